@@ -569,12 +569,190 @@ var update = function() {
   d3.select(".ev-bar-gop-total").text(gopTotal);
 }
 
+/* Content-hashed names of the published data files. Only this is revalidated. */
+var manifest = d3.json('data/manifest.json', {cache: 'no-cache'}).catch(() => ({}));
+
+/* Fetch a data file by its published name, if it has one, preferring the binary
+   version of a topology when it's been published too */
+var fetchData = function(file) {
+  return manifest.then(function(names) {
+    var slash = file.lastIndexOf('/') + 1;
+    var name = file.substring(slash);
+    var binaryName = name.replace(/\.json$/, '.bin');
+    if (binaryName !== name && binaryName in names) {
+      return d3.buffer(file.substring(0, slash) + names[binaryName]).then(decodeTopology);
+    }
+    return d3.json(name in names ? file.substring(0, slash) + names[name] : file);
+  });
+}
+
+/* Decode a binary topology (see redraw/binary.py) into the usual TopoJSON */
+var decodeTopology = function(buffer) {
+  var headerLength = new DataView(buffer).getUint32(8, true);
+  var header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 12, headerLength)));
+  var types = {u1: Uint8Array, i1: Int8Array, u2: Uint16Array, i2: Int16Array,
+               u4: Uint32Array, i4: Int32Array, f8: Float64Array};
+  var column = function(name) {
+    var [dtype, offset, length] = header.buffers[name];
+    return new types[dtype](buffer, 12 + headerLength + offset, length);
+  };
+
+  var lengths = column('arc_lengths'), starts = column('arc_starts'), deltas = column('arc_deltas');
+  var arcs = new Array(lengths.length);
+  for (var i=0, k=0; i<lengths.length; ++i) {
+    var arc = arcs[i] = new Array(lengths[i]);
+    arc[0] = [starts[2 * i], starts[2 * i + 1]];
+    for (var j=1; j<arc.length; ++j, k+=2) {
+      arc[j] = [deltas[k], deltas[k + 1]];
+    }
+  }
+  var topology = Object.assign({}, header.topology, {arcs: arcs});
+  if (header.object === null) {
+    return topology;
+  }
+
+  var geometryTypes = column('geometry_types'), polygonCounts = column('geometry_polygons');
+  var ringCounts = column('polygon_rings'), arcCounts = column('ring_arcs'), refs = column('arc_refs');
+  var properties = header.properties.map((p, i) => [p.name, p.values, column('property_' + i)]);
+  var geometries = [];
+  for (var i=0, p=0, r=0, a=0; i<geometryTypes.length; ++i) {
+    var polygons = new Array(polygonCounts[i]);
+    for (var j=0; j<polygons.length; ++j, ++p) {
+      var polygon = polygons[j] = new Array(ringCounts[p]);
+      for (var l=0; l<polygon.length; ++l, ++r) {
+        var ring = polygon[l] = new Array(arcCounts[r]);
+        for (var m=0; m<ring.length; ++m) {
+          ring[m] = refs[a++];
+        }
+      }
+    }
+    var geom = {type: [null, 'Polygon', 'MultiPolygon'][geometryTypes[i]]};
+    if (geom.type) {
+      geom.arcs = geom.type === 'Polygon' ? polygons[0] : polygons;
+    }
+    geom.properties = {};
+    for (var [name, values, col] of properties) {
+      var value = values ? values[col[i]] : col[i];
+      geom.properties[name] = value !== value ? null : value;
+    }
+    geometries.push(geom);
+  }
+  topology.objects = {[header.object]: {type: 'GeometryCollection', geometries: geometries}};
+  return topology;
+}
+
+/* Geometry shared between years with the same county boundaries, by file */
+var geometryData = {};
+
+var loadGeometry = function(geometryFile) {
+  if (!(geometryFile in geometryData)) {
+    var dir = geometryFile.substring(0, geometryFile.lastIndexOf('/') + 1);
+    geometryData[geometryFile] = fetchData(geometryFile).then(function(geometry) {
+      // The geometry file has the coarsest arcs. Finer levels of detail share its
+      // arc numbering and are only fetched once someone zooms in far enough.
+      var coarsest = geometry.arcs;
+      (geometry.levels || []).forEach(function(level) {
+        level.load = function() {
+          if (!level.file) {
+            return Promise.resolve(coarsest);
+          }
+          if (!level.arcs) {
+            level.arcs = fetchData(dir + level.file).then(d => d.arcs).catch(function() {
+              level.arcs = null;
+              return null;
+            });
+          }
+          return level.arcs;
+        };
+      });
+      return geometry;
+    }).catch(function(error) {
+      delete geometryData[geometryFile];
+      throw error;
+    });
+  }
+  return geometryData[geometryFile];
+}
+
+/* Swap in the finest level of detail that applies at zoom k */
+var zoomK = 1;
+
+var levelForZoom = function(levels, k) {
+  return levels.filter(level => k >= level.zoom).pop() || levels[0];
+}
+
+var setDetail = function(k) {
+  zoomK = k;
+  if (!us || !us.levels) {
+    return;
+  }
+  var current = us;
+  var level = levelForZoom(current.levels, k);
+  level.load().then(function(arcs) {
+    // Skip it if we've moved on since
+    if (!arcs || us !== current || current.arcs === arcs ||
+        levelForZoom(current.levels, zoomK) !== level) {
+      return;
+    }
+    current.arcs = arcs;
+
+    // Only the shapes change, so keep the paths (and what's selected) as they are
+    var features = topojson.feature(current, current.objects.counties).features;
+    g.selectAll("path.county-path")
+      .each((d, i) => d.geometry = features[i].geometry)
+      .attr("d", path);
+    g.selectAll("path.state-boundary")
+      .attr("d", d => path(topojson.merge(current, d[1])));
+  });
+}
+
+/* Build a year's data from its attributes and its boundaries' shared geometry */
+var loadSplit = function(dataFile) {
+  var attributesFile = dataFile.replace(/\.json$/, '.attributes.json');
+  var dir = dataFile.substring(0, dataFile.lastIndexOf('/') + 1);
+  return fetchData(attributesFile).then(function(attributes) {
+    return loadGeometry(dir + attributes.geometry).then(function(geometry) {
+      var row = {};
+      for (var i=0; i<attributes.ids.length; ++i) {
+        row[attributes.ids[i]] = i;
+      }
+      var columns = Object.keys(attributes.properties);
+
+      // Each year gets its own properties, as moving counties changes them, but
+      // the arcs are shared. Counties without attributes are left off, just as
+      // they are in the single file version.
+      var geometries = [];
+      geometry.objects.counties.geometries.forEach(function(geom) {
+        var i = row[geom.properties.id];
+        if (i === undefined) {
+          return;
+        }
+        var properties = {id: geom.properties.id};
+        columns.forEach(column => properties[column] = attributes.properties[column][i]);
+        geometries.push({type: geom.type, arcs: geom.arcs, properties: properties});
+      });
+
+      return Object.assign({}, geometry, {
+        objects: {counties: {type: 'GeometryCollection', geometries: geometries}}
+      });
+    });
+  });
+}
+
 /* Read data once! */
 var reset = function(dataFile, useUrl) {
   if (dataFile in data) {
     execReset(data[dataFile], useUrl);
   } else {
-    d3.json(dataFile).then(function(usData) {
+    // Older deployments only have a single file per year
+    loadSplit(dataFile).catch(function() {
+      return fetchData(dataFile).then(function(usData) {
+        // Share codes list counties in order of id. Newer data files are written in
+        // that order already, so this is only slow for older ones, and only once.
+        usData.objects.counties.geometries.sort((x, y) => parseInt(x.properties.id) - parseInt(y.properties.id));
+        return usData;
+      });
+    }).then(function(usData) {
       data[dataFile] = usData;
       execReset(usData, useUrl);
     });
@@ -599,8 +777,6 @@ var execReset = function(usData, useUrl) {
   if (useUrl) {
     var shareParameter = getParameterByName('share');
     if (shareParameter) {
-      us.objects.counties.geometries.sort((x, y) => parseInt(x.properties.id) - parseInt(y.properties.id))
-
       var newShareParameter = [];
       var curNumber = '';
       for (var i = 0; i < shareParameter.length; ++i) {
@@ -647,6 +823,7 @@ var execReset = function(usData, useUrl) {
   }
 
   update();
+  setDetail(zoomK);
 }
 
 reset(dataFile, true);
@@ -656,8 +833,6 @@ reset(dataFile, true);
 
 /* Turn map into URL */
 var getShareUrl = function() {
-  us.objects.counties.geometries.sort((x, y) => parseInt(x.properties.id) - parseInt(y.properties.id));
-
   shareUrl = [];
   var curLetter = null;
   var curStreak = 0;
@@ -719,6 +894,7 @@ d3.select("#selectYear").on("change", function(ev) {
 
 var zoomed = function({transform}) {
   g.attr("transform", transform)
+  setDetail(transform.k);
   if (transform.k >= 5) {
     g.classed('wide-zoom-stroke', false).classed('close-zoom-stroke', true);
   } else {
@@ -0,0 +1,164 @@
+"""
+Which counties touch which. Every build writes an adjacency index next to its
+data file so that anything asking "which counties can move where" can look it
+up rather than recompute it from geometry.
+
+The index is in CSR form over counties sorted by integer id, the same order share
+codes use: the neighbors of the county at position i are
+`indices[indptr[i]:indptr[i + 1]]`.
+"""
+
+import json
+from dataclasses import dataclass
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import shapely
+
+from .electors import NO_STATE
+from .share import share_order
+
+
+@dataclass(frozen=True)
+class Adjacency:
+    ids: np.ndarray  # (num_counties,) FIPS sorted by integer value
+    indptr: np.ndarray  # (num_counties + 1,)
+    indices: np.ndarray  # (num_edges,) positions of neighbors, both directions
+    border: np.ndarray  # (num_counties,) whether a county touches another state
+
+    def neighbors(self, county: int) -> np.ndarray:
+        return self.indices[self.indptr[county] : self.indptr[county + 1]]
+
+
+def adjacency_filename(filename: str) -> str:
+    """
+    Where the adjacency index for the data file `filename` lives, e.g.,
+    us2024.json -> us2024.adjacency.json
+    """
+    path = Path(filename)
+    return str(path.with_name(f"{path.stem}.adjacency.json"))
+
+
+def _to_csr(
+    left: np.ndarray, right: np.ndarray, num_nodes: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Symmetrize and deduplicate an edge list and convert it to CSR arrays
+    """
+    keys = np.unique(
+        np.concatenate([left * num_nodes + right, right * num_nodes + left])
+    )
+    sources, indices = np.divmod(keys, num_nodes)
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(sources, minlength=num_nodes))])
+    return indptr, indices
+
+
+def _border(indptr: np.ndarray, indices: np.ndarray, states: np.ndarray) -> np.ndarray:
+    sources = np.repeat(np.arange(len(states)), np.diff(indptr))
+    crossing = states[sources] != states[indices]
+    return np.bincount(sources[crossing], minlength=len(states)) > 0
+
+
+def from_geometry(gdf: gpd.GeoDataFrame) -> Adjacency:
+    """
+    Build the index from a GeoDataFrame with "id", "state" and geometry columns.
+    Candidate pairs come from the spatial index in one bulk query, and only pairs
+    that share a stretch of border (or overlap) rather than a single point count
+    as touching.
+    """
+    gdf = gdf.iloc[share_order(gdf["id"])]
+    geometries = np.asarray(gdf.geometry.values)
+
+    left, right = gdf.sindex.query(geometries, predicate="intersects")
+    keep = left < right
+    left, right = left[keep], right[keep]
+
+    # The DE-9IM matrix says whether the interiors overlap or the boundaries meet
+    # along a line
+    relations = shapely.relate(geometries[left], geometries[right])
+    shares_border = np.array(
+        [relation[0] == "2" or relation[4] == "1" for relation in relations],
+        dtype=bool,
+    )
+    left, right = left[shares_border], right[shares_border]
+
+    indptr, indices = _to_csr(left, right, len(gdf))
+    states = gdf["state"].to_numpy()
+    return Adjacency(
+        ids=gdf["id"].to_numpy(),
+        indptr=indptr,
+        indices=indices,
+        border=_border(indptr, indices, states),
+    )
+
+
+def _geometry_arcs(geometry: dict) -> list[int]:
+    """
+    The indices of all arcs a topojson geometry uses, regardless of direction
+    """
+    if geometry["type"] == "Polygon":
+        rings = geometry["arcs"]
+    elif geometry["type"] == "MultiPolygon":
+        rings = [ring for polygon in geometry["arcs"] for ring in polygon]
+    else:
+        return []
+    return [arc if arc >= 0 else ~arc for ring in rings for arc in ring]
+
+
+def from_topology(geometries: list[dict], states: np.ndarray) -> Adjacency:
+    """
+    Build the index from topojson geometries, which must already be in share code
+    order, using the arcs they share. This is a fallback for data files built
+    before adjacency indices were written.
+
+    Args:
+        geometries: Topojson geometries
+        states: The state index of each geometry
+    """
+    arcs = [
+        np.asarray(_geometry_arcs(geometry), dtype=np.int64) for geometry in geometries
+    ]
+    owners = np.repeat(np.arange(len(geometries)), [len(a) for a in arcs])
+    arcs = np.concatenate(arcs) if arcs else np.empty(0, dtype=np.int64)
+
+    order = np.lexsort((owners, arcs))
+    arcs, owners = arcs[order], owners[order]
+
+    # Consecutive owners of the same arc touch
+    shared = (arcs[1:] == arcs[:-1]) & (owners[1:] != owners[:-1])
+    indptr, indices = _to_csr(owners[:-1][shared], owners[1:][shared], len(geometries))
+    return Adjacency(
+        ids=np.array([g.get("properties", {}).get("id", "") for g in geometries]),
+        indptr=indptr,
+        indices=indices,
+        border=_border(indptr, indices, np.asarray(states)) & (states != NO_STATE),
+    )
+
+
+def write(adjacency: Adjacency, filename: str):
+    """
+    Write an adjacency index as compact JSON
+    """
+    with open(filename, "w") as outfile:
+        json.dump(
+            {
+                "ids": adjacency.ids.tolist(),
+                "indptr": adjacency.indptr.tolist(),
+                "indices": adjacency.indices.tolist(),
+                "border": adjacency.border.astype(int).tolist(),
+            },
+            outfile,
+            separators=(",", ":"),
+        )
+
+
+def read(filename: str) -> Adjacency:
+    with open(filename) as infile:
+        raw = json.load(infile)
+    return Adjacency(
+        ids=np.array(raw["ids"]),
+        indptr=np.array(raw["indptr"], dtype=np.int64),
+        indices=np.array(raw["indices"], dtype=np.int64),
+        border=np.array(raw["border"], dtype=bool),
+    )
@@ -0,0 +1,158 @@
+"""
+Publishing the files the map fetches for static serving. Each file is copied to
+a content-hashed name (e.g., us2024.json -> us2024.1f3b9c0e7d2a.json) alongside
+gzip and brotli variants at maximum compression, and a small manifest in the
+same directory maps each logical name to its current hashed name. Everything but
+the manifest can then be cached forever, and nothing needs to be compressed at
+request time.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import brotli
+
+MANIFEST = "manifest.json"
+
+# The hashed names the last build replaced, which the next build removes
+RETIRED = "retired.json"
+
+# The precompressed variants written next to every hashed file
+SUFFIXES = [".gz", ".br"]
+
+# The number of hex digits of the SHA-256 to put in a filename
+HASH_LENGTH = 12
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+
+
+def hashed_filename(filename: str, digest: str) -> str:
+    """
+    E.g., hashed_filename("data/us2024.json", "abc") -> "data/us2024.abc.json"
+    """
+    path = Path(filename)
+    return str(path.with_name(f"{path.stem}.{digest}{path.suffix}"))
+
+
+def compress(data: bytes) -> dict[str, bytes]:
+    """
+    The precompressed variants of `data`, keyed by the suffix to give them.
+    The gzip header has no timestamp, so the output only depends on `data`.
+    """
+    return {
+        ".gz": gzip.compress(data, compresslevel=9, mtime=0),
+        ".br": brotli.compress(data, quality=11),
+    }
+
+
+def _variant(path: Path, suffix: str) -> Path:
+    return path.with_name(path.name + suffix)
+
+
+def _write_bytes(path: Path, data: bytes):
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+
+def publish(filename: str) -> str:
+    """
+    Write the hashed copy of `filename` and its precompressed variants. As the
+    names are content addressed, anything already written is left alone.
+
+    Returns:
+        The name (not path) of the hashed copy
+    """
+    data = Path(filename).read_bytes()
+    path = Path(hashed_filename(filename, content_hash(data)))
+    if all(_variant(path, suffix).exists() for suffix in ["", *SUFFIXES]):
+        return path.name
+
+    for suffix, variant in compress(data).items():
+        _write_bytes(_variant(path, suffix), variant)
+    _write_bytes(path, data)
+    return path.name
+
+
+def manifest_filename(directory: str | Path) -> Path:
+    return Path(directory) / MANIFEST
+
+
+def read_manifest(directory: str | Path) -> dict[str, str]:
+    """
+    The manifest of `directory`, mapping logical names to hashed names
+    """
+    try:
+        with open(manifest_filename(directory)) as infile:
+            return json.load(infile)
+    except FileNotFoundError:
+        return {}
+
+
+def update_manifest(directory: str | Path, entries: dict[str, str]) -> list[str]:
+    """
+    Point the logical names in `entries` at new hashed names.
+
+    Returns:
+        The hashed names which are no longer in the manifest
+    """
+    manifest = read_manifest(directory)
+    replaced = [
+        manifest[name]
+        for name, hashed in entries.items()
+        if name in manifest and manifest[name] != hashed
+    ]
+    manifest.update(entries)
+    _write_bytes(
+        manifest_filename(directory),
+        json.dumps(manifest, indent=2, sort_keys=True).encode(),
+    )
+    return [name for name in replaced if name not in manifest.values()]
+
+
+def remove(directory: str | Path, names: list[str]):
+    """
+    Delete hashed copies, and their variants, which are no longer published
+    """
+    for name in names:
+        for suffix in ["", *SUFFIXES]:
+            _variant(Path(directory) / name, suffix).unlink(missing_ok=True)
+
+
+def retire(directory: str | Path, replaced: list[str]):
+    """
+    Remove the hashed copies the previous build replaced, and remember the ones
+    this build `replaced` for the next one to remove. Like `watch`, this keeps
+    superseded copies for one more cycle, so pages which read the old manifest can
+    still load them.
+    """
+    path = Path(directory) / RETIRED
+    try:
+        with open(path) as infile:
+            previous = json.load(infile)
+    except (FileNotFoundError, json.JSONDecodeError):
+        previous = []
+
+    live = set(read_manifest(directory).values())
+    remove(directory, [name for name in previous if name not in live])
+    _write_bytes(
+        path,
+        json.dumps(
+            sorted({name for name in replaced if name not in live}), indent=2
+        ).encode(),
+    )
+
+
+def publish_all(filenames: list[str]) -> dict[str, str]:
+    """
+    Publish many files at once.
+
+    Returns:
+        Manifest entries for them, mapping their names to their hashed names
+    """
+    return {Path(filename).name: publish(filename) for filename in filenames}
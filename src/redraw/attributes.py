@@ -0,0 +1,138 @@
+"""
+Splitting a data file into geometry and attributes. County geometry only changes
+with the boundary vintage (e.g., 2020 and 2024 both draw 2019 boundaries), so
+each vintage's geometry is written once, as a topojson whose only property is the
+county id, and each year gets a small columnar attribute file with its votes,
+populations and names in share code order. The map joins the two by id.
+
+The geometry comes in several levels of detail which share the same arc
+numbering. The geometry file holds the coarsest, for the national view, and
+lists the zoom from which each finer level applies. Finer levels are files with
+only arcs, which the map swaps in as you zoom.
+"""
+
+import json
+from pathlib import Path
+
+import geopandas as gpd
+import pandas as pd
+
+from . import binary, profiling, topology
+from .share import share_order
+
+# The zoom from which each level of detail applies and the minimum weight (see
+# `topology.gdf_to_topology`) it simplifies to. At 1x a pixel of the map covers
+# about 1e-6 steradians, and areas on screen grow with the square of the zoom.
+# The middle level matches the single level data files.
+LEVELS = [(1, 1e-6), (3, topology.MIN_WEIGHT), (8, 1.5e-8)]
+
+
+def geometry_filename(filename: str, vintage: int) -> str:
+    """
+    Where the geometry for boundary vintage `vintage` lives, next to the data file
+    `filename`, e.g., us2024.json -> counties-2019.json
+    """
+    return str(Path(filename).with_name(f"counties-{vintage}.json"))
+
+
+def level_filename(filename: str, zoom: int) -> str:
+    """
+    Where the arcs for the level of detail starting at `zoom` live for the
+    geometry file `filename`, e.g., counties-2019.json -> counties-2019.z3.json
+    """
+    path = Path(filename)
+    return str(path.with_name(f"{path.stem}.z{zoom}{path.suffix}"))
+
+
+def attributes_filename(filename: str) -> str:
+    """
+    Where the attributes for the data file `filename` live, e.g.,
+    us2024.json -> us2024.attributes.json
+    """
+    path = Path(filename)
+    return str(path.with_name(f"{path.stem}.attributes.json"))
+
+
+def write_geometry(
+    gdf: gpd.GeoDataFrame, filename: str, write_binary: bool = False
+) -> list[str]:
+    """
+    Write the geometry of `gdf` in share code order with only its ids as
+    properties, along with its finer levels of detail. If `write_binary` is set,
+    every file is also written in our binary format (see `binary`).
+
+    Returns:
+        The filenames written, the geometry file first
+    """
+    gdf = gdf.iloc[share_order(gdf["id"])]
+    with profiling.stage("topojson"):
+        base, *details = topology.gdf_to_levels(
+            gdf[["id", gdf.geometry.name]], [weight for _, weight in LEVELS]
+        )
+        # Every level's arcs, as that's what we write
+        profiling.count(
+            rows_in=len(gdf),
+            vertices_in=profiling.num_vertices(gdf),
+            rows_out=len(gdf),
+            vertices_out=sum(
+                profiling.num_arc_points(level) for level in [base, *details]
+            ),
+        )
+
+    filenames = [level_filename(filename, zoom) for zoom, _ in LEVELS[1:]]
+    base["levels"] = [{"zoom": LEVELS[0][0]}] + [
+        {"zoom": zoom, "file": Path(level_file).name}
+        for (zoom, _), level_file in zip(LEVELS[1:], filenames)
+    ]
+    levels = [base] + [{"arcs": level["arcs"]} for level in details]
+    filenames = [filename] + filenames
+    for level, level_file in zip(levels, filenames):
+        topology.write_topology(level, level_file)
+        if write_binary:
+            binary.write(level, binary.binary_filename(level_file))
+
+    if write_binary:
+        filenames += [binary.binary_filename(level_file) for level_file in filenames]
+    return filenames
+
+
+def write(df: pd.DataFrame, filename: str, geometry: str):
+    """
+    Write every non-geometry column of `df` as compact, columnar JSON.
+
+    Args:
+        df: The final table a build writes
+        filename: Where to write the attributes
+        geometry: The geometry file to join them to, relative to `filename`
+    """
+    df = df.iloc[share_order(df["id"])]
+    if isinstance(df, gpd.GeoDataFrame):
+        df = pd.DataFrame(df.drop(columns=df.geometry.name))
+    # Leave out the id, and anything that only repeats it (e.g., "fips")
+    columns = [
+        column
+        for column in df.columns
+        if column != "id" and not df[column].astype(str).equals(df["id"].astype(str))
+    ]
+
+    with open(filename, "w") as outfile:
+        json.dump(
+            {
+                "geometry": geometry,
+                "ids": df["id"].tolist(),
+                "properties": {
+                    column: [
+                        None if pd.isna(value) else value
+                        for value in df[column].tolist()
+                    ]
+                    for column in columns
+                },
+            },
+            outfile,
+            separators=(",", ":"),
+        )
+
+
+def read(filename: str) -> dict:
+    with open(filename) as infile:
+        return json.load(infile)
@@ -0,0 +1,326 @@
+"""
+Benchmarks for each stage of a build, run against the small fixtures in
+redraw/resources/bench so that they need no network:
+
+    * counties.zip: Census style county boundaries for CO, CT, DC, SD and VA
+    * nyt2016.json, nyt2020.json, nyt2024.json: NYT payloads for those states,
+      trimmed to the fields we read
+    * mit.csv: a synthetic slice of the MIT county returns
+    * census2020.json, census2020_ct_tracts.json: Census API responses
+
+Each stage is timed over several repeats and then run once more under
+tracemalloc for its peak memory (Python and NumPy allocations). Results record
+the commit, the library versions and a hash of the fixtures, so runs on
+different commits can be compared with `compare`.
+"""
+
+import gc
+import hashlib
+import importlib.metadata
+import importlib.resources
+import json
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+import geopandas as gpd
+import pandas as pd
+
+from . import cache, mit, nyt, nyt2016, nyt2024, population, rules, shared
+
+# The election and boundary years the fixtures are shaped like
+MIT_YEAR = 2012
+BOUNDARY_YEAR = 2019
+POPULATION_YEAR = 2024
+
+# Libraries whose versions affect the results
+LIBRARIES = ["numpy", "pandas", "geopandas", "shapely", "pyogrio", "pyarrow"]
+
+
+def fixture_path(name: str) -> Path:
+    return Path(str(importlib.resources.files("redraw.resources") / "bench" / name))
+
+
+def _read_json(name: str):
+    with open(fixture_path(name)) as infile:
+        return json.load(infile)
+
+
+def _payloads(name: str) -> dict[str, bytes]:
+    """
+    Each state's payload in a fixture as the bytes the NYT would send
+    """
+    return {abbr: json.dumps(data).encode() for abbr, data in _read_json(name).items()}
+
+
+def _coverage() -> list[bytes]:
+    """
+    The 2016 fixture embedded in a page like the NYT's coverage, in download sized
+    chunks
+    """
+    with open(fixture_path("nyt2016.json"), "rb") as infile:
+        races = infile.read()
+    page = b"<html><script>\n" + nyt2016.RACES_MARKER + races + b";\n</script></html>"
+    return [
+        page[start : start + cache.CHUNK_SIZE]
+        for start in range(0, len(page), cache.CHUNK_SIZE)
+    ]
+
+
+def _boundaries() -> gpd.GeoDataFrame:
+    gdf = gpd.read_file(fixture_path("counties.zip"))
+    return gdf.rename(columns={"GEOID": "id", "NAME": "name"})[
+        ["id", "name", "geometry"]
+    ]
+
+
+def _flattened() -> gpd.GeoDataFrame:
+    return shared.flatten_counties(_boundaries(), BOUNDARY_YEAR)
+
+
+def _census_responses() -> dict:
+    counties, ct_tracts = population.queries_for(POPULATION_YEAR)
+    responses = {}
+    for query, name in [
+        (counties, "census2020.json"),
+        (ct_tracts, "census2020_ct_tracts.json"),
+    ]:
+        rows = _read_json(name)
+        responses[query] = pd.DataFrame(rows[1:], columns=rows[0])
+    return responses
+
+
+def _populations(responses: dict) -> pd.DataFrame:
+    """
+    What `population.fetch_panel` and `build_all` do to the Census responses
+    """
+    df = population._assemble(POPULATION_YEAR, responses)
+    df = pd.DataFrame(
+        {
+            "id": df["state"] + df["county"],
+            "population": df["population"].astype(int),
+        }
+    )
+    return rules.apply_to_frame(df, POPULATION_YEAR, id_col="id", values=["population"])
+
+
+def _merged() -> gpd.GeoDataFrame:
+    parsed = nyt2024.parse_data(_read_json("nyt2024.json"))
+    return nyt2024.merge_data(parsed, _flattened()).merge(
+        _populations(_census_responses()), on="id"
+    )
+
+
+def _topojson(gdf: gpd.GeoDataFrame):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        shared.gdf_to_topojson(gdf, str(Path(tmpdir) / "bench.json"))
+
+
+@dataclass(frozen=True)
+class Stage:
+    """
+    A stage to benchmark. `setup` builds its inputs, which aren't timed, and
+    `run` is called with them.
+    """
+
+    name: str
+    setup: Callable[[], tuple]
+    run: Callable[..., Any]
+
+
+STAGES = [
+    Stage(
+        "nyt2016.extract_races",
+        lambda: (_coverage(),),
+        lambda chunks: b"".join(nyt2016.extract_races(chunks)),
+    ),
+    Stage(
+        "nyt2016.parse_data",
+        lambda: (_read_json("nyt2016.json"),),
+        nyt2016.parse_data,
+    ),
+    Stage("nyt.parse_data", lambda: (_payloads("nyt2020.json"),), nyt.parse_data),
+    Stage(
+        "nyt2024.parse_data",
+        lambda: (_payloads("nyt2024.json"),),
+        nyt2024.parse_data,
+    ),
+    Stage(
+        "mit.read_data",
+        lambda: (str(fixture_path("mit.csv")), MIT_YEAR),
+        mit.read_data,
+    ),
+    Stage(
+        "mit.parse_data",
+        lambda: (mit.read_data(str(fixture_path("mit.csv")), MIT_YEAR),),
+        mit.parse_data,
+    ),
+    Stage(
+        "shared.flatten_counties",
+        lambda: (_boundaries(),),
+        lambda gdf: shared.flatten_counties(gdf.copy(), BOUNDARY_YEAR),
+    ),
+    Stage(
+        "nyt.merge_data",
+        lambda: (nyt.parse_data(_read_json("nyt2020.json")), _flattened()),
+        nyt.merge_data,
+    ),
+    Stage(
+        "nyt2024.merge_data",
+        lambda: (nyt2024.parse_data(_read_json("nyt2024.json")), _flattened()),
+        nyt2024.merge_data,
+    ),
+    Stage(
+        "mit.merge_data",
+        lambda: (
+            mit.parse_data(mit.read_data(str(fixture_path("mit.csv")), MIT_YEAR)),
+            _flattened(),
+        ),
+        mit.merge_data,
+    ),
+    Stage("population", lambda: (_census_responses(),), _populations),
+    Stage("shared.gdf_to_topojson", lambda: (_merged(),), _topojson),
+]
+
+
+@dataclass(frozen=True)
+class Measurement:
+    stage: str
+    repeats: int
+    median: float  # Seconds
+    min: float  # Seconds
+    max: float  # Seconds
+    peak_memory: int  # Bytes allocated at peak while the stage ran
+
+
+def measure(stage: Stage, repeats: int = 5) -> Measurement:
+    """
+    Time `stage` over `repeats` runs, then run it once more for its peak memory
+    """
+    args = stage.setup()
+    stage.run(*args)  # Warm up imports and caches
+
+    times = []
+    for _ in range(repeats):
+        gc.collect()
+        start = time.perf_counter()
+        stage.run(*args)
+        times.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        stage.run(*args)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return Measurement(
+        stage=stage.name,
+        repeats=repeats,
+        median=statistics.median(times),
+        min=min(times),
+        max=max(times),
+        peak_memory=peak_memory,
+    )
+
+
+def fixtures_hash() -> str:
+    """
+    A hash of every fixture, so we only compare runs on the same inputs
+    """
+    digest = hashlib.sha256()
+    for path in sorted(fixture_path("").iterdir()):
+        digest.update(path.name.encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _version(library: str) -> Optional[str]:
+    try:
+        return importlib.metadata.version(library)
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+def run(
+    names: Optional[list[str]] = None,
+    repeats: int = 5,
+    callback: Optional[Callable[[Measurement], None]] = None,
+) -> dict:
+    """
+    Run the benchmarks.
+
+    Args:
+        names: The stages to run. Defaults to all of them
+        repeats: How many timed runs of each stage to make
+        callback: Called with each measurement as it's made
+
+    Returns:
+        The results as a JSON-serializable dict
+    """
+    measurements = []
+    for stage in STAGES:
+        if names and stage.name not in names:
+            continue
+        measurement = measure(stage, repeats=repeats)
+        if callback:
+            callback(measurement)
+        measurements.append(measurement)
+
+    return {
+        "commit": _commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "libraries": {library: _version(library) for library in LIBRARIES},
+        "fixtures": fixtures_hash(),
+        "stages": [asdict(measurement) for measurement in measurements],
+    }
+
+
+def compare(old: dict, new: dict) -> list[tuple[str, float, float, float, float]]:
+    """
+    Compare the stages two runs have in common.
+
+    Returns:
+        Tuples of (stage, old median, new median, old peak memory, new peak
+            memory)
+
+    Raises:
+        ValueError: If the runs used different fixtures
+    """
+    if old["fixtures"] != new["fixtures"]:
+        raise ValueError("These runs used different fixtures and can't be compared")
+
+    old_stages = {stage["stage"]: stage for stage in old["stages"]}
+    return [
+        (
+            stage["stage"],
+            old_stages[stage["stage"]]["median"],
+            stage["median"],
+            old_stages[stage["stage"]]["peak_memory"],
+            stage["peak_memory"],
+        )
+        for stage in new["stages"]
+        if stage["stage"] in old_stages
+    ]
@@ -0,0 +1,240 @@
+"""
+A compact binary encoding of the topologies we write, which the browser can use
+without parsing any JSON beyond a small header. See `decodeTopology` in map.js.
+
+A file is the magic bytes "RDTB", a little endian u32 version and a u32 header
+length, then a JSON header and then a body of buffers. Every buffer starts on an
+8 byte boundary of the file, so each can be viewed as a typed array in place:
+
+    * arc_lengths: the number of points in each arc
+    * arc_starts: the quantized (x, y) of the first point of each arc, interleaved
+    * arc_deltas: the delta encoded (x, y) of every other point, interleaved.
+      These are small, so they usually fit in 16 bits.
+    * geometry_types: 0 for null, 1 for Polygon and 2 for MultiPolygon
+    * geometry_polygons, polygon_rings, ring_arcs: how many polygons each
+      geometry has, how many rings each polygon has and how many arcs each ring
+      has
+    * arc_refs: the arcs of every ring, with ~i meaning arc i reversed
+    * one fixed width column per property. Numbers are stored as is (NaN means
+      null in float columns). Anything else is stored as indices into a list of
+      values in the header.
+
+Integers get the smallest type that holds them. The header holds everything
+else in the topology (bbox, transform, levels, ...), where each buffer is and
+the name of the object the geometries belong to.
+"""
+
+import json
+import math
+import struct
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+MAGIC = b"RDTB"
+VERSION = 1
+
+# The typed arrays the map can view buffers as, in order of preference
+_INT_TYPES = ["u1", "i1", "u2", "i2", "u4", "i4"]
+
+_GEOMETRY_TYPES = [None, "Polygon", "MultiPolygon"]
+
+
+def binary_filename(filename: str) -> str:
+    """
+    Where the binary version of the topojson `filename` lives, e.g.,
+    us2024.json -> us2024.bin
+    """
+    return str(Path(filename).with_suffix(".bin"))
+
+
+def _int_array(values) -> np.ndarray:
+    """
+    `values` as the smallest little endian integer type which holds them all
+    """
+    values = np.asarray(values, dtype=np.int64)
+    low, high = (values.min(), values.max()) if len(values) else (0, 0)
+    for code in _INT_TYPES:
+        info = np.iinfo(code)
+        if info.min <= low and high <= info.max:
+            return values.astype(f"<{code}")
+    raise ValueError(f"Values in [{low}, {high}] don't fit in 32 bits")
+
+
+def _is_int(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _property_column(values: list) -> tuple[np.ndarray, Optional[list]]:
+    """
+    Encode one property as a fixed width column, and the list of values its
+    entries index into if it isn't numeric
+    """
+    present = [value for value in values if value is not None]
+    if present and all(_is_int(value) for value in present):
+        if len(present) == len(values):
+            return _int_array(values), None
+        return np.array([math.nan if v is None else v for v in values], "<f8"), None
+    if present and all(_is_int(v) or isinstance(v, float) for v in present):
+        return np.array([math.nan if v is None else v for v in values], "<f8"), None
+
+    lookup: dict = {}
+    indices = [lookup.setdefault(value, len(lookup)) for value in values]
+    return _int_array(indices), list(lookup)
+
+
+def _ring_lists(geometry: dict) -> list[list[list[int]]]:
+    if geometry.get("type") == "Polygon":
+        return [geometry["arcs"]]
+    if geometry.get("type") == "MultiPolygon":
+        return geometry["arcs"]
+    return []
+
+
+def encode(topology: dict) -> bytes:
+    """
+    Encode a topology as produced by `topology.gdf_to_topology`. It may have at
+    most one object, which must be a GeometryCollection of Polygons and
+    MultiPolygons, or no objects at all.
+    """
+    arcs = topology["arcs"]
+    buffers = {
+        "arc_lengths": _int_array([len(arc) for arc in arcs]),
+        "arc_starts": _int_array([coord for arc in arcs for coord in arc[0]]),
+        "arc_deltas": _int_array(
+            [coord for arc in arcs for point in arc[1:] for coord in point]
+        ),
+    }
+
+    objects = topology.get("objects", {})
+    if len(objects) > 1:
+        raise ValueError("Only topologies with a single object can be encoded")
+    object_name = next(iter(objects), None)
+
+    properties = []
+    if object_name is not None:
+        geometries = objects[object_name]["geometries"]
+        polygons = [_ring_lists(geometry) for geometry in geometries]
+        rings = [ring for polygon in polygons for ring in polygon]
+        refs = [ref for polygon in rings for ring in polygon for ref in ring]
+        buffers.update(
+            geometry_types=_int_array(
+                [_GEOMETRY_TYPES.index(g.get("type")) for g in geometries]
+            ),
+            geometry_polygons=_int_array([len(polygon) for polygon in polygons]),
+            polygon_rings=_int_array([len(polygon) for polygon in rings]),
+            ring_arcs=_int_array([len(ring) for polygon in rings for ring in polygon]),
+            arc_refs=_int_array(refs),
+        )
+
+        names = list(
+            dict.fromkeys(key for g in geometries for key in g.get("properties", {}))
+        )
+        for i, name in enumerate(names):
+            column, values = _property_column(
+                [g.get("properties", {}).get(name) for g in geometries]
+            )
+            buffers[f"property_{i}"] = column
+            properties.append({"name": name, "values": values})
+
+    # Lay out the body
+    body = bytearray()
+    layout = {}
+    for name, array in buffers.items():
+        body.extend(b"\0" * (-len(body) % 8))
+        layout[name] = [array.dtype.str[1:], len(body), len(array)]
+        body.extend(array.tobytes())
+
+    header = {
+        "topology": {
+            key: value
+            for key, value in topology.items()
+            if key not in ("objects", "arcs")
+        },
+        "object": object_name,
+        "buffers": layout,
+        "properties": properties,
+    }
+    header_bytes = json.dumps(header, separators=(",", ":")).encode()
+    header_bytes += b" " * (-(len(header_bytes) + 12) % 8)
+    return MAGIC + struct.pack("<II", VERSION, len(header_bytes)) + header_bytes + body
+
+
+def decode(data: bytes) -> dict:
+    """
+    Decode a topology written by `encode`
+    """
+    if data[:4] != MAGIC:
+        raise ValueError("Not a binary topology")
+    version, header_length = struct.unpack_from("<II", data, 4)
+    if version != VERSION:
+        raise ValueError(f"Unsupported binary topology version {version}")
+    header = json.loads(data[12 : 12 + header_length])
+    body = 12 + header_length
+
+    def column(name: str) -> np.ndarray:
+        dtype, offset, length = header["buffers"][name]
+        return np.frombuffer(data, f"<{dtype}", length, body + offset)
+
+    starts = column("arc_starts").astype(np.int64).reshape(-1, 2).tolist()
+    deltas = column("arc_deltas").astype(np.int64).reshape(-1, 2).tolist()
+    bounds = np.cumsum(column("arc_lengths") - 1, dtype=np.int64).tolist()
+    arcs = [
+        [first] + deltas[start:end]
+        for first, start, end in zip(starts, [0] + bounds, bounds)
+    ]
+
+    topology = dict(header["topology"])
+    if header["object"] is None:
+        topology["arcs"] = arcs
+        return topology
+
+    num_polygons = column("geometry_polygons").tolist()
+    num_rings = iter(column("polygon_rings").tolist())
+    num_refs = iter(column("ring_arcs").tolist())
+    refs = column("arc_refs").tolist()
+
+    columns = []
+    for i, prop in enumerate(header["properties"]):
+        values = column(f"property_{i}")
+        if prop["values"] is not None:
+            values = [prop["values"][index] for index in values.tolist()]
+        else:
+            values = [None if v != v else v for v in values.tolist()]
+        columns.append((prop["name"], values))
+
+    geometries = []
+    position = 0
+    for i, type_code in enumerate(column("geometry_types").tolist()):
+        polygons = []
+        for _ in range(num_polygons[i]):
+            polygon = []
+            for _ in range(next(num_rings)):
+                count = next(num_refs)
+                polygon.append(refs[position : position + count])
+                position += count
+            polygons.append(polygon)
+
+        geometry_type = _GEOMETRY_TYPES[type_code]
+        geometry: dict = {"type": geometry_type}
+        if geometry_type == "Polygon":
+            geometry["arcs"] = polygons[0]
+        elif geometry_type == "MultiPolygon":
+            geometry["arcs"] = polygons
+        geometry["properties"] = {name: values[i] for name, values in columns}
+        geometries.append(geometry)
+
+    topology["objects"] = {
+        header["object"]: {"type": "GeometryCollection", "geometries": geometries}
+    }
+    topology["arcs"] = arcs
+    return topology
+
+
+def write(topology: dict, filename: str):
+    Path(filename).write_bytes(encode(topology))
+
+
+def read(filename: str) -> dict:
+    return decode(Path(filename).read_bytes())
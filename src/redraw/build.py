@@ -0,0 +1,471 @@
+"""
+Building the data files the map reads, either one year at a time or all at once
+"""
+
+import multiprocessing
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+import click
+import geopandas as gpd
+import pandas as pd
+
+from . import (
+    adjacency,
+    artifacts,
+    attributes,
+    binary,
+    mit,
+    nyt,
+    nyt2016,
+    nyt2024,
+    population,
+    profiling,
+    refetch,
+    results,
+    rules,
+    share,
+    shared,
+)
+
+SOURCES = {"mit": mit, "nyt2016": nyt2016, "nyt": nyt, "nyt2024": nyt2024}
+
+
+@dataclass(frozen=True)
+class Target:
+    """
+    Everything needed to build one of the files the map reads
+    """
+
+    source: str  # A key of SOURCES
+    year: int  # The election year
+    boundary_year: int  # The year of county boundaries to draw
+    # The year to pull populations for, which picks the Census to use (see
+    # `population.decennial_year`)
+    population_year: int
+    filename: str  # Where the map expects to find the output in public/data
+
+
+# Keyed by the `year` the javascript app uses
+TARGETS = {
+    "2004": Target("mit", 2004, 2004, 2004, "us2004.json"),
+    "2008": Target("mit", 2008, 2008, 2008, "us2008.json"),
+    "2012": Target("mit", 2012, 2012, 2012, "us2012.json"),
+    "2016": Target("nyt2016", 2016, 2016, 2016, "us.json"),
+    "2020": Target("nyt", 2020, 2019, 2020, "us2020.json"),
+    "2020s": Target("nyt", 2020, 2019, 2022, "us2020-new-pop.json"),
+    "2024": Target("nyt2024", 2024, 2019, 2022, "us2024.json"),
+}
+
+
+def boundary_vintage(year: int) -> int:
+    """
+    The earliest year whose boundaries `shared.get_county_boundaries(year)` would
+    return, so that years which share boundaries share the download
+    """
+    if year >= 2013:
+        return year
+    if year >= 2010:
+        return 2010
+    if year >= 2000:
+        return 2000
+    raise NotImplementedError("Can't currently handle pre-2000 dates")
+
+
+def load_boundaries(year: int) -> gpd.GeoDataFrame:
+    """
+    Pull and flatten the county boundaries for `year`. Note that the geometry
+    follows the county rules for the boundaries' year rather than the election's.
+    """
+    with profiling.stage(f"boundaries {year}"):
+        with profiling.stage("download"):
+            gdf = shared.get_county_boundaries(year)
+            profiling.count(rows_out=len(gdf), vertices_out=profiling.num_vertices(gdf))
+        with profiling.stage("flatten"):
+            flattened = shared.flatten_counties(gdf, year)
+            profiling.count(
+                rows_in=len(gdf),
+                vertices_in=profiling.num_vertices(gdf),
+                rows_out=len(flattened),
+                vertices_out=profiling.num_vertices(flattened),
+            )
+    return flattened
+
+
+def load_results(
+    source: str,
+    year: int,
+    mit_filename: Optional[str] = None,
+    force: bool = False,
+    max_connections: Optional[int] = None,
+) -> pd.DataFrame:
+    """
+    Pull and parse the election results for a source. Results from the NYT are
+    cached in CACHE_DIR (see `results.load_or_build`). With `force`, the 2020 and
+    2024 results are refetched state by state, and only the states which changed
+    are re-parsed (see `refetch.load_results`).
+
+    Args:
+        source: A key of SOURCES
+        year: The election year
+        mit_filename: The location of the MIT data set. Required for "mit"
+        force: Force redownloading NYT data
+        max_connections: The maximum number of connections to open to the NYT API.
+            Defaults to as many as it keeps up with (see `client`)
+
+    Returns:
+        A DataFrame with a column per field of the source module's CountyResult
+    """
+    with profiling.stage(f"results {source} {year}"):
+        df = _load_results(
+            source,
+            year,
+            mit_filename=mit_filename,
+            force=force,
+            max_connections=max_connections,
+        )
+        profiling.count(rows_out=len(df))
+    return df
+
+
+def _load_results(
+    source: str,
+    year: int,
+    mit_filename: Optional[str] = None,
+    force: bool = False,
+    max_connections: Optional[int] = None,
+) -> pd.DataFrame:
+    if source == "mit":
+        if mit_filename is None:
+            raise ValueError("The MIT data set is required to build MIT years")
+        return mit.parse_data(mit.read_data(mit_filename, year))
+
+    if source == "nyt2016":
+        df = results.load_or_build(
+            "nyt2016",
+            nyt2016,
+            lambda: nyt2016.parse_data(nyt2016.pull_data(force=force)),
+            force=force,
+        )
+    else:
+        df = refetch.load_results(
+            f"nyt{year}", SOURCES[source], force=force, max_connections=max_connections
+        )
+
+    return apply_rules(df, year)
+
+
+def apply_rules(df: pd.DataFrame, year: int) -> pd.DataFrame:
+    """
+    Apply the county rules for `year` to a table of NYT results
+    """
+    return rules.apply_to_frame(
+        df,
+        year,
+        id_col="fips",
+        values=[column for column in df.columns if column.endswith("_vote")],
+        keys=["state"],
+        name_col="county",
+    )
+
+
+def check_counties(gdf: gpd.GeoDataFrame, parsed: pd.DataFrame):
+    """
+    Make sure vote data and map data match
+    """
+    tjson_counties = set(gdf.id)
+    parsed_counties = set(parsed.fips)
+    assert len(tjson_counties - parsed_counties) == 0, (
+        f"{tjson_counties - parsed_counties}"
+    )
+    assert len(parsed_counties - tjson_counties) == 0, (
+        f"{parsed_counties - tjson_counties}"
+    )
+
+
+def assemble(
+    target: Target,
+    parsed: pd.DataFrame,
+    gdf: gpd.GeoDataFrame,
+    pop_df: pd.DataFrame,
+    filename: str,
+    write_binary: bool = False,
+) -> dict[str, str]:
+    """
+    Merge results, geographies and populations together and write the topojson,
+    its county index, its adjacency index and its attributes. This is the CPU heavy
+    part of a build, so it's what `build_all` runs in worker processes. The shared
+    geometry the attributes refer to is written separately (see `write_geometry`).
+    If `write_binary` is set, the topojson is also written in our binary format.
+
+    Returns:
+        Manifest entries for the files the map fetches (see `artifacts.publish`)
+    """
+    with profiling.stage("merge"):
+        final = SOURCES[target.source].merge_data(parsed, gdf).merge(pop_df, on="id")
+
+        if target.source == "nyt2024":
+            # Fix CT names one last time :-/
+            # TODO(khw): For some reason I have both a "name" and a "county" field
+            # which should be identical but debugging will take too long
+            final.loc[final["state"] == "CT", "name"] = final.loc[
+                final["state"] == "CT", "county"
+            ]
+
+        # Write counties in share code order so the map never has to sort them
+        final = final.iloc[share.share_order(final["id"])]
+        profiling.count(rows_in=len(parsed), rows_out=len(final))
+
+    shared.gdf_to_topojson(final, filename, write_binary=write_binary)
+    with profiling.stage("indexes"):
+        share.write_index(share.make_index(final), share.index_filename(filename))
+        adjacency.write(
+            adjacency.from_geometry(final), adjacency.adjacency_filename(filename)
+        )
+    with profiling.stage("attributes"):
+        geometry = attributes.geometry_filename(
+            filename, boundary_vintage(target.boundary_year)
+        )
+        attributes.write(
+            final, attributes.attributes_filename(filename), Path(geometry).name
+        )
+    published = [filename, attributes.attributes_filename(filename)]
+    if write_binary:
+        published.append(binary.binary_filename(filename))
+    with profiling.stage("publish"):
+        return artifacts.publish_all(published)
+
+
+def write_geometry(
+    target: Target, gdf: gpd.GeoDataFrame, filename: str, write_binary: bool = False
+) -> dict[str, str]:
+    """
+    Write and publish the geometry, at every level of detail, that `target`'s
+    attributes refer to, given the boundaries it was built from and the filename
+    of its data file
+    """
+    geometry = attributes.geometry_filename(
+        filename, boundary_vintage(target.boundary_year)
+    )
+    filenames = attributes.write_geometry(gdf, geometry, write_binary=write_binary)
+    with profiling.stage("publish"):
+        return artifacts.publish_all(filenames)
+
+
+def build_target(
+    target: Target,
+    filename: str,
+    census_api_key: str,
+    mit_filename: Optional[str] = None,
+    force: bool = False,
+    max_connections: Optional[int] = None,
+    write_binary: bool = False,
+):
+    """
+    Build a single target, start to finish
+    """
+    with profiling.stage(f"build {Path(filename).name}"):
+        _build_target(
+            target,
+            filename,
+            census_api_key,
+            mit_filename=mit_filename,
+            force=force,
+            max_connections=max_connections,
+            write_binary=write_binary,
+        )
+
+
+def _build_target(
+    target: Target,
+    filename: str,
+    census_api_key: str,
+    mit_filename: Optional[str] = None,
+    force: bool = False,
+    max_connections: Optional[int] = None,
+    write_binary: bool = False,
+):
+    click.echo("Pulling election results...")
+    parsed = load_results(
+        target.source,
+        target.year,
+        mit_filename=mit_filename,
+        force=force,
+        max_connections=max_connections,
+    )
+
+    click.echo("Getting county boundaries from Census and flattening counties...")
+    gdf = load_boundaries(target.boundary_year)
+    check_counties(gdf, parsed)
+
+    click.echo("Getting populations from Census...")
+    with profiling.stage(f"populations {target.population_year}"):
+        pop_df = shared.pull_population(
+            census_api_key, year=target.population_year, election_year=target.year
+        )
+        profiling.count(rows_out=len(pop_df))
+
+    click.echo("Merging data and geographies and topojsonifying...")
+    with profiling.stage(f"assemble {Path(filename).name}"):
+        published = assemble(
+            target, parsed, gdf, pop_df, filename, write_binary=write_binary
+        )
+    with profiling.stage(f"geometry {boundary_vintage(target.boundary_year)}"):
+        published.update(
+            write_geometry(target, gdf, filename, write_binary=write_binary)
+        )
+    directory = Path(filename).parent
+    artifacts.retire(directory, artifacts.update_manifest(directory, published))
+
+    click.echo("Done.")
+
+
+def _pull_panel(census_api_key: str, years: list[int]) -> pd.DataFrame:
+    with profiling.stage("populations"):
+        panel = population.pull_panel(census_api_key, years)
+        profiling.count(rows_out=len(panel))
+    return panel
+
+
+def build_all(
+    names: list[str],
+    output_dir: str,
+    census_api_key: str,
+    mit_filename: Optional[str] = None,
+    force: bool = False,
+    max_connections: Optional[int] = None,
+    max_workers: Optional[int] = None,
+    write_binary: bool = False,
+):
+    """
+    Build many targets at once. Boundaries, populations and election results are
+    each pulled once no matter how many targets use them, and are pulled
+    concurrently. As soon as everything a target needs is ready, its merge and
+    topojson stages are run in a pool of worker processes. The geometry shared by
+    every target with the same boundary vintage is written once.
+
+    Args:
+        names: Keys of TARGETS to build
+        output_dir: The directory to write the outputs to
+        census_api_key: Your Census API key
+        mit_filename: The location of the MIT data set. Required for MIT years
+        force: Force redownloading NYT data
+        max_connections: The maximum number of connections to open to the NYT API.
+            Defaults to as many as it keeps up with (see `client`)
+        max_workers: The maximum number of worker processes
+        write_binary: Also write topologies in our binary format (see `binary`)
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    targets = {name: TARGETS[name] for name in names}
+
+    with (
+        ThreadPoolExecutor() as io_pool,
+        ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+        ) as cpu_pool,
+    ):
+        # Populations for every year come from a single concurrent Census pull
+        populations = io_pool.submit(
+            _pull_panel,
+            census_api_key,
+            sorted({target.population_year for target in targets.values()}),
+        )
+        boundaries: dict[int, Future] = {}
+        election_results: dict[tuple[str, int], Future] = {}
+        for target in targets.values():
+            vintage = boundary_vintage(target.boundary_year)
+            if vintage not in boundaries:
+                boundaries[vintage] = io_pool.submit(load_boundaries, vintage)
+            if (target.source, target.year) not in election_results:
+                election_results[target.source, target.year] = io_pool.submit(
+                    load_results,
+                    target.source,
+                    target.year,
+                    mit_filename=mit_filename,
+                    force=force,
+                    max_connections=max_connections,
+                )
+
+        def dependencies(target: Target) -> tuple[Future, Future, Future]:
+            return (
+                election_results[target.source, target.year],
+                boundaries[boundary_vintage(target.boundary_year)],
+                populations,
+            )
+
+        waiting = dict(targets)
+        running: dict[Future, str] = {}
+        geometries_written: set[int] = set()
+        replaced: list[str] = []  # Hashed names the new manifest entries replaced
+        while waiting or running:
+            for name, target in list(waiting.items()):
+                deps = dependencies(target)
+                if all(dep.done() for dep in deps):
+                    parsed, gdf, panel = (dep.result() for dep in deps)
+                    check_counties(gdf, parsed)
+
+                    pop_df = rules.apply_to_frame(
+                        panel.loc[
+                            panel["year"] == target.population_year,
+                            ["id", "population"],
+                        ],
+                        target.year,
+                        id_col="id",
+                        values=["population"],
+                    )
+                    click.echo(f"Assembling {name}...")
+                    filename = str(output_dir / target.filename)
+                    future = profiling.submit(
+                        cpu_pool,
+                        f"assemble {target.filename}",
+                        assemble,
+                        target,
+                        parsed,
+                        gdf,
+                        pop_df,
+                        filename,
+                        write_binary=write_binary,
+                    )
+                    running[future] = target.filename
+                    del waiting[name]
+
+                    vintage = boundary_vintage(target.boundary_year)
+                    if vintage not in geometries_written:
+                        future = profiling.submit(
+                            cpu_pool,
+                            f"geometry {vintage}",
+                            write_geometry,
+                            target,
+                            gdf,
+                            filename,
+                            write_binary=write_binary,
+                        )
+                        running[future] = Path(
+                            attributes.geometry_filename(filename, vintage)
+                        ).name
+                        geometries_written.add(vintage)
+
+            pending = [
+                dep
+                for target in waiting.values()
+                for dep in dependencies(target)
+                if not dep.done()
+            ]
+            done, _ = wait(pending + list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in running:
+                    replaced += artifacts.update_manifest(
+                        output_dir, profiling.result(future)
+                    )
+                    click.echo(f"Wrote {running.pop(future)}")
+
+    artifacts.retire(output_dir, replaced)
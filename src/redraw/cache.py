@@ -0,0 +1,283 @@
+"""
+A content-addressed, on-disk cache for everything we download
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+from pathlib import Path, PosixPath
+from typing import Callable, Iterable, Iterator, Optional
+from urllib.parse import urlsplit
+
+from . import client, profiling
+from .constants import CACHE_DIR
+
+# By default keep at most 4 GiB of downloads around
+DEFAULT_MAX_BYTES = int(os.environ.get("REDRAW_CACHE_MAX_BYTES", 4 * 1024**3))
+
+# And only bother the upstream servers about revalidation once a day
+DEFAULT_MAX_AGE = float(os.environ.get("REDRAW_CACHE_MAX_AGE", 24 * 60 * 60))
+
+CHUNK_SIZE = 1 << 16
+
+
+@dataclass(frozen=True)
+class Extractor:
+    """
+    Pulls the part of a download we want out of it as it streams in, e.g., JSON
+    embedded in an HTML page, so only that part is cached. `extract` is given the
+    response's chunks and yields the chunks to keep. It may stop reading early.
+    """
+
+    name: str  # Distinguishes what it keeps from the whole download in the cache
+    suffix: str  # The extension of the file it keeps
+    extract: Callable[[Iterable[bytes]], Iterable[bytes]]
+
+
+def _counted(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    for chunk in chunks:
+        profiling.downloaded(len(chunk))
+        yield chunk
+
+
+@dataclass
+class CacheEntry:
+    """
+    What we know about a single cached URL
+    """
+
+    url: str
+    sha256: str
+    size: int
+    suffix: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched_at: float
+    last_used: float
+
+
+class DownloadCache:
+    """
+    A cache of remote files. Blobs are stored by the sha256 of their contents
+    (so two URLs serving the same bytes share storage) and an index maps each
+    URL to its blob along with the validators (ETag / Last-Modified) the server
+    gave us. Stale entries are revalidated with a conditional GET, and the least
+    recently used blobs are evicted once the cache grows beyond `max_bytes`.
+
+    `fetch` is safe to call from multiple threads at once, and from multiple
+    processes sharing a `root` (e.g., `build_all`'s workers).
+
+    Cached files keep the extension of the URL they came from, so zipped
+    shapefiles can be handed straight to `gpd.read_file` without extraction.
+    """
+
+    def __init__(
+        self,
+        root: Optional[Path] = None,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_age: float = DEFAULT_MAX_AGE,
+        http: Optional[client.SyncClient] = None,
+    ):
+        self.root = Path(root) if root is not None else CACHE_DIR / "downloads"
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.http = http or client.sync_client()
+
+        self._lock = threading.Lock()
+
+    @property
+    def index_path(self) -> Path:
+        return self.root / "index.json"
+
+    def blob_path(self, entry: CacheEntry) -> Path:
+        return self.root / "objects" / entry.sha256[:2] / (entry.sha256 + entry.suffix)
+
+    def _load_index(self) -> dict[str, CacheEntry]:
+        try:
+            with open(self.index_path) as infile:
+                raw = json.load(infile)
+        except (FileNotFoundError, json.JSONDecodeError):
+            raw = {}
+        return {url: CacheEntry(**entry) for url, entry in raw.items()}
+
+    def _save_index(self, index: dict[str, CacheEntry]):
+        with tempfile.NamedTemporaryFile(
+            "w", dir=self.root, suffix=".tmp", delete=False
+        ) as outfile:
+            json.dump({url: asdict(entry) for url, entry in index.items()}, outfile)
+        os.replace(outfile.name, self.index_path)
+
+    @contextmanager
+    def _updating_index(self) -> Iterator[dict[str, CacheEntry]]:
+        """
+        Yield the index as it is on disk, to change, and then save it. Other
+        processes may be updating it too, so this holds a lock file throughout, and
+        the index is replaced atomically so readers never see half of it.
+        """
+        self.root.mkdir(parents=True, exist_ok=True)
+        with self._lock, open(self.root / "index.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            index = self._load_index()
+            yield index
+            self._save_index(index)
+
+    def _lookup(self, url: str) -> Optional[CacheEntry]:
+        entry = self._load_index().get(url)
+        if entry is not None and not self.blob_path(entry).exists():
+            return None
+        return entry
+
+    def _touch(self, entry: CacheEntry, revalidated: bool = False):
+        entry.last_used = time.time()
+        if revalidated:
+            entry.fetched_at = entry.last_used
+        with self._updating_index() as index:
+            current = index.get(entry.url)
+            # Unless another process has stored something newer for it since
+            if current is None or self.blob_path(current) == self.blob_path(entry):
+                index[entry.url] = entry
+
+    def fetch(
+        self, url: str, force: bool = False, extractor: Optional[Extractor] = None
+    ) -> Path:
+        """
+        Return a local path holding the contents of `url`, downloading it only if
+        we don't have it or the server says our copy is out of date.
+
+        Args:
+            url: The URL to fetch
+            force: If set, ignore whatever we have cached and download afresh
+            extractor: If set, cache (and return) only what it extracts from the
+                download. It's revalidated with the download's validators, so
+                the download itself is never stored.
+
+        Returns:
+            The path to the cached file
+        """
+        key = url if extractor is None else f"{url}#{extractor.name}"
+        entry = None if force else self._lookup(key)
+        if entry is not None and time.time() - entry.fetched_at < self.max_age:
+            profiling.cache(hit=True)
+            self._touch(entry)
+            return self.blob_path(entry)
+
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+
+        with self.http.get(url, headers=headers) as response:
+            if response.status_code == 304 and entry is not None:
+                profiling.cache(hit=True)
+                self._touch(entry, revalidated=True)
+                return self.blob_path(entry)
+
+            response.raise_for_status()
+            profiling.cache(hit=False)
+            chunks = _counted(response.iter_content(CHUNK_SIZE))
+            if extractor is None:
+                suffix = PosixPath(urlsplit(url).path).suffix
+            else:
+                chunks, suffix = extractor.extract(chunks), extractor.suffix
+            return self._store(
+                key,
+                chunks,
+                suffix,
+                etag=response.headers.get("ETag"),
+                last_modified=response.headers.get("Last-Modified"),
+            )
+
+    def _store(
+        self,
+        url: str,
+        chunks: Iterable[bytes],
+        suffix: str,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> Path:
+        tmp_dir = self.root / "tmp"
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+
+        digest = hashlib.sha256()
+        size = 0
+        with tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False) as outfile:
+            try:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    size += len(chunk)
+                    outfile.write(chunk)
+            except BaseException:
+                outfile.close()
+                os.unlink(outfile.name)
+                raise
+
+        now = time.time()
+        entry = CacheEntry(
+            url=url,
+            sha256=digest.hexdigest(),
+            size=size,
+            suffix=suffix,
+            etag=etag,
+            last_modified=last_modified,
+            fetched_at=now,
+            last_used=now,
+        )
+
+        path = self.blob_path(entry)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.exists():
+            os.unlink(outfile.name)
+        else:
+            os.replace(outfile.name, path)
+
+        with self._updating_index() as index:
+            index[url] = entry
+            self._evict(index, keep=url)
+
+        return path
+
+    def _evict(self, index: dict[str, CacheEntry], keep: Optional[str] = None):
+        """
+        Drop the least recently used entries of `index` until we're under
+        `max_bytes`. Must be called while updating the index.
+        """
+        blob_sizes = {self.blob_path(entry): entry.size for entry in index.values()}
+        total = sum(blob_sizes.values())
+        if total <= self.max_bytes:
+            return
+
+        for entry in sorted(index.values(), key=lambda entry: entry.last_used):
+            if total <= self.max_bytes:
+                break
+            if entry.url == keep:
+                continue
+
+            del index[entry.url]
+            path = self.blob_path(entry)
+            if all(self.blob_path(other) != path for other in index.values()):
+                path.unlink(missing_ok=True)
+                total -= entry.size
+
+
+@lru_cache
+def get_cache() -> DownloadCache:
+    """
+    The cache shared by all of redraw
+    """
+    return DownloadCache()
+
+
+def fetch(url: str, force: bool = False, extractor: Optional[Extractor] = None) -> Path:
+    """
+    Fetch `url` through the shared download cache. See `DownloadCache.fetch`.
+    """
+    return get_cache().fetch(url, force=force, extractor=extractor)
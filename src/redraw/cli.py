@@ -2,26 +2,87 @@
 A CLI for manipulating NYT API election data into our format
 """
 
-import asyncio
-import os
-import pickle
+import dataclasses
+import functools
+import json
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Callable, Optional
 
 import click
 from dotenv import load_dotenv
 
-from . import mit, nyt, nyt2016, nyt2024, shared
+from . import bench, build, profiling, share, solve, transport, watch
 
 load_dotenv()
 
-CACHE_DIR = Path(os.environ.get("REDRAW_CACHE_DIR", ".redraw_cache"))
-
 
 @click.group()
 def cli():
     pass
 
 
+@contextmanager
+def profiled(filename: Optional[str], trace_filename: Optional[str]):
+    """
+    Profile a build if either file is set (see `profiling.profile`), and print a
+    summary of its stages at the end
+    """
+    with profiling.profile(filename, trace_filename) as profiler:
+        yield
+    if profiler is not None:
+        click.echo("\nProfile:")
+        for line in profiling.summary(profiler):
+            click.echo(line)
+
+
+def profile_options(command: Callable) -> Callable:
+    """
+    Add --profile and --trace options to a build command, which run it `profiled`
+    """
+
+    @click.option(
+        "--profile",
+        "profile_filename",
+        type=click.Path(dir_okay=False),
+        help="Profile each stage of the build and write the results here as JSON",
+    )
+    @click.option(
+        "--trace",
+        "trace_filename",
+        type=click.Path(dir_okay=False),
+        help="Profile each stage and write a Chrome trace (for Perfetto) here",
+    )
+    @functools.wraps(command)
+    def wrapper(
+        *args,
+        profile_filename: Optional[str] = None,
+        trace_filename: Optional[str] = None,
+        **kwargs,
+    ):
+        with profiled(profile_filename, trace_filename):
+            return command(*args, **kwargs)
+
+    return wrapper
+
+
+binary_option = click.option(
+    "--binary",
+    "write_binary",
+    is_flag=True,
+    help="Also write topologies in our compact binary format",
+)
+
+max_connections_option = click.option(
+    "--max-connections",
+    "-m",
+    "max_connections",
+    type=int,
+    help="The maximum number of connections to open to the NYT API. Defaults to "
+    "as many as it keeps up with, up to REDRAW_HTTP_MAX_CONNECTIONS",
+)
+
+
 @cli.command("mit")
 @click.argument("year", type=int)
 @click.argument("input_filename", type=click.Path())
@@ -33,40 +94,26 @@ def cli():
     envvar="CENSUS_API_KEY",
     help="Your Census API key",
 )
+@binary_option
+@profile_options
 def mit_command(
-    year: int, input_filename: str, output_filename: str, census_api_key: str
+    year: int,
+    input_filename: str,
+    output_filename: str,
+    census_api_key: str,
+    write_binary: bool = False,
 ):
-    click.echo("Reading and parsing data...")
-    data = mit.read_data(input_filename, year)
-    parsed = mit.parse_data(data)
-
-    click.echo("Getting county boundaries from Census...")
-    tjson = shared.get_county_boundaries(year)
-
-    click.echo("Flattening counties...")
-    gdf = shared.flatten_counties(tjson)
-
-    tjson_counties = set(gdf.id)
-    parsed_counties = {county.fips for county in parsed}
-    assert (
-        len(tjson_counties - parsed_counties) == 0
-    ), f"{tjson_counties - parsed_counties}"
-    assert (
-        len(parsed_counties - tjson_counties) == 0
-    ), f"{parsed_counties - tjson_counties}"
-
-    # Pull populations
-    click.echo("Getting populations from Census...")
-    pop_df = shared.pull_population(census_api_key, year=year)
-
-    # Then merge the two together
-    click.echo("Merging data and geographies...")
-    final = mit.merge_data(parsed, gdf).merge(pop_df, on="id")
-
-    click.echo("Topojsonifying...")
-    shared.gdf_to_topojson(final, output_filename)
-
-    click.echo("Done.")
+    """
+    Create a topojson for YEAR from the MIT data set at INPUT_FILENAME
+    """
+    target = build.Target("mit", year, year, year, output_filename)
+    build.build_target(
+        target,
+        output_filename,
+        census_api_key,
+        mit_filename=input_filename,
+        write_binary=write_binary,
+    )
 
 
 @cli.command("2016")
@@ -81,47 +128,24 @@ def mit_command(
 @click.option(
     "--force", "-f", "force", is_flag=True, help="Force redownloading NYT data"
 )
-def twenty_sixteen_command(filename: str, census_api_key: str, force: bool = False):
+@binary_option
+@profile_options
+def twenty_sixteen_command(
+    filename: str,
+    census_api_key: str,
+    force: bool = False,
+    write_binary: bool = False,
+):
     """
     Create the 2016 election topojson. FILENAME is the location we'll store the output.
     """
-    CACHE_DIR.mkdir(exist_ok=True)
-    results_cache_file = CACHE_DIR / "nyt2016.pkl"
-
-    click.echo("Pulling data from NYT...")
-    if force or not results_cache_file.exists():
-        data = nyt2016.pull_data()
-        parsed = nyt2016.parse_data(data)
-        with open(results_cache_file, "wb") as outfile:
-            pickle.dump(parsed, outfile)
-    else:
-        with open(results_cache_file, "rb") as infile:
-            parsed = pickle.load(infile)
-
-    click.echo("Getting county boundaries from Census...")
-    tjson = shared.get_county_boundaries(2016)
-
-    click.echo("Flattening counties...")
-    gdf = shared.flatten_counties(tjson)
-
-    # Make sure vote data and map data match
-    tjson_counties = set(gdf.id)
-    parsed_counties = {county.fips for county in parsed}
-    assert len(tjson_counties - parsed_counties) == 0, tjson_counties - parsed_counties
-    assert len(parsed_counties - tjson_counties) == 0
-
-    # Pull populations
-    click.echo("Getting populations from Census...")
-    pop_df = shared.pull_population(census_api_key, year=2016)
-
-    # Then merge the two together
-    click.echo("Merging data...")
-    final = nyt2016.merge_data(parsed, gdf).merge(pop_df, on="id")
-
-    click.echo("Simplifying and writing...")
-    shared.gdf_to_topojson(final, filename)
-
-    click.echo("Done.")
+    build.build_target(
+        build.TARGETS["2016"],
+        filename,
+        census_api_key,
+        force=force,
+        write_binary=write_binary,
+    )
 
 
 @cli.command("2020")
@@ -133,13 +157,7 @@ def twenty_sixteen_command(filename: str, census_api_key: str, force: bool = Fal
     envvar="CENSUS_API_KEY",
     help="Your Census API key",
 )
-@click.option(
-    "--max-connections",
-    "-m",
-    "max_connections",
-    default=3,
-    help="The maximum number of connections to open to the NYT API",
-)
+@max_connections_option
 @click.option(
     "--force", "-f", "force", is_flag=True, help="Force redownloading NYT data"
 )
@@ -149,58 +167,30 @@ def twenty_sixteen_command(filename: str, census_api_key: str, force: bool = Fal
     default=2020,
     help="Pretend like the population was this year",
 )
+@binary_option
+@profile_options
 def twenty_twenty_command(
-    max_connections: int,
+    max_connections: Optional[int],
     filename: str,
     census_api_key: str,
     force: bool = False,
     population_year: int = 2020,
+    write_binary: bool = False,
 ):
     """
     Pull data from the NYT API for 2020
     """
-    CACHE_DIR.mkdir(exist_ok=True)
-    results_cache_file = CACHE_DIR / "nyt2020.pkl"
-
-    click.echo("Pulling data from NYT...")
-    if force or not results_cache_file.exists():
-        loop = asyncio.get_event_loop()
-        data = loop.run_until_complete(
-            nyt.fetch_all_states(max_connections=max_connections)
-        )
-
-        click.echo("Parsing data...")
-        parsed = sorted(nyt.parse_data(data))
-
-        with open(results_cache_file, "wb") as outfile:
-            pickle.dump(parsed, outfile)
-    else:
-        with open(results_cache_file, "rb") as infile:
-            parsed = pickle.load(infile)
-
-    click.echo("Getting county boundaries from Census...")
-    tjson = shared.get_county_boundaries(2019)
-
-    click.echo("Flattening counties...")
-    gdf = shared.flatten_counties(tjson)
-
-    tjson_counties = set(gdf.id)
-    parsed_counties = {county.fips for county in parsed}
-    assert len(tjson_counties - parsed_counties) == 0
-    assert len(parsed_counties - tjson_counties) == 0
-
-    # Pull populations
-    click.echo("Getting populations from Census...")
-    pop_df = shared.pull_population(census_api_key, year=population_year)
-
-    # Then merge the two together
-    click.echo("Merging data and geographies...")
-    final = nyt.merge_data(parsed, gdf).merge(pop_df, on="id")
-
-    click.echo("Topojsonifying...")
-    shared.gdf_to_topojson(final, filename)
-
-    click.echo("Done.")
+    target = dataclasses.replace(
+        build.TARGETS["2020"], population_year=population_year, filename=filename
+    )
+    build.build_target(
+        target,
+        filename,
+        census_api_key,
+        force=force,
+        max_connections=max_connections,
+        write_binary=write_binary,
+    )
 
 
 @cli.command("2024")
@@ -212,13 +202,7 @@ def twenty_twenty_command(
     envvar="CENSUS_API_KEY",
     help="Your Census API key",
 )
-@click.option(
-    "--max-connections",
-    "-m",
-    "max_connections",
-    default=3,
-    help="The maximum number of connections to open to the NYT API",
-)
+@max_connections_option
 @click.option(
     "--force", "-f", "force", is_flag=True, help="Force redownloading NYT data"
 )
@@ -228,68 +212,369 @@ def twenty_twenty_command(
     default=False,
     help="If set, use the new CT counties. Will cause issues with sharing code",
 )
+@binary_option
+@profile_options
 def twenty_twenty_four_command(
-    max_connections: int,
+    max_connections: Optional[int],
     filename: str,
     census_api_key: str,
     force: bool = False,
     use_new_ct_counties: bool = False,
+    write_binary: bool = False,
 ):
     """
     Pull data from the NYT API for 2024
     """
-    CACHE_DIR.mkdir(exist_ok=True)
-    results_cache_file = CACHE_DIR / "nyt2024.pkl"
-
-    click.echo("Pulling data from NYT...")
-    if force or not results_cache_file.exists():
-        loop = asyncio.get_event_loop()
-        data = loop.run_until_complete(
-            nyt2024.fetch_all_states(max_connections=max_connections)
-        )
+    target = dataclasses.replace(
+        build.TARGETS["2024"],
+        population_year=2024 if use_new_ct_counties else 2022,
+        filename=filename,
+    )
+    build.build_target(
+        target,
+        filename,
+        census_api_key,
+        force=force,
+        max_connections=max_connections,
+        write_binary=write_binary,
+    )
 
-        click.echo("Parsing data...")
-        parsed = sorted(nyt2024.parse_data(data))
 
-        with open(results_cache_file, "wb") as outfile:
-            pickle.dump(parsed, outfile)
-    else:
-        with open(results_cache_file, "rb") as infile:
-            parsed = pickle.load(infile)
+@cli.command("build-all")
+@click.argument("output_dir", type=click.Path(file_okay=False))
+@click.option(
+    "--year",
+    "-y",
+    "years",
+    multiple=True,
+    type=click.Choice(list(build.TARGETS)),
+    help="A year to build. May be repeated. Defaults to all years",
+)
+@click.option(
+    "--mit-file",
+    "mit_filename",
+    type=click.Path(exists=True, dir_okay=False),
+    help="The MIT data set. Without it, the MIT years are skipped",
+)
+@click.option(
+    "--api-key",
+    "-k",
+    "census_api_key",
+    envvar="CENSUS_API_KEY",
+    help="Your Census API key",
+)
+@max_connections_option
+@click.option(
+    "--max-workers",
+    "-j",
+    "max_workers",
+    type=int,
+    default=None,
+    help="The maximum number of worker processes. Defaults to the number of CPUs",
+)
+@click.option(
+    "--force", "-f", "force", is_flag=True, help="Force redownloading NYT data"
+)
+@binary_option
+@profile_options
+def build_all_command(
+    output_dir: str,
+    years: tuple[str, ...],
+    mit_filename: str,
+    census_api_key: str,
+    max_connections: Optional[int],
+    max_workers: int,
+    force: bool = False,
+    write_binary: bool = False,
+):
+    """
+    Build the data for many years at once into OUTPUT_DIR, sharing boundaries,
+    populations and results between them
+    """
+    names = list(years) or list(build.TARGETS)
+    if mit_filename is None:
+        skipped = [name for name in names if build.TARGETS[name].source == "mit"]
+        if skipped:
+            click.echo(f"No --mit-file given, skipping {', '.join(skipped)}")
+        names = [name for name in names if name not in skipped]
+
+    build.build_all(
+        names,
+        output_dir,
+        census_api_key,
+        mit_filename=mit_filename,
+        force=force,
+        max_connections=max_connections,
+        max_workers=max_workers,
+        write_binary=write_binary,
+    )
+    click.echo("Done.")
 
-    click.echo("Getting county boundaries from Census...")
-    tjson = shared.get_county_boundaries(2019)
 
-    click.echo("Flattening counties...")
-    gdf = shared.flatten_counties(tjson)
+@cli.command("watch")
+@click.argument(
+    "year",
+    type=click.Choice(
+        [name for name, t in build.TARGETS.items() if t.source in ("nyt", "nyt2024")]
+    ),
+)
+@click.argument("filename", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--interval",
+    "-i",
+    default=60.0,
+    help="The number of seconds between polls of the NYT API",
+)
+@click.option(
+    "--delta",
+    "delta_filename",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Write changed votes to this file instead of rewriting FILENAME",
+)
+@max_connections_option
+@click.option("--once", is_flag=True, help="Poll once and exit")
+def watch_command(
+    year: str,
+    filename: str,
+    interval: float,
+    delta_filename: str,
+    max_connections: Optional[int],
+    once: bool,
+):
+    """
+    Poll the NYT for YEAR's results and patch the votes in FILENAME, a file built
+    for YEAR, without touching its geometry
+    """
+    watch.watch(
+        year,
+        filename,
+        interval=interval,
+        delta_filename=delta_filename,
+        max_connections=max_connections,
+        once=once,
+    )
 
-    tjson_counties = set(gdf.id)
-    parsed_counties = {county.fips for county in parsed}
-    assert len(tjson_counties - parsed_counties) == 0
-    assert len(parsed_counties - tjson_counties) == 0
 
-    # Pull populations
-    click.echo("Getting populations from Census...")
-    pop_df = shared.pull_population(
-        census_api_key,
-        year=2024 if use_new_ct_counties else 2022,
+@cli.command("solve")
+@click.argument("year", type=click.Choice(list(build.TARGETS)))
+@click.option(
+    "--data-dir",
+    "-d",
+    "data_dir",
+    type=click.Path(exists=True, file_okay=False),
+    default="public/data",
+    help="The directory the year's data was built into",
+)
+@click.option(
+    "--party",
+    "-p",
+    type=click.Choice(solve.PARTIES),
+    default=None,
+    help="The party to make win. Defaults to whoever lost",
+)
+@click.option(
+    "--ilp",
+    "use_ilp",
+    is_flag=True,
+    help="Solve exactly with an integer program (requires scipy)",
+)
+@click.option(
+    "--beam-width",
+    "-b",
+    default=16,
+    help="The number of maps the beam search keeps each round. 1 is greedy",
+)
+@click.option(
+    "--max-moves",
+    default=30,
+    help="Give up on the beam search after this many moves",
+)
+@click.option(
+    "--time-limit",
+    type=float,
+    default=None,
+    help="The number of seconds to give the integer program",
+)
+@click.option(
+    "--base-url",
+    default=share.DEFAULT_BASE_URL,
+    help="Where the map lives, for the share URL",
+)
+def solve_command(
+    year: str,
+    data_dir: str,
+    party: str,
+    use_ilp: bool,
+    beam_width: int,
+    max_moves: int,
+    time_limit: float,
+    base_url: str,
+):
+    """
+    Find the fewest border counties to move to flip YEAR's election
+    """
+    filename = Path(data_dir) / build.TARGETS[year].filename
+    try:
+        data, party, solution = solve.solve(
+            str(filename),
+            party=party,
+            method="ilp" if use_ilp else "beam",
+            beam_width=beam_width,
+            max_moves=max_moves,
+            time_limit=time_limit,
+        )
+    except ImportError as exc:
+        raise click.UsageError(str(exc))
+
+    if solution is None:
+        raise click.ClickException(f"Couldn't find a way to make {party} win")
+
+    click.echo(f"Moving {len(solution.moves)} counties makes {party} win:")
+    for move in solution.moves:
+        click.echo(f"  {solve.describe(data, move)}")
+    click.echo(
+        f"Electors: dem {solution.outcome.dem_electors[0]}, "
+        f"gop {solution.outcome.gop_electors[0]}"
     )
+    click.echo(share.share_url(year, solution.states, base_url=base_url))
 
-    # Then merge the two together
-    click.echo("Merging data and geographies...")
-    final = nyt2024.merge_data(parsed, gdf).merge(pop_df, on="id")
 
-    # Fix CT names one last time :-/
-    # TODO(khw): For some reason I have both a "name" and a "county" field which should be
-    # identical but debugging will take too long
-    final.loc[final["state"] == "CT", "name"] = final.loc[
-        final["state"] == "CT", "county"
-    ]
+@cli.command("score")
+@click.argument("year", type=click.Choice(list(build.TARGETS)))
+@click.argument("input_filename", type=click.File("r"))
+@click.argument("output_filename", type=click.File("w"), default="-")
+@click.option(
+    "--data-dir",
+    "-d",
+    "data_dir",
+    type=click.Path(exists=True, file_okay=False),
+    default="public/data",
+    help="The directory the year's data was built into",
+)
+@click.option(
+    "--batch-size",
+    default=10_000,
+    help="The number of share codes to decode and score at once",
+)
+def score_command(
+    year: str, input_filename, output_filename, data_dir: str, batch_size: int
+):
+    """
+    Score every shared map in INPUT_FILENAME, which has one share URL or share code
+    per line, against YEAR. Writes a CSV to OUTPUT_FILENAME (stdout by default).
+    """
+    filename = Path(data_dir) / build.TARGETS[year].filename
+    index = share.read_index(share.index_filename(str(filename)))
 
-    click.echo("Topojsonifying...")
-    shared.gdf_to_topojson(final, filename)
+    codes = [share.parse_url(line)[1] for line in input_filename]
+    valid = [i for i, code in enumerate(codes) if share.is_valid(code)]
+    if len(valid) < len(codes):
+        click.echo(f"Skipping {len(codes) - len(valid)} malformed lines", err=True)
 
-    click.echo("Done.")
+    output_filename.write("line,dem_electors,gop_electors\n")
+    for start in range(0, len(valid), batch_size):
+        lines = valid[start : start + batch_size]
+        outcome = share.score_many([codes[i] for i in lines], index)
+        for line, dem, gop in zip(lines, outcome.dem_electors, outcome.gop_electors):
+            output_filename.write(f"{line + 1},{dem},{gop}\n")
+
+
+@cli.command("bench")
+@click.option(
+    "--repeat",
+    "repeats",
+    default=5,
+    help="The number of timed runs of each stage",
+)
+@click.option(
+    "--stage",
+    "stages",
+    type=click.Choice([stage.name for stage in bench.STAGES]),
+    multiple=True,
+    help="A stage to run (may be repeated). Defaults to every stage",
+)
+@click.option(
+    "--output",
+    "-o",
+    "output_filename",
+    type=click.Path(dir_okay=False),
+    help="Where to write the results as JSON",
+)
+@click.option(
+    "--compare",
+    "baseline_filename",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Results of an earlier run to compare against",
+)
+@click.option(
+    "--threshold",
+    default=0.1,
+    help="The relative change in time or memory to flag when comparing",
+)
+def bench_command(
+    repeats: int,
+    stages: tuple[str, ...],
+    output_filename: str,
+    baseline_filename: str,
+    threshold: float,
+):
+    """
+    Benchmark each stage of a build against offline fixtures
+    """
+
+    def report(measurement: bench.Measurement):
+        click.echo(
+            f"{measurement.stage:<26} {measurement.median * 1000:9.2f}ms "
+            f"(min {measurement.min * 1000:.2f}ms, max {measurement.max * 1000:.2f}ms)"
+            f" {measurement.peak_memory / 1024:9.0f}KB"
+        )
+
+    results = bench.run(list(stages), repeats=repeats, callback=report)
+    if output_filename:
+        with open(output_filename, "w") as outfile:
+            json.dump(results, outfile, indent=2)
+
+    if baseline_filename:
+        with open(baseline_filename) as infile:
+            baseline = json.load(infile)
+        try:
+            comparison = bench.compare(baseline, results)
+        except ValueError as exc:
+            raise click.ClickException(str(exc))
+
+        click.echo(f"\nCompared to {baseline.get('commit') or baseline_filename}:")
+        for stage, old_time, new_time, old_memory, new_memory in comparison:
+            time_ratio = new_time / old_time
+            memory_ratio = new_memory / old_memory if old_memory else 1.0
+            flags = [
+                label
+                for label, ratio in (("time", time_ratio), ("memory", memory_ratio))
+                if abs(ratio - 1) > threshold
+            ]
+            click.echo(
+                f"{stage:<26} time x{time_ratio:.2f} memory x{memory_ratio:.2f}"
+                + (f"  <- {', '.join(flags)} changed" if flags else "")
+            )
+
+
+@cli.command("replay-server")
+@click.argument("archive", type=click.Path(dir_okay=False))
+@click.option("--host", default="127.0.0.1", help="The interface to listen on")
+@click.option("--port", "-p", default=8765, help="The port to listen on")
+@click.option(
+    "--record",
+    is_flag=True,
+    help="Fetch and record anything ARCHIVE doesn't have from the real servers",
+)
+def replay_server_command(archive: str, host: str, port: int, record: bool):
+    """
+    Serve the responses recorded in ARCHIVE in place of the NYT, Census and CDC.
+    Point builds at it by setting REDRAW_REPLAY_URL, e.g., to http://127.0.0.1:8765
+    """
+    if not record and not Path(archive).exists():
+        raise click.UsageError(f"{archive} doesn't exist. Pass --record to create it")
+    transport.serve(archive, host=host, port=port, record=record)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,373 @@
+"""
+The HTTP client every data source uses. Requests to each host share
+
+    * a token bucket, so we send at most `rate` requests a second to it on
+      average, in bursts of at most `burst`
+    * an adaptive concurrency window: every success widens it by about one
+      request per window's worth of successes, up to `max_connections`, and every
+      sign of throttling (a 429, a 5xx or a timeout) halves it (AIMD)
+    * a pause for as long as its last Retry-After asked
+
+so we go about as fast as each server lets us without being throttled. Failed
+requests are retried after a jittered exponential backoff (or the Retry-After,
+if longer). Successful requests never wait, and every request has a timeout.
+
+`Client` is for asyncio code and `SyncClient` for everything else. They share the
+per-host state, so, e.g., Census downloads from a thread pool and Census API calls
+from asyncio are limited together. Requests go through `transport.resolve`, so
+they can be replayed offline.
+
+Everything is tuned by `Settings`, whose defaults can be overridden with the
+environment variables REDRAW_HTTP_RATE, REDRAW_HTTP_BURST,
+REDRAW_HTTP_MAX_CONNECTIONS, REDRAW_HTTP_INITIAL_CONNECTIONS, REDRAW_HTTP_TIMEOUT,
+REDRAW_HTTP_NUM_ATTEMPTS, REDRAW_HTTP_BACKOFF and REDRAW_HTTP_MAX_BACKOFF.
+"""
+
+import asyncio
+import dataclasses
+import email.utils
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Iterator, Mapping, Optional
+from urllib.parse import urlsplit
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import profiling, transport
+
+# Statuses which mean "slow down and try again"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# How often to check for a free slot when a host's window is full
+POLL_INTERVAL = 0.01
+
+
+@dataclass(frozen=True)
+class Settings:
+    rate: float = 20.0  # Requests per second to each host, on average
+    burst: int = 10  # The most requests to send a host at once after a lull
+    max_connections: int = 16  # The most requests in flight to each host
+    initial_connections: int = 4  # Requests in flight to a host before adapting
+    timeout: float = 120.0  # Seconds per request
+    num_attempts: int = 4  # Attempts per request before giving up
+    backoff: float = 0.5  # Retry n waits a random time up to backoff * 2 ** n
+    max_backoff: float = 30.0  # Seconds
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        """
+        The defaults, overridden by any REDRAW_HTTP_* environment variables
+
+        Raises:
+            ValueError: If a variable isn't a number, or isn't a whole one for a
+                field that must be
+        """
+        overrides = {}
+        for field in dataclasses.fields(cls):
+            name = f"REDRAW_HTTP_{field.name.upper()}"
+            value = os.environ.get(name)
+            if value is None:
+                continue
+            try:
+                number = float(value)
+            except ValueError:
+                raise ValueError(f"{name} must be a number, not {value!r}") from None
+            if field.type is int:
+                if not number.is_integer():
+                    raise ValueError(f"{name} must be a whole number, not {value!r}")
+                number = int(number)
+            overrides[field.name] = number
+        return cls(**overrides)
+
+
+SETTINGS = Settings.from_env()
+
+
+class HostLimiter:
+    """
+    The token bucket and concurrency window for one host. This is thread safe and
+    doesn't depend on an event loop: `reserve` says how long to wait rather than
+    waiting itself.
+    """
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self.tokens = float(settings.burst)
+        self.window = float(min(settings.initial_connections, settings.max_connections))
+        self.in_flight = 0
+        self.paused_until = 0.0
+
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_connections: Optional[int] = None) -> float:
+        """
+        Try to start a request, which must be followed by `release` if it starts.
+
+        Args:
+            max_connections: A lower cap on requests in flight, if any
+
+        Returns:
+            0 if the request may start now, or else the number of seconds to wait
+                before trying again
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.settings.burst,
+                self.tokens + (now - self._updated) * self.settings.rate,
+            )
+            self._updated = now
+
+            if now < self.paused_until:
+                return self.paused_until - now
+            limit = int(self.window)
+            if max_connections is not None:
+                limit = min(limit, max_connections)
+            if self.in_flight >= limit:
+                return POLL_INTERVAL
+            if self.tokens < 1:
+                return (1 - self.tokens) / self.settings.rate
+
+            self.tokens -= 1
+            self.in_flight += 1
+            return 0.0
+
+    def release(self, throttled: bool = False, retry_after: Optional[float] = None):
+        """
+        Finish a request, adapting the window to how it went
+        """
+        with self._lock:
+            self.in_flight -= 1
+            if throttled:
+                self.window = max(1.0, self.window / 2)
+            else:
+                self.window = min(
+                    self.settings.max_connections, self.window + 1 / self.window
+                )
+            if retry_after:
+                self.paused_until = max(
+                    self.paused_until, time.monotonic() + retry_after
+                )
+
+
+_limiters: dict[str, HostLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter(url: str, settings: Settings = SETTINGS) -> HostLimiter:
+    """
+    The limiter for the host `url` is on. Pass the URL as requested rather than
+    as `transport.resolve`d, so hosts replayed from one server stay apart.
+    """
+    host = urlsplit(url).netloc
+    with _limiters_lock:
+        if host not in _limiters:
+            _limiters[host] = HostLimiter(settings)
+        return _limiters[host]
+
+
+def retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """
+    The number of seconds a Retry-After header asks us to wait, if any
+    """
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(
+            0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+        )
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff(
+    num_attempt: int, wait: Optional[float] = None, settings: Settings = SETTINGS
+) -> float:
+    """
+    How long to wait after failed attempt `num_attempt` (from 0): a random time up
+    to an exponentially growing cap, or `wait` (e.g., from a Retry-After) if longer
+    """
+    cap = min(settings.max_backoff, settings.backoff * 2**num_attempt)
+    return max(wait or 0.0, random.uniform(0, cap))
+
+
+@dataclass(frozen=True)
+class Response:
+    status: int
+    headers: Mapping[str, str]
+    body: bytes
+
+    @property
+    def ok(self) -> bool:
+        return self.status < 400
+
+
+class Client:
+    """
+    An asyncio HTTP client. Use it as
+
+        async with Client() as session:
+            response = await session.get(url)
+
+    Args:
+        max_connections: A cap on requests in flight to each host from this client,
+            below the adaptive window. Defaults to no cap beyond `settings`
+        settings: How to limit and retry requests
+    """
+
+    def __init__(
+        self, max_connections: Optional[int] = None, settings: Settings = SETTINGS
+    ):
+        self.max_connections = max_connections
+        self.settings = settings
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def __aenter__(self) -> "Client":
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit_per_host=self.settings.max_connections
+            ),
+            timeout=aiohttp.ClientTimeout(total=self.settings.timeout),
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._session.close()
+
+    async def get(
+        self,
+        url: str,
+        headers: Optional[dict[str, str]] = None,
+        num_attempts: Optional[int] = None,
+    ) -> Response:
+        """
+        GET `url`, retrying on throttling and connection errors.
+
+        Args:
+            url: The URL to fetch
+            headers: Any headers to send
+            num_attempts: How many attempts to make. Defaults to the settings'
+
+        Returns:
+            The response, with its body read. Its status may be anything but one
+                we retry on
+
+        Raises:
+            EnvironmentError: If every attempt failed
+        """
+        target = transport.resolve(url)
+        host = limiter(url, self.settings)
+        num_attempts = num_attempts or self.settings.num_attempts
+        for num_attempt in range(num_attempts):
+            while (wait := host.reserve(self.max_connections)) > 0:
+                await asyncio.sleep(wait)
+
+            throttled, wait = False, None
+            try:
+                async with self._session.get(target, headers=headers) as response:
+                    body = await response.read()
+                    if response.status not in RETRY_STATUSES:
+                        profiling.downloaded(len(body))
+                        return Response(response.status, response.headers, body)
+                    throttled, wait = True, retry_after(response.headers)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                throttled = True
+            finally:
+                host.release(throttled=throttled, retry_after=wait)
+
+            if num_attempt < num_attempts - 1:
+                await asyncio.sleep(backoff(num_attempt, wait, self.settings))
+
+        raise EnvironmentError(
+            f"Something went wrong after {num_attempts} attempts to pull "
+            f"{transport.request_key(url)}"
+        )
+
+
+class SyncClient:
+    """
+    A blocking HTTP client with a pool of keep-alive connections per host, safe to
+    use from many threads at once. See `Client`.
+    """
+
+    def __init__(self, settings: Settings = SETTINGS):
+        self.settings = settings
+        adapter = HTTPAdapter(
+            pool_connections=settings.max_connections,
+            pool_maxsize=settings.max_connections,
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    @contextmanager
+    def get(
+        self,
+        url: str,
+        headers: Optional[dict[str, str]] = None,
+        num_attempts: Optional[int] = None,
+    ) -> Iterator[requests.Response]:
+        """
+        GET `url`, retrying on throttling and connection errors, and yield the
+        response with its body unread, so it can be streamed
+
+        Raises:
+            EnvironmentError: If every attempt failed
+        """
+        target = transport.resolve(url)
+        host = limiter(url, self.settings)
+        num_attempts = num_attempts or self.settings.num_attempts
+        for num_attempt in range(num_attempts):
+            while (wait := host.reserve()) > 0:
+                time.sleep(wait)
+
+            try:
+                response = self.session.get(
+                    target, headers=headers, stream=True, timeout=self.settings.timeout
+                )
+            except (requests.ConnectionError, requests.Timeout):
+                wait = None
+            except BaseException:
+                host.release()
+                raise
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    break
+                wait = retry_after(response.headers)
+                response.close()
+
+            host.release(throttled=True, retry_after=wait)
+            if num_attempt < num_attempts - 1:
+                time.sleep(backoff(num_attempt, wait, self.settings))
+        else:
+            raise EnvironmentError(
+                f"Something went wrong after {num_attempts} attempts to pull "
+                f"{transport.request_key(url)}"
+            )
+
+        try:
+            with response:
+                yield response
+        finally:
+            host.release()
+
+
+@lru_cache
+def sync_client() -> SyncClient:
+    """
+    The blocking client shared by all of redraw
+    """
+    return SyncClient()
@@ -1,3 +1,21 @@
+import os
 from pathlib import Path
 
-CACHE_DIR = Path(".redraw_cache")
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CACHE_DIR = Path(os.environ.get("REDRAW_CACHE_DIR", ".redraw_cache"))
+
+# Where a replay server (see `transport`) is listening, if we're replaying
+REPLAY_URL = os.environ.get("REDRAW_REPLAY_URL")
+
+# The order in which the javascript app (and its share codes) list the states
+STATE_ABBREVS = [
+    "AL", "AK", "AZ", "AR", "CA", "CO", "CT", "DE", "DC", "FL",
+    "GA", "HI", "ID", "IL", "IN", "IA", "KS", "KY", "LA", "ME",
+    "MD", "MA", "MI", "MN", "MS", "MO", "MT", "NE", "NV", "NH",
+    "NJ", "NM", "NY", "NC", "ND", "OH", "OK", "OR", "PA", "RI",
+    "SC", "SD", "TN", "TX", "UT", "VT", "VA", "WA", "WV", "WI",
+    "WY",
+]  # fmt: skip
@@ -0,0 +1,217 @@
+"""
+Apportioning electors and scoring electoral outcomes. This mirrors
+`computeElectors` in the javascript app, which uses the method of equal
+proportions (Huntington-Hill) described here:
+
+    https://en.wikipedia.org/wiki/United_States_congressional_apportionment#The_method_of_equal_proportions
+
+Every function here works on a batch of maps at once. States are always indexed
+in the order of `constants.STATE_ABBREVS`.
+"""
+
+import heapq
+import math
+from dataclasses import dataclass
+
+import numpy as np
+
+from .constants import STATE_ABBREVS
+
+NUM_STATES = len(STATE_ABBREVS)
+DC = STATE_ABBREVS.index("DC")
+NUM_REPRESENTATIVES = 435
+
+# Counties assigned to this "state" don't count toward anything. It matches the
+# letter share codes use for geometries without a state.
+NO_STATE = NUM_STATES
+
+_NOT_DC = np.arange(NUM_STATES) != DC
+
+
+def _priority(population: np.ndarray, seats: np.ndarray) -> np.ndarray:
+    """
+    The priority value of a state with `seats` representatives for its next seat
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return population / np.sqrt(seats * (seats + 1.0))
+
+
+def apportion_one(populations: np.ndarray) -> np.ndarray:
+    """
+    Apportion electors for a single map with a heap, handing out one seat at a
+    time as the javascript app does. Exact ties, which don't happen with real
+    populations, go to the earlier state.
+
+    Args:
+        populations: The population of each state
+
+    Returns:
+        The number of electors each state receives
+    """
+    populations = np.asarray(populations, dtype=float)
+    has_population = populations > 0
+
+    # All states, DC included, get a minimum of 3 electors. DC doesn't get any
+    # more electors than the least populous state, which for the lifespan of this
+    # tool we can safely assume to be 3.
+    electors = np.where(has_population, 3, 0)
+    remaining = NUM_REPRESENTATIVES - int(has_population[_NOT_DC].sum())
+
+    heap = [
+        (-populations[state] / math.sqrt(2), state)
+        for state in range(NUM_STATES)
+        if state != DC
+    ]
+    heapq.heapify(heap)
+    for _ in range(remaining):
+        _, state = heapq.heappop(heap)
+        electors[state] += 1
+        seats = electors[state] - 2
+        heapq.heappush(
+            heap, (-populations[state] / math.sqrt(seats * (seats + 1)), state)
+        )
+
+    return electors
+
+
+def apportion(populations: np.ndarray, num_iterations: int = 100) -> np.ndarray:
+    """
+    Apportion electors for a batch of maps at once.
+
+    Rather than handing out seats one at a time, we bisect for the priority
+    threshold above which exactly the right number of seats are handed out. Any
+    map where that isn't exact (e.g., due to ties) falls back to `apportion_one`.
+
+    Args:
+        populations: An array of shape (..., NUM_STATES) of state populations
+        num_iterations: The number of bisection steps
+
+    Returns:
+        An integer array of the same shape with the number of electors per state
+    """
+    populations = np.asarray(populations, dtype=float)
+    shape = populations.shape
+    pops = populations.reshape(-1, NUM_STATES)
+    house_pops = np.where(_NOT_DC, pops, 0.0)
+
+    has_population = pops > 0
+    remaining = NUM_REPRESENTATIVES - (has_population & _NOT_DC).sum(axis=1)
+
+    def extra_seats(threshold: np.ndarray) -> np.ndarray:
+        # The number of r >= 1 with pop / sqrt(r (r + 1)) >= threshold
+        ratio = house_pops / threshold[:, None]
+        return np.floor((np.sqrt(1 + 4 * ratio**2) - 1) / 2)
+
+    # The threshold lives between the smallest and largest possible priorities
+    lo = np.full(len(pops), 1e-9)
+    hi = house_pops.max(axis=1) / math.sqrt(2) * 2 + 1
+    for _ in range(num_iterations):
+        mid = np.sqrt(lo * hi)
+        too_many = extra_seats(mid).sum(axis=1) > remaining
+        lo = np.where(too_many, mid, lo)
+        hi = np.where(too_many, hi, mid)
+
+    extra = extra_seats(hi)
+
+    # Check exactly that the seats we handed out have higher priority than the
+    # ones we didn't
+    last_given = np.where(extra > 0, _priority(house_pops, extra), np.inf)
+    next_up = _priority(house_pops, extra + 1)
+    next_up = np.where(_NOT_DC, next_up, -np.inf)
+    exact = (extra.sum(axis=1) == remaining) & (
+        last_given.min(axis=1) > next_up.max(axis=1)
+    )
+
+    electors = np.where(has_population, 3 + extra, 0).astype(int)
+    electors[:, DC] = np.where(has_population[:, DC], 3, 0)
+    for i in np.flatnonzero(~exact):
+        electors[i] = apportion_one(pops[i])
+
+    return electors.reshape(shape)
+
+
+def state_totals(
+    assignments: np.ndarray, values: np.ndarray, num_states: int = NUM_STATES
+) -> np.ndarray:
+    """
+    Total up county values by state for a batch of maps.
+
+    Args:
+        assignments: An integer array of shape (num_maps, num_counties) giving the
+            state index of each county in each map. NO_STATE is ignored.
+        values: An array of shape (num_counties,) of per-county values
+
+    Returns:
+        An array of shape (num_maps, num_states)
+    """
+    assignments = np.atleast_2d(assignments)
+    num_maps, num_counties = assignments.shape
+    width = num_states + 1
+    flat = (assignments + width * np.arange(num_maps)[:, None]).ravel()
+    weights = np.broadcast_to(values, (num_maps, num_counties)).ravel()
+    totals = np.bincount(flat, weights=weights, minlength=num_maps * width)
+    return totals.reshape(num_maps, width)[:, :num_states]
+
+
+@dataclass
+class Outcome:
+    """
+    The electoral outcome of a batch of maps. Every array has one row per map.
+    """
+
+    population: np.ndarray  # (num_maps, NUM_STATES)
+    dem: np.ndarray  # (num_maps, NUM_STATES) votes
+    gop: np.ndarray  # (num_maps, NUM_STATES) votes
+    electors: np.ndarray  # (num_maps, NUM_STATES)
+    dem_electors: np.ndarray  # (num_maps,)
+    gop_electors: np.ndarray  # (num_maps,)
+
+    @property
+    def dem_wins(self) -> np.ndarray:
+        return self.dem > self.gop
+
+
+def outcome_from_totals(
+    population: np.ndarray, dem: np.ndarray, gop: np.ndarray
+) -> Outcome:
+    """
+    Score maps given their state totals. As in the javascript app, a state goes to
+    the Democrat only if they have strictly more votes.
+    """
+    population, dem, gop = (np.atleast_2d(x) for x in (population, dem, gop))
+    electors = apportion(population)
+    dem_wins = dem > gop
+    return Outcome(
+        population=population,
+        dem=dem,
+        gop=gop,
+        electors=electors,
+        dem_electors=np.where(dem_wins, electors, 0).sum(axis=1),
+        gop_electors=np.where(dem_wins, 0, electors).sum(axis=1),
+    )
+
+
+def evaluate(
+    assignments: np.ndarray,
+    population: np.ndarray,
+    dem: np.ndarray,
+    gop: np.ndarray,
+) -> Outcome:
+    """
+    Score a batch of county -> state assignments.
+
+    Args:
+        assignments: An integer array of shape (num_maps, num_counties) of state
+            indices (see `constants.STATE_ABBREVS`)
+        population: The population of each county
+        dem: The Democratic votes in each county
+        gop: The Republican votes in each county
+
+    Returns:
+        The outcome of each map
+    """
+    return outcome_from_totals(
+        state_totals(assignments, population),
+        state_totals(assignments, dem),
+        state_totals(assignments, gop),
+    )
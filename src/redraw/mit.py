@@ -6,11 +6,13 @@ Parsing and using the MIT data::
 
 import dataclasses
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import Optional
 
 import geopandas as gpd
 import pandas as pd
 
+from . import results, rules
+
 
 @dataclass(frozen=True, order=True)
 class CountyResult:
@@ -28,7 +30,18 @@ class CountyResult:
 
 
 def read_data(filename: str, year: int) -> pd.DataFrame:
-    df = pd.read_csv(filename)
+    """
+    Read the MIT data for `year`, apply our county fixups (see `rules.RULES`), and
+    total up the votes by county and party.
+
+    Returns:
+        A DataFrame with columns "state_po", "county", "FIPS", "party", and
+            "candidatevotes"
+    """
+    df = pd.read_csv(
+        filename,
+        usecols=["year", "state_po", "county", "FIPS", "party", "candidatevotes"],
+    )
 
     # Drop all rows without a FIPS code
     #
@@ -36,122 +49,62 @@ def read_data(filename: str, year: int) -> pd.DataFrame:
     #       seems to have had about 70k write in votes in 2012 (about 2% of
     #       their total vote) which is counted at the state level and so
     #       has no FIPS attached to it.
-    df = df[df["FIPS"].notna()].copy()
-    df["FIPS"] = df["FIPS"].apply(lambda x: f"{int(x):05d}")
-    df = df[df["year"] == year].copy()
-
-    df["party"] = df["party"].fillna("other")
-
-    # Merge all of Alaska's election districts (which do not really align
-    # with their counties) into just the whole state.
-    ak_only = df[df["state_po"] == "AK"]
-    ak_only = (
-        ak_only.groupby(
-            ["year", "state", "state_po", "office", "party", "candidate", "version"]
-        )["candidatevotes"]
-        .sum()
-        .reset_index()
-    )
-    ak_only["county"] = "Alaska"
-    ak_only["FIPS"] = "02000"
-    ak_only["totalvotes"] = ak_only.groupby("county")["candidatevotes"].transform("sum")
-
-    df = pd.concat([df[df["state_po"] != "AK"], ak_only])
-
-    # Keep our conventions for the name of DC's "county" (Washington) and
-    # its FIPS code (which is its actual FIPS code)
-    df.loc[df["state_po"] == "DC", "county"] = "Washington"
-    df.loc[df["state_po"] == "DC", "FIPS"] = "11001"
-
-    # Kansas City, Missouri, spans parts of four counties. The MIT data reports
-    # the results for KCMO separately (with FIPS 36000). We follow what appears to be
-    # the New York Times' convention and simply add these votes to Jackson County's
-    # total (FIPS 29095)
-    kcmo_only = df[df["FIPS"].isin(["36000", "29095"])]
-    kcmo_only = (
-        kcmo_only.groupby(
-            ["year", "state", "state_po", "office", "party", "candidate", "version"]
-        )["candidatevotes"]
-        .sum()
-        .reset_index()
-    )
-    kcmo_only["county"] = "Jackson"
-    kcmo_only["FIPS"] = "29095"
-    kcmo_only["totalvotes"] = kcmo_only.groupby("county")["candidatevotes"].transform(
-        "sum"
+    df = df[df["FIPS"].notna() & (df["year"] == year)]
+    df = df.assign(
+        FIPS=df["FIPS"].astype(int).astype(str).str.zfill(5),
+        party=df["party"].fillna("other"),
+        candidatevotes=df["candidatevotes"].fillna(0),
     )
 
-    df = pd.concat([df[~df["FIPS"].isin(["36000", "29095"])], kcmo_only])
-
-    # Broomfield County, Colorado, came into being in 2001. However, the Census
-    # doesn't have easily parsed cartographic boundaries for the years 2001-2009.
-    # As such, we just merge Broomfield (FIPS 08014) into Boulder (FIPS 08013)
-    # for the years 2004 and 2008
-    if year == 2004 or year == 2008:
-        brco_only = df[df["FIPS"].isin(["08013", "08014"])]
-        brco_only = (
-            brco_only.groupby(
-                ["year", "state", "state_po", "office", "party", "candidate", "version"]
-            )["candidatevotes"]
-            .sum()
-            .reset_index()
-        )
-        brco_only["county"] = "Boulder"
-        brco_only["FIPS"] = "08013"
-        brco_only["totalvotes"] = brco_only.groupby("county")[
-            "candidatevotes"
-        ].transform("sum")
-
-        df = pd.concat([df[~df["FIPS"].isin(["08013", "08014"])], brco_only])
+    return rules.apply_to_frame(
+        df,
+        year,
+        id_col="FIPS",
+        values=["candidatevotes"],
+        keys=["state_po", "party"],
+        name_col="county",
+    )
 
-    return df
 
+def parse_data(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Turn the output of `read_data` into one row per county
 
-def parse_data(df: pd.DataFrame) -> List[CountyResult]:
-    # Pivot the data and if greens are not present add them
+    Returns:
+        A DataFrame with one column per field of CountyResult
+    """
     df = (
-        df[["state_po", "county", "FIPS", "party", "candidatevotes"]]
-        .pivot_table(
-            index=["state_po", "county", "FIPS"],
-            columns="party",
-            values="candidatevotes",
-            aggfunc="sum",
-        )
+        df.pivot(index=["state_po", "county", "FIPS"], columns="party")[
+            "candidatevotes"
+        ]
+        .reindex(columns=["democrat", "republican", "green", "other"])
         .fillna(0)
         .astype(int)
+        .rename_axis(columns=None)
         .reset_index()
     )
 
-    if "green" not in df.columns:
-        df["green"] = 0
-
-    output = []
-    for _, row in df.iterrows():
-        output.append(
-            CountyResult(
-                state=row["state_po"],
-                county=row["county"],
-                fips=row["FIPS"],
-                dem_vote=row["democrat"],
-                gop_vote=row["republican"],
-                green_vote=row["green"],
-                other_vote=row["other"],
-            )
-        )
-
-    return output
+    return df.rename(
+        columns={
+            "state_po": "state",
+            "FIPS": "fips",
+            "democrat": "dem_vote",
+            "republican": "gop_vote",
+            "green": "green_vote",
+            "other": "other_vote",
+        }
+    )[[field.name for field in dataclasses.fields(CountyResult)]]
 
 
-def merge_data(parsed: List[CountyResult], gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+def merge_data(
+    parsed: list[CountyResult] | pd.DataFrame, gdf: gpd.GeoDataFrame
+) -> gpd.GeoDataFrame:
     """
-    Merge together the parsed data from `parsed_data` with the GeoDataFrame
-    from the Census. Note that this standardizes for the column headers the
-    javascript app expects.
+    Merge together the parsed data from `parsed_data` (either as a list or as a
+    DataFrame from the results cache) with the GeoDataFrame from the Census. Note
+    that this standardizes for the column headers the javascript app expects.
     """
-    df = pd.DataFrame(
-        [dataclasses.astuple(row) for row in parsed],
-        columns=[field.name for field in dataclasses.fields(CountyResult)],
-    )
+    df = results.to_frame(parsed, CountyResult)
 
     gdf = gdf.merge(df.drop(columns=["state"]), left_on="id", right_on="fips")
     gdf = gdf.rename(
@@ -2,17 +2,21 @@
 Interacting with the NYT Elections data API for 2020
 """
 
-import asyncio
-import dataclasses
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 from enum import Enum
-from typing import Dict, List
+from typing import List
 
-import aiohttp
 import geopandas as gpd
+import msgspec
+import numpy as np
 import pandas as pd
 import us
 
+from . import nytapi, results
+
+# Every state that votes for president, along with DC
+STATES = us.STATES + [us.states.DC]
+
 
 class KEYS(str, Enum):
     """
@@ -41,137 +45,92 @@ class CountyResult:
     jorgensen_vote: int
 
 
-def fix_state_name(state_name: str) -> str:
-    """
-    Convert a state name to the format the NYT API expects
+# The candidates in the order of CountyResult's vote fields
+CANDIDATES = [KEYS.BIDEN, KEYS.TRUMP, KEYS.JORGENSEN]
+VOTE_FIELDS = [
+    field.name for field in fields(CountyResult) if field.name.endswith("_vote")
+]
+_CANDIDATE_COLUMNS = {str(key): i for i, key in enumerate(CANDIDATES)}
 
-    Args:
-        state_name: The formal state name, e.g., "West Virginia"
 
-    Returns:
-        The converted name, e.g., "west-virginia"
+class _County(msgspec.Struct):
+    name: str
+    fips: str
+    results: dict[str, int]
+
+
+class _Race(msgspec.Struct):
+    counties: list[_County]
+
+
+class _Data(msgspec.Struct):
+    races: list[_Race]
+
+
+class Payload(msgspec.Struct):
+    """
+    The parts of a state's results that we read. Decoding skips everything else,
+    and fails if anything we read is missing or has changed type.
     """
-    return state_name.lower().strip().replace(" ", "-")
+
+    data: _Data
 
 
-async def fetch_state(
-    session: aiohttp.ClientSession,
-    sem: asyncio.Semaphore,
-    state_name: str,
-    num_attempts: int = 3,
-) -> dict:
+_DECODER = msgspec.json.Decoder(Payload)
+
+
+def state_url(state_name: str) -> str:
     """
-    Fetch a particular state's data from the NYT API.
+    The URL of a state's results, e.g., for "North Carolina"
+    """
+    state_name = nytapi.fix_state_name(state_name)
+    return f"https://static01.nyt.com/elections-assets/2020/data/api/2020-11-03/race-page/{state_name}/president.json"
 
-    Args:
-        session: An aiohttp ClientSession in which to fetch the data
-        sem: A semaphore to bound the maximum number of simultaneous
-             hits to the NYT API (be kind!)
-        state_name: The state name spelled like "North Carolina" to pull
-        num_attempts: The maximum number of retries in case something goes wrong
+
+def parse_state(
+    state: str, data: bytes | str | dict
+) -> tuple[list[str], list[str], np.ndarray]:
+    """
+    Parse one state's results.
 
     Returns:
-        The raw data from the NYT API
+        The FIPS and names of its counties, and their votes with a column for each
+            of CANDIDATES
     """
-    state_name = fix_state_name(state_name)
-    url = f"https://static01.nyt.com/elections-assets/2020/data/api/2020-11-03/race-page/{state_name}/president.json"
-    for num_attempt in range(num_attempts):
-        async with sem:
-            async with session.get(url) as response:
-                if response.ok:
-                    await asyncio.sleep(2 ** (num_attempt - 2))
-                    return await response.json()
-        await asyncio.sleep(2 ** (num_attempt - 2))
-
-    raise EnvironmentError(
-        f"Something went wrong after {num_attempts} to pull {state_name} data"
+    counties = nytapi.decode(data, _DECODER).data.races[0].counties
+
+    # AK and DC behave slightly differently: their results are summed into a
+    # single row
+    statewide = state in ["AK", "DC"]
+    codes, votes = nytapi.tally(
+        (
+            (0 if statewide else int(county.fips[-3:]), county.results.items())
+            for county in counties
+        ),
+        _CANDIDATE_COLUMNS,
+        len(CANDIDATES),
     )
 
+    if statewide:
+        fips = ["02000" if state == "AK" else "11001"]
+        names = ["Alaska" if state == "AK" else "Washington"]
+    else:
+        by_code = {int(county.fips[-3:]): county for county in reversed(counties)}
+        fips = [by_code[code].fips[-5:] for code in codes]
+        names = [by_code[code].name for code in codes]
 
-async def fetch_all_states(
-    max_connections: int = 3, num_attempts_per_state: int = 3
-) -> Dict[str, dict]:
-    """
-    Pull the data from _all_ states that vote in the US
-    presidential election from the NYT API
+    return fips, names, votes
 
-    Args:
-        max_connections: The maximum number of connections to the NYT API at a time
-        num_attempts_per_state: The maximum number of pull attempts to make per state
-            before erroring
 
-    Returns:
-        [state abbreviation] -> [raw data from NYT]
+def merge_data(
+    parsed: List[CountyResult] | pd.DataFrame, gdf: gpd.GeoDataFrame
+) -> gpd.GeoDataFrame:
     """
-    sem = asyncio.Semaphore(max_connections)
-    states = us.STATES + [us.states.DC]
-    async with aiohttp.ClientSession() as session:
-        data = await asyncio.gather(
-            *[
-                fetch_state(
-                    session, sem, state.name, num_attempts=num_attempts_per_state
-                )
-                for state in states
-            ]
-        )
-
-    return {state.abbr: datum for state, datum in zip(states, data)}
-
-
-def parse_data(results: Dict[str, dict]) -> List[CountyResult]:
+    Merge together the parsed data from `parsed_data` (either as a list or as a
+    DataFrame from the results cache) with the GeoDataFrame from the Census. Note
+    that this standardizes for the column headers the javascript app expects.
     """
-    Parse the raw data into a CSV that can be written to disk
-    """
-    output = []
-    for state, data in results.items():
-        if state not in ["AK", "DC"]:
-            for county_data in data["data"]["races"][0]["counties"]:
-                output.append(
-                    CountyResult(
-                        state=state,
-                        county=county_data["name"],
-                        fips=county_data["fips"][-5:],
-                        biden_vote=county_data["results"].get(KEYS.BIDEN, 0),
-                        trump_vote=county_data["results"].get(KEYS.TRUMP, 0),
-                        jorgensen_vote=county_data["results"].get(KEYS.JORGENSEN, 0),
-                    )
-                )
-        else:
-            # AK and DC behave slightly differently
-            county = "Alaska" if state == "AK" else "Washington"
-            deep_data = data["data"]["races"][0]["counties"]
-            output.append(
-                CountyResult(
-                    state=state,
-                    county=county,
-                    fips="02000" if state == "AK" else "11001",
-                    biden_vote=sum(
-                        county_data["results"].get(KEYS.BIDEN, 0)
-                        for county_data in deep_data
-                    ),
-                    trump_vote=sum(
-                        county_data["results"].get(KEYS.TRUMP, 0)
-                        for county_data in deep_data
-                    ),
-                    jorgensen_vote=sum(
-                        county_data["results"].get(KEYS.JORGENSEN, 0)
-                        for county_data in deep_data
-                    ),
-                )
-            )
-    return output
-
-
-def merge_data(parsed: List[CountyResult], gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
-    """
-    Merge together the parsed data from `parsed_data` with the GeoDataFrame
-    from the Census. Note that this standardizes for the column headers the
-    javascript app expects.
-    """
-    df = pd.DataFrame(
-        [dataclasses.astuple(row) for row in parsed],
-        columns=[field.name for field in dataclasses.fields(CountyResult)],
-    )
+    df = results.to_frame(parsed, CountyResult)
 
     gdf = gdf.merge(df.drop(columns=["state"]), left_on="id", right_on="fips")
     gdf = gdf.rename(
@@ -181,3 +140,9 @@ def merge_data(parsed: List[CountyResult], gdf: gpd.GeoDataFrame) -> gpd.GeoData
     gdf["una"] = 0
 
     return gdf
+
+
+SOURCE = nytapi.Source(STATES, state_url, parse_state, VOTE_FIELDS)
+PARSER_MODULES = [nytapi]  # Where the rest of our parsing lives
+parse_data = SOURCE.parse_data
+fetch_all_states = SOURCE.fetch_all_states
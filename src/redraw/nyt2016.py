@@ -2,19 +2,26 @@
 Pulling 2016 election data
 """
 
-import dataclasses
-import json
-import time
+import re
 from dataclasses import dataclass
 from enum import Enum
-from typing import List
+from typing import Iterable, Iterator, List
 
 import geopandas as gpd
+import msgspec
 import pandas as pd
-import requests
+
+from . import cache, results
 
 URL = "https://www.nytimes.com/elections/2016/results/president"
 
+# What precedes the results in the coverage's HTML
+RACES_MARKER = b"eln_races = "
+
+# What we look for in and out of JSON strings when scanning for the results' end
+_IN_STRING = re.compile(rb'["\\]')
+_STRUCTURAL = re.compile(rb'["\[\]{}]')
+
 
 class KEYS(str, Enum):
     """
@@ -47,39 +54,82 @@ class CountyResult:
     mcmullin_vote: int
 
 
-def pull_data(url: str = URL, num_attempts: int = 3) -> list:
+def extract_races(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    Stream the JSON assigned to `eln_races` out of the chunks of the coverage's
+    HTML, stopping as soon as it's complete. We only track strings and nesting, so
+    only a chunk at a time is ever in memory.
+
+    Raises:
+        ValueError: If the page has no eln_races, or it isn't a complete JSON
+            array or object
+    """
+    chunks = iter(chunks)
+
+    # Find the marker, which may straddle two chunks
+    buffer = b""
+    for chunk in chunks:
+        buffer += chunk
+        start = buffer.find(RACES_MARKER)
+        if start >= 0:
+            buffer = buffer[start + len(RACES_MARKER) :].lstrip()
+            break
+        buffer = buffer[-len(RACES_MARKER) + 1 :]
+    else:
+        raise ValueError("The 2016 coverage has no eln_races")
+
+    while not buffer:
+        buffer = next(chunks, b"").lstrip()
+        if not buffer:
+            raise ValueError("The 2016 coverage's eln_races is incomplete")
+    if buffer[:1] not in (b"[", b"{"):
+        raise ValueError("The 2016 coverage's eln_races isn't a JSON array or object")
+
+    depth = 0
+    in_string = False
+    skip = 0  # Bytes of the next chunk escaped at the end of this one
+    while True:
+        pos = skip
+        while match := (_IN_STRING if in_string else _STRUCTURAL).search(buffer, pos):
+            pos = match.end()
+            char = match.group()
+            if char == b"\\":
+                pos += 1
+            elif char == b'"':
+                in_string = not in_string
+            elif char in (b"[", b"{"):
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    yield buffer[:pos]
+                    return
+
+        skip = max(0, pos - len(buffer))
+        yield buffer
+        buffer = next(chunks, None)
+        if buffer is None:
+            raise ValueError("The 2016 coverage's eln_races is incomplete")
+
+
+RACES = cache.Extractor("eln_races", ".json", extract_races)
+
+
+def pull_data(url: str = URL, force: bool = False) -> list:
     """
-    Pull data from the NYT 2016 election coverage.
+    Pull data from the NYT 2016 election coverage. Only the results embedded in
+    the page are kept, in the download cache, so later pulls skip the HTML.
 
     Args:
         url: The url of the election coverage
-        num_attempts: The number of HTTP retries
+        force: If set, download the coverage even if we have its results cached
 
     Return:
         The raw dictionary of their election coverage
     """
-    data = None
-    for num_attempt in range(num_attempts):
-        try:
-            response = requests.get(url)
-            response.raise_for_status()
-            data = response.content.decode("utf8")
-            break
-        except requests.exceptions.HTTPError:
-            time.sleep(2 ** (num_attempt - 2))
-            continue
-
-    if not data:
-        raise ValueError(f"Could not pull {url}")
-
-    for line in data.split("\n"):
-        line = line.strip()
-        if line.startswith("eln_races = "):
-            line = line[len("eln_races = ") : -1]
-            parsed = json.loads(line)
-            break
-
-    return parsed
+    return msgspec.json.decode(
+        cache.fetch(url, force=force, extractor=RACES).read_bytes()
+    )
 
 
 def parse_data(results: list) -> List[CountyResult]:
@@ -115,16 +165,15 @@ def parse_data(results: list) -> List[CountyResult]:
     return output
 
 
-def merge_data(parsed: List[CountyResult], gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+def merge_data(
+    parsed: List[CountyResult] | pd.DataFrame, gdf: gpd.GeoDataFrame
+) -> gpd.GeoDataFrame:
     """
-    Merge together the parsed data from `parsed_data` with the GeoDataFrame
-    from the Census. Note that this standardizes for the column headers the
-    javascript app expects.
+    Merge together the parsed data from `parsed_data` (either as a list or as a
+    DataFrame from the results cache) with the GeoDataFrame from the Census. Note
+    that this standardizes for the column headers the javascript app expects.
     """
-    df = pd.DataFrame(
-        [dataclasses.astuple(row) for row in parsed],
-        columns=[field.name for field in dataclasses.fields(CountyResult)],
-    )
+    df = results.to_frame(parsed, CountyResult)
 
     gdf = gdf.merge(df.drop(columns=["state"]), left_on="id", right_on="fips")
     gdf = gdf.rename(
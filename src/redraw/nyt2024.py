@@ -2,30 +2,32 @@
 Interacting with the NYT Elections data API for 2020
 """
 
-import asyncio
-import dataclasses
 import importlib
 import importlib.resources
-from collections import defaultdict, namedtuple
+from collections import namedtuple
 from contextlib import contextmanager
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 from enum import StrEnum
 from functools import lru_cache
-from pathlib import PosixPath
-from urllib.parse import urlsplit
+from typing import Iterable, Optional
 
-import aiohttp
 import geopandas as gpd
+import msgspec
+import numpy as np
 import pandas as pd
-import requests
 import us
 
-from .constants import CACHE_DIR
+from . import cache, nytapi, results
 
 COUNTY_TIGER = (
     "https://www2.census.gov/geo/tiger/TIGER{year}/COUNTY/tl_{year}_us_county.zip"
 )
 
+# Every state that votes for president, along with DC, which the NYT spells
+# differently this year
+_State = namedtuple("_State", ["name", "abbr"])
+STATES = us.STATES + [_State("washington dc", "DC")]
+
 
 class KEYS(StrEnum):
     """
@@ -55,20 +57,54 @@ class CountyResult:
     oliver_vote: int
 
 
-@contextmanager
-def open_or_download(url: str, force: bool = False):
-    path = CACHE_DIR / PosixPath(urlsplit(url).path).name
+# The candidates in the order of CountyResult's vote fields
+CANDIDATES = [KEYS.HARRIS, KEYS.TRUMP, KEYS.KENNEDY, KEYS.STEIN, KEYS.OLIVER]
+VOTE_FIELDS = [
+    field.name for field in fields(CountyResult) if field.name.endswith("_vote")
+]
+_CANDIDATE_COLUMNS = {str(key): i for i, key in enumerate(CANDIDATES)}
+
+# The states whose results come by township
+NEW_ENGLAND_FIPS = {"MA": "25", "ME": "23", "VT": "50", "NH": "33", "RI": "44"}
+
+
+class _Votes(msgspec.Struct):
+    total: int
+
+
+class _Candidate(msgspec.Struct):
+    nyt_id: str
+    votes: _Votes
+
+
+class _ReportingUnit(msgspec.Struct):
+    level: str
+    candidates: list[_Candidate]
+    name: Optional[str] = None
+    fips_state: Optional[str] = None
+    fips_county: Optional[str] = None
+    fips_suffix: Optional[str] = None
 
-    if force or (not path.exists()):
-        CACHE_DIR.mkdir(parents=True, exist_ok=True)
 
-        with requests.get(url, stream=True) as resp:
-            resp.raise_for_status()
-            with open(path, "wb") as outfile:
-                for chunk in resp.iter_content(8192):
-                    outfile.write(chunk)
+class _Race(msgspec.Struct):
+    reporting_units: list[_ReportingUnit]
 
-    with open(path, "rb") as infile:
+
+class Payload(msgspec.Struct):
+    """
+    The parts of a state's results that we read. Decoding skips everything else,
+    and fails if anything we read is missing or has changed type.
+    """
+
+    races: list[_Race]
+
+
+_DECODER = msgspec.json.Decoder(Payload)
+
+
+@contextmanager
+def open_or_download(url: str, force: bool = False):
+    with open(cache.fetch(url, force=force), "rb") as infile:
         yield infile
 
 
@@ -88,6 +124,7 @@ def get_fips_to_county_name(force: bool = False) -> dict[str, str]:
     )
 
 
+@lru_cache
 def generate_ct_mapping(
     force: bool = False,
 ) -> tuple[dict[str, str], dict[str, str]]:
@@ -138,224 +175,100 @@ def generate_ct_mapping(
     return county_town_to_new_county, cogs
 
 
-def fix_state_name(state_name: str) -> str:
+def state_url(state_name: str) -> str:
     """
-    Convert a state name to the format the NYT API expects
-
-    Args:
-        state_name: The formal state name, e.g., "West Virginia"
-
-    Returns:
-        The converted name, e.g., "west-virginia"
+    The URL of a state's results, e.g., for "North Carolina"
     """
-    return state_name.lower().strip().replace(" ", "-")
+    state_name = nytapi.fix_state_name(state_name)
+    return f"https://static01.nyt.com/elections-assets/pages/data/2024-11-05/results-{state_name}-president.json"
 
 
-async def fetch_state(
-    session: aiohttp.ClientSession,
-    sem: asyncio.Semaphore,
-    state_name: str,
-    num_attempts: int = 3,
-) -> dict:
+def tally(
+    units: Iterable[tuple[int, list[_Candidate]]],
+) -> tuple[np.ndarray, np.ndarray]:
     """
-    Fetch a particular state's data from the NYT API.
+    Sum the votes in reporting units by county (see `nytapi.tally`).
 
     Args:
-        session: An aiohttp ClientSession in which to fetch the data
-        sem: A semaphore to bound the maximum number of simultaneous
-             hits to the NYT API (be kind!)
-        state_name: The state name spelled like "North Carolina" to pull
-        num_attempts: The maximum number of retries in case something goes wrong
-
-    Returns:
-        The raw data from the NYT API
+        units: Pairs of (three digit county FIPS, the unit's candidates)
     """
-    state_name = fix_state_name(state_name)
-    url = f"https://static01.nyt.com/elections-assets/pages/data/2024-11-05/results-{state_name}-president.json"
-    for num_attempt in range(num_attempts):
-        async with sem:
-            async with session.get(url) as response:
-                if response.ok:
-                    await asyncio.sleep(2 ** (num_attempt - 2))
-                    return await response.json()
-        await asyncio.sleep(2 ** (num_attempt - 2))
-
-    raise EnvironmentError(
-        f"Something went wrong after {num_attempts} to pull {state_name} data"
+    return nytapi.tally(
+        (
+            (county, ((c.nyt_id, c.votes.total) for c in candidates))
+            for county, candidates in units
+        ),
+        _CANDIDATE_COLUMNS,
+        len(CANDIDATES),
     )
 
 
-async def fetch_all_states(
-    max_connections: int = 3, num_attempts_per_state: int = 3
-) -> dict[str, dict]:
+def parse_state(
+    state: str, data: bytes | str | dict
+) -> tuple[list[str], list[str], np.ndarray]:
     """
-    Pull the data from _all_ states that vote in the US
-    presidential election from the NYT API
-
-    Args:
-        max_connections: The maximum number of connections to the NYT API at a time
-        num_attempts_per_state: The maximum number of pull attempts to make per state
-            before erroring
+    Parse one state's results.
 
     Returns:
-        [state abbreviation] -> [raw data from NYT]
+        The FIPS and names of its counties, and their votes with a column for each
+            of CANDIDATES
     """
-    sem = asyncio.Semaphore(max_connections)
-
-    tmp = namedtuple("state_tmp", ["name", "abbr"])
-    states = us.STATES + [tmp("washington dc", "DC")]
-
-    async with aiohttp.ClientSession() as session:
-        data = await asyncio.gather(
-            *[
-                fetch_state(
-                    session, sem, state.name, num_attempts=num_attempts_per_state
-                )
-                for state in states
-            ]
+    units = nytapi.decode(data, _DECODER).races[0].reporting_units
+
+    if state in ["AK", "DC"]:
+        # AK and DC behave differently than others
+        _, votes = tally([(0, units[0].candidates)])
+        return (
+            ["11001" if state == "DC" else "02000"],
+            ["Washington" if state == "DC" else "Alaska"],
+            votes,
         )
 
-    return {state.abbr: datum for state, datum in zip(states, data)}
+    if state == "CT":
+        # CT got rid of their counties in 2022 for Census purposes
+        # So we have to do some surgery
+        county_to_cog, cogs = generate_ct_mapping()
+        counties, votes = tally(
+            (int(county_to_cog[unit.fips_county + unit.fips_suffix]), unit.candidates)
+            for unit in units
+            if unit.level == "township"
+        )
+        codes = [f"{county:03d}" for county in counties]
+        return [f"09{code}" for code in codes], [cogs[code] for code in codes], votes
+
+    if state in NEW_ENGLAND_FIPS:
+        # The New England townships are very annoying
+        counties, votes = tally(
+            (int(unit.fips_county), unit.candidates)
+            for unit in units
+            if unit.level == "township"
+        )
+        fips = [f"{NEW_ENGLAND_FIPS[state]}{county:03d}" for county in counties]
+        # Only look up names (from a Census download) when we need them
+        county_fips_to_name = get_fips_to_county_name()
+        return fips, [county_fips_to_name[f] for f in fips], votes
+
+    county_units = [unit for unit in units if unit.level == "county"]
+    counties, votes = tally(
+        (int(unit.fips_county), unit.candidates) for unit in county_units
+    )
+    names = {int(unit.fips_county): unit.name for unit in reversed(county_units)}
+    state_fips = county_units[0].fips_state if county_units else ""
+    return (
+        [f"{state_fips}{county:03d}" for county in counties],
+        [names[county] for county in counties],
+        votes,
+    )
 
 
-def parse_data(results: dict[str, dict]) -> list[CountyResult]:
-    """
-    Parse the raw data into a CSV that can be written to disk
+def merge_data(
+    parsed: list[CountyResult] | pd.DataFrame, gdf: gpd.GeoDataFrame
+) -> gpd.GeoDataFrame:
     """
-    county_fips_to_name = get_fips_to_county_name()
-    output = []
-    for state, data in results.items():
-        if state not in ["AK", "DC", "CT", "MA", "ME", "VT", "NH", "RI"]:
-            for county_data in data["races"][0]["reporting_units"]:
-                if county_data["level"] != "county":
-                    continue
-
-                votes = {
-                    c["nyt_id"]: c["votes"]["total"] for c in county_data["candidates"]
-                }
-
-                output.append(
-                    CountyResult(
-                        state=state,
-                        county=county_data["name"],
-                        fips=county_data["fips_state"] + county_data["fips_county"],
-                        harris_vote=votes.get(KEYS.HARRIS, 0),
-                        trump_vote=votes.get(KEYS.TRUMP, 0),
-                        kennedy_vote=votes.get(KEYS.KENNEDY, 0),
-                        stein_vote=votes.get(KEYS.STEIN, 0),
-                        oliver_vote=votes.get(KEYS.OLIVER, 0),
-                    )
-                )
-
-        elif state == "CT":
-            # CT got rid of their counties in 2022 for Census purposes
-            # So we have to do some surgery
-            county_to_cog, cogs = generate_ct_mapping()
-
-            counts = defaultdict(lambda: {val: 0 for val in KEYS})
-
-            for township_data in data["races"][0]["reporting_units"]:
-                if township_data["level"] != "township":
-                    continue
-
-                votes = {
-                    c["nyt_id"]: c["votes"]["total"]
-                    for c in township_data["candidates"]
-                }
-
-                for key in KEYS:
-                    counts[
-                        county_to_cog[
-                            township_data["fips_county"] + township_data["fips_suffix"]
-                        ]
-                    ][key] += votes.get(key, 0)
-
-            for fips, count in counts.items():
-                output.append(
-                    CountyResult(
-                        state="CT",
-                        county=cogs[fips],
-                        fips=f"09{fips}",
-                        harris_vote=count[KEYS.HARRIS],
-                        trump_vote=count[KEYS.TRUMP],
-                        kennedy_vote=count[KEYS.KENNEDY],
-                        stein_vote=count[KEYS.STEIN],
-                        oliver_vote=count[KEYS.OLIVER],
-                    )
-                )
-
-        elif state in ["MA", "ME", "VT", "NH", "RI"]:
-            # The New England townships are very annoying
-            counts = defaultdict(lambda: {val: 0 for val in KEYS})
-
-            for township_data in data["races"][0]["reporting_units"]:
-                if township_data["level"] != "township":
-                    continue
-
-                votes = {
-                    c["nyt_id"]: c["votes"]["total"]
-                    for c in township_data["candidates"]
-                }
-
-                for key in KEYS:
-                    counts[township_data["fips_county"]][key] += votes.get(key, 0)
-
-            state_fips = {
-                "MA": 25,
-                "ME": 23,
-                "VT": 50,
-                "NH": 33,
-                "RI": 44,
-            }[state]
-            for fips, vals in counts.items():
-                full_fips = f"{state_fips}{fips}"
-                output.append(
-                    CountyResult(
-                        state=state,
-                        county=county_fips_to_name[
-                            full_fips
-                        ],  # Not sure if I actually need the name...
-                        fips=full_fips,
-                        harris_vote=vals[KEYS.HARRIS],
-                        trump_vote=vals[KEYS.TRUMP],
-                        kennedy_vote=vals[KEYS.KENNEDY],
-                        stein_vote=vals[KEYS.STEIN],
-                        oliver_vote=vals[KEYS.OLIVER],
-                    )
-                )
-
-        else:
-            # AK and DC behave differently than others
-            votes = {
-                c["nyt_id"]: c["votes"]["total"]
-                for c in data["races"][0]["reporting_units"][0]["candidates"]
-            }
-
-            output.append(
-                CountyResult(
-                    state=state,
-                    county="Washington" if state == "DC" else "Alaska",
-                    fips="11001" if state == "DC" else "02000",
-                    harris_vote=votes.get(KEYS.HARRIS, 0),
-                    trump_vote=votes.get(KEYS.TRUMP, 0),
-                    kennedy_vote=votes.get(KEYS.KENNEDY, 0),
-                    stein_vote=votes.get(KEYS.STEIN, 0),
-                    oliver_vote=votes.get(KEYS.OLIVER, 0),
-                )
-            )
-    return output
-
-
-def merge_data(parsed: list[CountyResult], gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    Merge together the parsed data from `parsed_data` (either as a list or as a
+    DataFrame from the results cache) with the GeoDataFrame from the Census. Note
+    that this standardizes for the column headers the javascript app expects.
     """
-    Merge together the parsed data from `parsed_data` with the GeoDataFrame
-    from the Census. Note that this standardizes for the column headers the
-    javascript app expects.
-    """
-    df = pd.DataFrame(
-        [dataclasses.astuple(row) for row in parsed],
-        columns=[field.name for field in dataclasses.fields(CountyResult)],
-    )
+    df = results.to_frame(parsed, CountyResult)
 
     gdf = gdf.merge(df.drop(columns=["state"]), left_on="id", right_on="fips")
     gdf = gdf.rename(
@@ -369,3 +282,9 @@ def merge_data(parsed: list[CountyResult], gdf: gpd.GeoDataFrame) -> gpd.GeoData
     )
 
     return gdf
+
+
+SOURCE = nytapi.Source(STATES, state_url, parse_state, VOTE_FIELDS)
+PARSER_MODULES = [nytapi]  # Where the rest of our parsing lives
+parse_data = SOURCE.parse_data
+fetch_all_states = SOURCE.fetch_all_states
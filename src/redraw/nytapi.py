@@ -0,0 +1,203 @@
+"""
+What pulling results from the NYT Elections data API has in common across years.
+Each year's module (`nyt` for 2020, `nyt2024`) describes its payload and how to
+parse one state of it, and wraps that in a `Source`, which pulls and combines
+every state.
+"""
+
+import asyncio
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Optional, Sequence
+
+import msgspec
+import numpy as np
+import pandas as pd
+
+from . import client
+
+# What a module's `parse_state` returns: the FIPS and names of a state's counties,
+# and their votes with a column per vote field
+ParsedState = tuple[list[str], list[str], np.ndarray]
+
+# Three digit county FIPS are below 1000, so we can index votes by them directly
+NUM_COUNTY_CODES = 1000
+
+
+def fix_state_name(state_name: str) -> str:
+    """
+    Convert a state name to the format the NYT API expects
+
+    Args:
+        state_name: The formal state name, e.g., "West Virginia"
+
+    Returns:
+        The converted name, e.g., "west-virginia"
+    """
+    return state_name.lower().strip().replace(" ", "-")
+
+
+def decode(data: bytes | str | dict, decoder: msgspec.json.Decoder) -> Any:
+    """
+    Decode a state's results, either straight from the JSON the NYT sent or from
+    an already parsed dict, into the type `decoder` decodes.
+
+    Raises:
+        msgspec.ValidationError: If the data doesn't match that type
+    """
+    if isinstance(data, dict):
+        return msgspec.convert(data, decoder.type)
+    return decoder.decode(data)
+
+
+def tally(
+    units: Iterable[tuple[int, Iterable[tuple[str, int]]]],
+    columns: dict[str, int],
+    num_candidates: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Sum the votes in reporting units by county.
+
+    Args:
+        units: Pairs of (three digit county FIPS, the unit's (candidate ID, votes)
+            pairs)
+        columns: The column of each candidate ID we keep. Votes for anyone else
+            are dropped
+        num_candidates: The number of columns
+
+    Returns:
+        The county FIPS which reported, in order, and an array with a row of votes
+            for each of them and `num_candidates` columns
+    """
+    cells, totals, reported = [], [], set()
+    for county, candidates in units:
+        reported.add(county)
+        for candidate, total in candidates:
+            column = columns.get(candidate)
+            if column is not None:
+                cells.append(county * num_candidates + column)
+                totals.append(total)
+
+    votes = np.zeros((NUM_COUNTY_CODES, num_candidates), dtype=np.int64)
+    np.add.at(
+        votes.reshape(-1),
+        np.array(cells, dtype=np.int64),
+        np.array(totals, dtype=np.int64),
+    )
+    counties = np.array(sorted(reported), dtype=np.int64)
+    return counties, votes[counties]
+
+
+@dataclass(frozen=True)
+class Source:
+    """
+    One year of NYT results
+
+    Args:
+        states: The states to pull, each with a `name` and an `abbr`
+        state_url: The URL of a state's results, given its name
+        parse_state: Parses a state's results, given its abbreviation and data
+        vote_fields: The names of the vote columns, in the order `parse_state`
+            returns them
+    """
+
+    states: Sequence[Any]
+    state_url: Callable[[str], str]
+    parse_state: Callable[[str, bytes | str | dict], ParsedState]
+    vote_fields: list[str]
+
+    def combine(self, parsed: Iterable[tuple[str, ParsedState]]) -> pd.DataFrame:
+        """
+        Combine the output of `parse_state` for many states into a table with a
+        column per CountyResult field
+
+        Args:
+            parsed: Pairs of (state abbreviation, what `parse_state` returned for
+                it)
+        """
+        states, fips, names = [], [], []
+        votes = [np.zeros((0, len(self.vote_fields)), dtype=np.int64)]
+        for state, (state_fips, state_names, state_votes) in parsed:
+            states += [state] * len(state_fips)
+            fips += state_fips
+            names += state_names
+            votes.append(state_votes)
+
+        columns = np.concatenate(votes).T
+        return pd.DataFrame(
+            {
+                "state": states,
+                "county": names,
+                "fips": fips,
+                **dict(zip(self.vote_fields, columns)),
+            }
+        )
+
+    def parse_data(self, results: dict[str, bytes | str | dict]) -> pd.DataFrame:
+        """
+        Parse the raw data, keyed by state abbreviation, into a table with a column
+        per CountyResult field. Each state's data may be the JSON the NYT sent or
+        the dict it decodes to.
+        """
+        return self.combine(
+            (state, self.parse_state(state, data)) for state, data in results.items()
+        )
+
+    async def fetch_state(
+        self,
+        session: client.Client,
+        state_name: str,
+        num_attempts: Optional[int] = None,
+    ) -> bytes:
+        """
+        Fetch a particular state's data from the NYT API. The client limits how
+        hard we hit the NYT API (be kind!) and retries failed attempts.
+
+        Args:
+            session: The client in which to fetch the data
+            state_name: The state name spelled like "North Carolina" to pull
+            num_attempts: The maximum number of attempts in case something goes
+                wrong. Defaults to the client's
+
+        Returns:
+            The raw data from the NYT API, undecoded
+        """
+        response = await session.get(
+            self.state_url(state_name), num_attempts=num_attempts
+        )
+        if not response.ok:
+            raise EnvironmentError(
+                f"Got a {response.status} when pulling {state_name} data"
+            )
+        return response.body
+
+    async def fetch_all_states(
+        self,
+        max_connections: Optional[int] = None,
+        num_attempts_per_state: Optional[int] = None,
+    ) -> pd.DataFrame:
+        """
+        Pull and parse the data from _all_ states that vote in the US
+        presidential election from the NYT API. Each state is parsed as soon as it
+        arrives and its raw data dropped, so only the payloads in flight are ever
+        in memory.
+
+        Args:
+            max_connections: The maximum number of connections to the NYT API at a
+                time. Defaults to as many as it keeps up with (see `client`)
+            num_attempts_per_state: The maximum number of pull attempts to make per
+                state before erroring. Defaults to the client's
+
+        Returns:
+            A table with a column per CountyResult field, in the order of `states`
+        """
+        async with client.Client(max_connections=max_connections) as session:
+
+            async def pull(state) -> ParsedState:
+                data = await self.fetch_state(
+                    session, state.name, num_attempts=num_attempts_per_state
+                )
+                return self.parse_state(state.abbr, data)
+
+            parsed = await asyncio.gather(*[pull(state) for state in self.states])
+
+        return self.combine(zip([state.abbr for state in self.states], parsed))
@@ -0,0 +1,258 @@
+"""
+Pulling county populations from the Census API. Every request for every year is
+made concurrently over one client, and every response is cached on disk (the
+decennial counts don't change), so a multi-year build makes a handful of Census
+requests the first time and none after that.
+"""
+
+import asyncio
+import hashlib
+import importlib.resources
+import json
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Optional
+
+import geopandas as gpd
+import pandas as pd
+
+from . import cache, client, profiling
+from .constants import CACHE_DIR
+
+CENSUS_API = "https://api.census.gov/data"
+
+CNTY_1990_URL = "https://www2.cdc.gov/nceh/lead/census90/house11/files/cnty.zip"
+
+# Where raw Census API responses are cached
+RESPONSE_DIR = CACHE_DIR / "census"
+
+
+@dataclass(frozen=True)
+class Query:
+    """
+    A single Census API query for one variable over one geography
+    """
+
+    year: int  # The decennial year
+    dataset: str  # E.g., "dec/pl" or "dec/sf1"
+    variable: str  # E.g., "P1_001N"
+    geography: tuple[tuple[str, str], ...]  # E.g., (("for", "county:*"), ...)
+
+    @property
+    def url(self) -> str:
+        params = "&".join(f"{key}={value}" for key, value in self.geography)
+        return f"{CENSUS_API}/{self.year}/{self.dataset}?get={self.variable}&{params}"
+
+    @property
+    def cache_path(self) -> Path:
+        # Note that the API key is not part of the URL we hash
+        return RESPONSE_DIR / f"{hashlib.sha256(self.url.encode()).hexdigest()}.json"
+
+
+def _counties(year: int, dataset: str, variable: str) -> Query:
+    return Query(year, dataset, variable, (("for", "county:*"), ("in", "state:*")))
+
+
+CT_TRACTS = Query(
+    2020,
+    "dec/pl",
+    "P1_001N",
+    (("for", "tract:*"), ("in", "state:09+county:*")),
+)
+
+
+def decennial_year(year: int) -> int:
+    """
+    The decennial Census whose counts we use for `year`
+    """
+    decennial = ((year - 2) // 10) * 10
+    if decennial not in [1990, 2000, 2010, 2020]:
+        raise ValueError(f"Year must be in [1992, 2032), not {year}")
+    return decennial
+
+
+def queries_for(year: int) -> list[Query]:
+    """
+    The Census API queries needed for the populations of `year`. 1990 needs none
+    as it comes from a CDC extract instead.
+    """
+    decennial = decennial_year(year)
+    if decennial == 2020:
+        queries = [_counties(2020, "dec/pl", "P1_001N")]
+        if year == 2024:
+            queries.append(CT_TRACTS)
+        return queries
+    if decennial in (2000, 2010):
+        return [_counties(decennial, "dec/sf1", "P001001")]
+    return []
+
+
+async def fetch_query(
+    session: client.Client,
+    query: Query,
+    api_key: Optional[str],
+    force: bool = False,
+    num_attempts: Optional[int] = None,
+) -> pd.DataFrame:
+    """
+    Fetch a single query, or read it from the on-disk cache.
+
+    Args:
+        session: The client in which to fetch the data
+        query: The query to make
+        api_key: Your Census API key
+        force: If set, ignore the cache
+        num_attempts: The maximum number of attempts in case something goes wrong.
+            Defaults to the client's
+
+    Returns:
+        The response as a DataFrame with one column per returned field
+    """
+    path = query.cache_path
+    profiling.cache(hit=not force and path.exists())
+    if force or not path.exists():
+        url = query.url + (f"&key={api_key}" if api_key else "")
+        response = await session.get(url, num_attempts=num_attempts)
+        if not response.ok:
+            raise EnvironmentError(f"Got a {response.status} when pulling {query.url}")
+        rows = json.loads(response.body)
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(rows))
+        tmp_path.replace(path)
+
+    rows = json.loads(path.read_text())
+    return pd.DataFrame(rows[1:], columns=rows[0])
+
+
+def read_1990() -> pd.DataFrame:
+    """
+    1990 populations from the CDC's extract of the 1990 SF1, as the Census API's
+    1990 SF1 seems to be down. GDAL reads the DBF straight out of the cached zip.
+    """
+    cnty_zipfile = cache.fetch(CNTY_1990_URL)
+    df = gpd.read_file(f"/vsizip/{cnty_zipfile.resolve()}/CNTY.dbf")
+    return pd.DataFrame(df[["P0010001", "STATEFP", "CNTY"]]).rename(
+        columns={"P0010001": "population", "STATEFP": "state", "CNTY": "county"}
+    )
+
+
+def ct_planning_regions(tracts: pd.DataFrame) -> pd.DataFrame:
+    """
+    Total up 2020 CT tract populations into the planning regions that replaced
+    CT's counties in 2022.
+
+    Args:
+        tracts: The CT_TRACTS response
+
+    Returns:
+        A DataFrame with columns population, state and county
+    """
+    with importlib.resources.open_text(
+        "redraw.resources", "ct2022tractcrosswalk.csv"
+    ) as infile:
+        conv_df = pd.read_csv(infile)
+
+    fips = tracts["state"] + tracts["county"] + tracts["tract"]
+    conv_df["tract_fips_2020"] = "0" + conv_df["tract_fips_2020"].astype(str)
+    conv_df["Tract_fips_2022"] = "0" + conv_df["Tract_fips_2022"].astype(str)
+
+    merged_df = tracts.assign(fips=fips).merge(
+        conv_df, left_on="fips", right_on="tract_fips_2020", how="left", indicator=True
+    )
+    unmatched = merged_df["_merge"] == "left_only"
+    assert merged_df.loc[unmatched, "P1_001N"].astype(int).sum() == 0
+    merged_df = merged_df[merged_df["_merge"] == "both"]
+
+    return (
+        pd.DataFrame(
+            {
+                "population": merged_df["P1_001N"].astype(int),
+                "state": "09",
+                "county": merged_df["Tract_fips_2022"].str[2:5],
+            }
+        )
+        .groupby(["state", "county"])["population"]
+        .sum()
+        .reset_index()
+    )
+
+
+def _assemble(year: int, responses: dict) -> pd.DataFrame:
+    """
+    Turn the responses for `year` into a table with columns population, state and
+    county. `responses` maps each Query (and 1990) to its DataFrame.
+    """
+    if decennial_year(year) == 1990:
+        return responses[1990]
+
+    counties, *rest = queries_for(year)
+    df = responses[counties].rename(columns={counties.variable: "population"})
+    if year == 2024:
+        df = df[df["state"] != "09"]
+        df = pd.concat([df, ct_planning_regions(responses[rest[0]])])
+    return df[["population", "state", "county"]]
+
+
+async def fetch_panel(
+    api_key: Optional[str],
+    years: Iterable[int],
+    max_connections: Optional[int] = None,
+    force: bool = False,
+) -> pd.DataFrame:
+    """
+    Fetch county populations for many years at once. Queries shared between years
+    (e.g., 2020 and 2022 both use the 2020 redistricting file) are made once.
+
+    Args:
+        api_key: Your Census API key
+        years: The years to pull. Each must be in [1992, 2032). 2024 replaces CT's
+            counties with its planning regions.
+        max_connections: The maximum number of connections to the Census API.
+            Defaults to as many as it keeps up with (see `client`)
+        force: If set, ignore cached responses
+
+    Returns:
+        A long DataFrame with columns "year", "id" (the 5-digit county FIPS as a
+            str) and "population" (an int)
+    """
+    years = sorted(set(years))
+    queries = list(dict.fromkeys(q for year in years for q in queries_for(year)))
+
+    async with client.Client(max_connections=max_connections) as session:
+        fetches = [
+            fetch_query(session, query, api_key, force=force) for query in queries
+        ]
+        if any(decennial_year(year) == 1990 for year in years):
+            queries.append(1990)
+            fetches.append(asyncio.to_thread(profiling.inherit(read_1990)))
+        responses = dict(zip(queries, await asyncio.gather(*fetches)))
+
+    frames = []
+    for year in years:
+        df = _assemble(year, responses)
+        frames.append(
+            pd.DataFrame(
+                {
+                    "year": year,
+                    "id": df["state"] + df["county"],
+                    "population": df["population"].astype(int),
+                }
+            )
+        )
+    return pd.concat(frames, ignore_index=True)
+
+
+def pull_panel(
+    api_key: Optional[str],
+    years: Iterable[int],
+    max_connections: Optional[int] = None,
+    force: bool = False,
+) -> pd.DataFrame:
+    """
+    A synchronous version of `fetch_panel`
+    """
+    return asyncio.run(
+        fetch_panel(api_key, years, max_connections=max_connections, force=force)
+    )
@@ -0,0 +1,321 @@
+"""
+Per-stage profiling of builds. Wrap a stage in `stage` and, while a `Profiler` is
+active, it records the stage's wall time, the CPU time of the thread running it,
+the process's peak RSS up to when it finished, the bytes it downloaded, its cache hits
+and misses and whatever row and vertex counts it reports with `count`.
+
+Downloads and cache lookups report themselves (see `downloaded` and `cache`)
+to every stage open on the current thread, so a stage's numbers include those of
+the stages inside it, just as its times do. When nothing is being profiled all
+of these are no-ops.
+
+Work handed to other threads is counted towards the stages that handed it off if
+it's wrapped in `inherit`. Stages which run in worker processes are profiled with
+`submit` and `result`, which send the worker's spans back to the parent's
+profiler.
+"""
+
+import functools
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import Executor, Future
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Optional
+
+import geopandas as gpd
+import shapely
+
+# The counts a stage may report
+COUNTS = ["rows_in", "rows_out", "vertices_in", "vertices_out"]
+
+# ru_maxrss is in bytes on macOS and KiB everywhere else
+_RSS_UNITS = 1 if sys.platform == "darwin" else 1024
+
+
+@dataclass
+class Span:
+    """
+    What we measured about one run of a stage
+    """
+
+    name: str
+    pid: int
+    tid: int
+    depth: int  # The number of stages open on this thread when this one started
+    start: float  # Seconds since the epoch
+    wall: float = 0.0  # Seconds
+    cpu: float = 0.0  # Seconds of CPU time used by the stage's thread
+    # The most the process had resident at any point up to the stage's end, in
+    # bytes. This is a high-water mark for the whole process, not the stage's own
+    process_peak_rss: int = 0
+    downloaded: int = 0  # Bytes
+    cache_hits: int = 0
+    cache_misses: int = 0
+    counts: dict[str, int] = field(default_factory=dict)
+
+
+class Profiler:
+    """
+    Collects spans from every thread of a process
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.spans: list[Span] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def open_spans(self) -> list[Span]:
+        """
+        The spans open on the current thread, outermost first
+        """
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def stage(self, name: str):
+        stack = self.open_spans()
+        span = Span(
+            name=name,
+            pid=os.getpid(),
+            tid=threading.get_native_id(),
+            depth=len(stack),
+            start=time.time(),
+        )
+        stack.append(span)
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield span
+        finally:
+            span.wall = time.perf_counter() - wall
+            span.cpu = time.thread_time() - cpu
+            span.process_peak_rss = (
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _RSS_UNITS
+            )
+            stack.pop()
+            self.extend([span])
+
+    def extend(self, spans: list[Span]):
+        with self._lock:
+            self.spans.extend(spans)
+
+    def to_json(self) -> dict:
+        spans = sorted(self.spans, key=lambda span: (span.start, span.depth))
+        return {
+            "start": self.start,
+            "argv": sys.argv,
+            "spans": [asdict(span) for span in spans],
+        }
+
+    def to_trace_events(self) -> dict:
+        """
+        The spans in Chrome's trace event format, for chrome://tracing or Perfetto
+        """
+        return {
+            "traceEvents": [
+                {
+                    "name": span.name,
+                    "ph": "X",
+                    "ts": (span.start - self.start) * 1e6,
+                    "dur": span.wall * 1e6,
+                    "pid": span.pid,
+                    "tid": span.tid,
+                    "args": {
+                        "cpu": span.cpu,
+                        "process_peak_rss": span.process_peak_rss,
+                        "downloaded": span.downloaded,
+                        "cache_hits": span.cache_hits,
+                        "cache_misses": span.cache_misses,
+                        **span.counts,
+                    },
+                }
+                for span in self.spans
+            ],
+            "displayTimeUnit": "ms",
+        }
+
+
+_profiler: Optional[Profiler] = None
+
+
+def active() -> Optional[Profiler]:
+    return _profiler
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Profile the enclosed block as the stage `name`, if we're profiling
+    """
+    if _profiler is None:
+        yield None
+        return
+    with _profiler.stage(name) as span:
+        yield span
+
+
+def _innermost() -> Optional[Span]:
+    if _profiler is None:
+        return None
+    stack = _profiler.open_spans()
+    return stack[-1] if stack else None
+
+
+def count(**counts: int):
+    """
+    Report counts (see COUNTS) for the innermost stage open on this thread
+    """
+    span = _innermost()
+    if span is not None:
+        span.counts.update({key: int(value) for key, value in counts.items()})
+
+
+def downloaded(num_bytes: int):
+    """
+    Report bytes downloaded to the stages open on this thread
+    """
+    if _profiler is not None:
+        # Stages may be open on several threads at once (see `inherit`)
+        with _profiler._lock:
+            for span in _profiler.open_spans():
+                span.downloaded += num_bytes
+
+
+def cache(hit: bool):
+    """
+    Report a cache hit or miss to the stages open on this thread
+    """
+    if _profiler is not None:
+        with _profiler._lock:
+            for span in _profiler.open_spans():
+                if hit:
+                    span.cache_hits += 1
+                else:
+                    span.cache_misses += 1
+
+
+def inherit(fn: Callable) -> Callable:
+    """
+    Wrap `fn` to run on another thread (e.g., in a thread pool or under
+    `asyncio.to_thread`) inside the stages open on this one, so its downloads,
+    cache lookups and stages count towards them
+    """
+    profiler = _profiler
+    if profiler is None:
+        return fn
+    parents = list(profiler.open_spans())
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        stack = profiler.open_spans()
+        outer = stack[:]
+        stack[:] = parents
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            stack[:] = outer
+
+    return wrapper
+
+
+def num_vertices(gdf: gpd.GeoDataFrame) -> int:
+    return int(shapely.get_num_coordinates(gdf.geometry.values).sum())
+
+
+def num_arc_points(topology: dict) -> int:
+    return sum(len(arc) for arc in topology["arcs"])
+
+
+@dataclass(frozen=True)
+class _Profiled:
+    """
+    What a profiled call in a worker process sends back
+    """
+
+    result: Any
+    spans: list[Span]
+
+
+def _call(name: str, fn: Callable, *args, **kwargs) -> _Profiled:
+    global _profiler
+    _profiler = Profiler()
+    try:
+        with _profiler.stage(name):
+            result = fn(*args, **kwargs)
+        return _Profiled(result, _profiler.spans)
+    finally:
+        _profiler = None
+
+
+def submit(pool: Executor, name: str, fn: Callable, *args, **kwargs) -> Future:
+    """
+    Submit `fn` to a process pool, profiling it as the stage `name` in the worker
+    if we're profiling here. Get its result with `result`.
+    """
+    if _profiler is None:
+        return pool.submit(fn, *args, **kwargs)
+    return pool.submit(_call, name, fn, *args, **kwargs)
+
+
+def result(future: Future) -> Any:
+    """
+    The result of a future from `submit`, adding the worker's spans to ours
+    """
+    value = future.result()
+    if isinstance(value, _Profiled):
+        if _profiler is not None:
+            _profiler.extend(value.spans)
+        value = value.result
+    return value
+
+
+def summary(profiler: Profiler) -> list[str]:
+    """
+    A line per top level stage, for printing at the end of a build
+    """
+    lines = []
+    for span in sorted(profiler.spans, key=lambda span: span.start):
+        if span.depth > 1:
+            continue
+        cache_lookups = span.cache_hits + span.cache_misses
+        lines.append(
+            f"{'  ' * span.depth}{span.name:<{36 - 2 * span.depth}} "
+            f"{span.wall:8.2f}s wall {span.cpu:8.2f}s cpu "
+            f"{span.downloaded / 1024**2:8.1f}MB down "
+            f"{span.cache_hits}/{cache_lookups} cached "
+            f"{span.process_peak_rss / 1024**2:7.0f}MB process peak rss"
+        )
+    return lines
+
+
+@contextmanager
+def profile(filename: Optional[str] = None, trace_filename: Optional[str] = None):
+    """
+    Profile everything in the enclosed block, writing a JSON trace to `filename`
+    and a Chrome trace to `trace_filename`. If neither is set, do nothing.
+
+    Yields:
+        The profiler, or None if we're not profiling
+    """
+    global _profiler
+    if filename is None and trace_filename is None:
+        yield None
+        return
+
+    _profiler = profiler = Profiler()
+    try:
+        yield profiler
+    finally:
+        _profiler = None
+        if filename is not None:
+            with open(filename, "w") as outfile:
+                json.dump(profiler.to_json(), outfile, indent=2)
+        if trace_filename is not None:
+            with open(trace_filename, "w") as outfile:
+                json.dump(profiler.to_trace_events(), outfile)
@@ -0,0 +1,211 @@
+"""
+Incrementally refetching NYT results state by state. For each state we keep the
+validators (ETag / Last-Modified) the NYT gave us along with that state's parsed
+results. Refetches are conditional GETs, so states that haven't changed cost a
+304 and nothing else, and only the states that did change are re-parsed.
+"""
+
+import asyncio
+import json
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from types import ModuleType
+from typing import Optional
+
+import pandas as pd
+
+from . import client, profiling, results
+from .constants import CACHE_DIR
+
+
+@dataclass(frozen=True)
+class Validators:
+    """
+    What a server told us to identify the version of a resource we have
+    """
+
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+    @classmethod
+    def from_headers(cls, headers) -> "Validators":
+        return cls(etag=headers.get("ETag"), last_modified=headers.get("Last-Modified"))
+
+    def headers(self) -> dict[str, str]:
+        """
+        The headers for a conditional GET
+        """
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+async def fetch_if_changed(
+    session: client.Client,
+    url: str,
+    validators: Optional[Validators] = None,
+    num_attempts: Optional[int] = None,
+) -> tuple[Optional[bytes], Validators]:
+    """
+    GET a JSON document, conditionally if we have validators for it. The document
+    is returned undecoded, so each module can decode just the parts it needs.
+
+    Args:
+        session: The client in which to fetch the data
+        url: The URL to fetch
+        validators: The validators of the version we already have, if any
+        num_attempts: The maximum number of attempts in case something goes wrong.
+            Defaults to the client's
+
+    Returns:
+        The document's bytes, or None if it hasn't changed, and its (new)
+            validators
+    """
+    headers = validators.headers() if validators else {}
+    response = await session.get(url, headers=headers, num_attempts=num_attempts)
+    if response.status == 304:
+        return None, validators
+    if not response.ok:
+        raise EnvironmentError(f"Got a {response.status} when pulling {url}")
+    return response.body, Validators.from_headers(response.headers)
+
+
+class StateCache:
+    """
+    The per-state validators and parsed results for one NYT results table, e.g.,
+    "nyt2024", stored in CACHE_DIR / name
+    """
+
+    def __init__(self, name: str, module: ModuleType):
+        self.name = name
+        self.module = module
+        self.root = CACHE_DIR / name
+        self.version = results.parser_version(module)
+
+    @property
+    def validators_path(self) -> Path:
+        return self.root / "validators.json"
+
+    def fragment_path(self, abbr: str) -> Path:
+        return self.root / f"{abbr}.arrow"
+
+    def load_validators(self) -> dict[str, Validators]:
+        try:
+            with open(self.validators_path) as infile:
+                raw = json.load(infile)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        return {abbr: Validators(**value) for abbr, value in raw.items()}
+
+    def save_validators(self, validators: dict[str, Validators]):
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.validators_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as outfile:
+            json.dump(
+                {abbr: asdict(value) for abbr, value in validators.items()}, outfile
+            )
+        tmp_path.replace(self.validators_path)
+
+    def load_fragment(self, abbr: str) -> Optional[pd.DataFrame]:
+        return results.load(self.fragment_path(abbr), self.version)
+
+    def store_fragment(self, abbr: str, data: bytes) -> pd.DataFrame:
+        """
+        Parse a single state's raw data and store the result
+        """
+        df = results.to_frame(
+            self.module.parse_data({abbr: data}), self.module.CountyResult
+        )
+        results.store(self.fragment_path(abbr), self.version, df)
+        return df
+
+
+async def refetch_states(
+    cache: StateCache, max_connections: Optional[int] = None
+) -> tuple[dict[str, pd.DataFrame], bool]:
+    """
+    Refetch every state, conditionally where we have a usable parsed fragment, and
+    re-parse only the states which changed. Each state is parsed as soon as it
+    arrives, while the others are still downloading, and its raw data dropped.
+
+    Returns:
+        [state abbreviation] -> parsed results, and whether any state changed
+    """
+    validators = cache.load_validators()
+    fragments = {abbr: cache.load_fragment(abbr) for abbr in validators}
+
+    async with client.Client(max_connections=max_connections) as session:
+
+        async def refetch(state) -> tuple[Optional[pd.DataFrame], Validators]:
+            # Without a fragment from the current parser, we need the data anyway
+            have = fragments.get(state.abbr) is not None
+            data, state_validators = await fetch_if_changed(
+                session,
+                cache.module.state_url(state.name),
+                validators.get(state.abbr) if have else None,
+            )
+            if data is None:
+                return None, state_validators
+            return cache.store_fragment(state.abbr, data), state_validators
+
+        fetched = await asyncio.gather(
+            *[refetch(state) for state in cache.module.STATES]
+        )
+
+    changed = False
+    for state, (fragment, state_validators) in zip(cache.module.STATES, fetched):
+        if fragment is not None:
+            fragments[state.abbr] = fragment
+            changed = True
+        validators[state.abbr] = state_validators
+
+    cache.save_validators(validators)
+    return {state.abbr: fragments[state.abbr] for state in cache.module.STATES}, changed
+
+
+def load_results(
+    name: str,
+    module: ModuleType,
+    force: bool = False,
+    max_connections: Optional[int] = None,
+) -> pd.DataFrame:
+    """
+    Load the results table `name` (e.g., "nyt2024") pulled by `module`, which must
+    have STATES, `state_url`, `parse_data` and `CountyResult`.
+
+    Without `force`, a cached table from the current parser is returned as is.
+    Otherwise, every state is refetched with conditional GETs, and the table is only
+    rebuilt from the per-state fragments if some state changed.
+
+    Args:
+        name: The name of the table
+        module: The module which pulls and parses the results
+        force: Refetch even if the table is cached
+        max_connections: The maximum number of connections to open to the NYT API.
+            Defaults to as many as it keeps up with (see `client`)
+
+    Returns:
+        The results with one column per `module.CountyResult` field
+    """
+    cache = StateCache(name, module)
+    path = CACHE_DIR / f"{name}.arrow"
+    df = results.load(path, cache.version)
+    if df is not None and not force:
+        profiling.cache(hit=True)
+        return df
+
+    fragments, changed = asyncio.run(
+        refetch_states(cache, max_connections=max_connections)
+    )
+    if df is not None and not changed:
+        profiling.cache(hit=True)
+        return df
+
+    profiling.cache(hit=False)
+    df = pd.concat(fragments.values(), ignore_index=True)
+    df = df.sort_values(list(df.columns), ignore_index=True)
+    results.store(path, cache.version, df)
+    return df
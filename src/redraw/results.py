@@ -0,0 +1,122 @@
+"""
+A versioned, columnar on-disk cache for parsed election results
+"""
+
+import dataclasses
+import hashlib
+import inspect
+from pathlib import Path
+from types import ModuleType
+from typing import Callable, Optional, Union
+
+import pandas as pd
+import pyarrow as pa
+
+from . import profiling
+from .constants import CACHE_DIR
+
+# Bump this if the on-disk layout itself changes
+FORMAT_VERSION = 1
+
+VERSION_KEY = b"redraw_version"
+
+
+def to_frame(parsed: Union[list, pd.DataFrame], cls: type) -> pd.DataFrame:
+    """
+    Convert a list of CountyResult dataclasses into a DataFrame with one column
+    per field. DataFrames are passed through untouched.
+
+    Args:
+        parsed: The parsed results
+        cls: The CountyResult dataclass the results are instances of
+    """
+    if isinstance(parsed, pd.DataFrame):
+        return parsed
+
+    return pd.DataFrame(
+        [dataclasses.astuple(row) for row in parsed],
+        columns=[field.name for field in dataclasses.fields(cls)],
+    )
+
+
+def parser_version(module: ModuleType) -> str:
+    """
+    A hash identifying the parser in `module`. Any change to the module's source,
+    including its CountyResult dataclass, or to that of any module it lists in
+    PARSER_MODULES changes the hash.
+    """
+    digest = hashlib.sha256()
+    digest.update(str(FORMAT_VERSION).encode())
+    for source in [module, *getattr(module, "PARSER_MODULES", [])]:
+        digest.update(inspect.getsource(source).encode())
+    return digest.hexdigest()
+
+
+def load(path: Path, version: str) -> Optional[pd.DataFrame]:
+    """
+    Load a cached table memory-mapped from `path` if it exists and was written by
+    the parser with hash `version`. Otherwise, return None.
+    """
+    if not path.exists():
+        return None
+
+    try:
+        with pa.memory_map(str(path)) as source:
+            reader = pa.ipc.open_file(source)
+            metadata = reader.schema.metadata or {}
+            if metadata.get(VERSION_KEY) != version.encode():
+                return None
+            return reader.read_all().to_pandas()
+    except pa.ArrowInvalid:
+        return None
+
+
+def store(path: Path, version: str, df: pd.DataFrame):
+    """
+    Write `df` to `path` as an uncompressed Arrow IPC file stamped with `version`
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata(
+        {**(table.schema.metadata or {}), VERSION_KEY: version.encode()}
+    )
+
+    tmp_path = path.with_suffix(".tmp")
+    with pa.OSFile(str(tmp_path), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    tmp_path.replace(path)
+
+
+def load_or_build(
+    name: str,
+    module: ModuleType,
+    build: Callable[[], Union[list, pd.DataFrame]],
+    force: bool = False,
+) -> pd.DataFrame:
+    """
+    Load the results table `name` from the cache, rebuilding it with `build` if
+    it's missing, was written by a different version of `module`'s parser, or
+    `force` is set.
+
+    Args:
+        name: The name of the table, e.g., "nyt2020"
+        module: The module whose `CountyResult` and parser produce the table
+        build: Pulls and parses the results
+        force: If set, always rebuild
+
+    Returns:
+        The results with one column per `module.CountyResult` field
+    """
+    path = CACHE_DIR / f"{name}.arrow"
+    version = parser_version(module)
+    if not force:
+        df = load(path, version)
+        if df is not None:
+            profiling.cache(hit=True)
+            return df
+
+    profiling.cache(hit=False)
+    df = to_frame(build(), module.CountyResult)
+    store(path, version, df)
+    return df
@@ -0,0 +1,185 @@
+"""
+The county fixups we make so that votes, populations and geometries line up.
+Each rule is declared once here, compiled into a single FIPS mapping for a year,
+and then applied in one pass to each of votes, populations and geometries.
+"""
+
+from dataclasses import dataclass
+from fnmatch import fnmatchcase
+from typing import Iterable, Optional
+
+import geopandas as gpd
+import pandas as pd
+
+
+@dataclass(frozen=True)
+class CountyRule:
+    """
+    Every county whose FIPS matches `pattern` (a shell-style pattern, e.g., "02???")
+    in the years [since, until] is merged into `target`, or dropped if `target` is
+    None. Merged counties take on `name`.
+    """
+
+    pattern: str
+    target: Optional[str]
+    name: Optional[str] = None
+    since: int = 0
+    until: int = 9999
+    reason: str = ""
+
+    def applies(self, fips: str, year: int) -> bool:
+        return self.since <= year <= self.until and fnmatchcase(fips, self.pattern)
+
+
+# Rules are tried in order and the first match wins
+RULES = [
+    CountyRule(
+        "02???",
+        "02000",
+        "Alaska",
+        reason="Alaska's election districts do not really align with its counties, "
+        "so we treat the whole state as one county",
+    ),
+    CountyRule(
+        "11???",
+        "11001",
+        "Washington",
+        reason="Our convention for the name of DC's county",
+    ),
+    CountyRule(
+        "46113",
+        "46102",
+        "Oglala Lakota",
+        since=2015,
+        reason="Shannon County, SD, was renamed Oglala Lakota County in 2015",
+    ),
+    CountyRule("15005", None, reason="Kalawao County, HI, causes issues"),
+    CountyRule(
+        "51560",
+        None,
+        since=2000,
+        reason="Clifton Forge, VA, reverted to town status in 2001. Notably, it "
+        "does not appear in the MIT election data from 2000 even though it should "
+        "have existed at the time?",
+    ),
+    CountyRule(
+        "36000",
+        "29095",
+        "Jackson",
+        reason="Kansas City, MO, spans parts of four counties. The MIT data reports "
+        "its results separately. We follow what appears to be the New York Times' "
+        "convention and add them to Jackson County's",
+    ),
+    CountyRule(
+        "08014",
+        "08013",
+        "Boulder",
+        since=2001,
+        until=2009,
+        reason="Broomfield County, CO, came into being in 2001, but the Census "
+        "doesn't have easily parsed cartographic boundaries for 2001-2009",
+    ),
+    CountyRule(
+        "[6-9]????",
+        None,
+        reason="Territories and other high FIPS codes have no electors",
+    ),
+]
+
+
+@dataclass(frozen=True)
+class FipsMapping:
+    """
+    The rules compiled for a particular year and set of FIPS codes
+    """
+
+    # FIPS -> the FIPS it should become, or None if it should be dropped.
+    # Only FIPS that change are included.
+    remap: dict[str, Optional[str]]
+
+    # Target FIPS -> the name it should have
+    names: dict[str, str]
+
+    def apply(self, fips: pd.Series) -> pd.Series:
+        """
+        Remap a Series of FIPS. Dropped counties become NaN.
+        """
+        changed = fips.isin(self.remap.keys())
+        return fips.where(~changed, fips.map(self.remap))
+
+
+def compile_rules(
+    year: int, fips: Iterable[str], rules: list[CountyRule] = RULES
+) -> FipsMapping:
+    """
+    Compile `rules` into a single mapping for the FIPS codes that appear in a data
+    set for a particular election year.
+    """
+    remap = {}
+    names = {}
+    for code in set(fips):
+        for rule in rules:
+            if rule.applies(code, year):
+                if rule.target != code:
+                    remap[code] = rule.target
+                if rule.target is not None and rule.name is not None:
+                    names[rule.target] = rule.name
+                break
+    return FipsMapping(remap=remap, names=names)
+
+
+def apply_to_frame(
+    df: pd.DataFrame,
+    year: int,
+    id_col: str,
+    values: list[str],
+    keys: Optional[list[str]] = None,
+    name_col: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Apply the rules for `year` to a table of counts (votes or populations) in one
+    pass: remap FIPS, drop dropped counties, rename merged counties, and total up
+    `values` within each county.
+
+    Args:
+        df: The table to fix
+        year: The election year
+        id_col: The column with the five digit FIPS
+        values: The columns to sum
+        keys: Any additional columns to group by, e.g., party
+        name_col: A column with the county name, if any
+
+    Returns:
+        The fixed table with the same columns as `df` (less any columns which are
+        not keys, names or values)
+    """
+    columns = df.columns
+    mapping = compile_rules(year, df[id_col].unique())
+    df = df.assign(**{id_col: mapping.apply(df[id_col])})
+    df = df[df[id_col].notna()]
+
+    by = (keys or []) + [id_col]
+    if name_col is not None:
+        names = df[id_col].map(mapping.names).fillna(df[name_col])
+        df = df.assign(**{name_col: names})
+        by.append(name_col)
+
+    df = df.groupby(by, sort=False)[values].sum().reset_index()
+    return df[[column for column in columns if column in df.columns]]
+
+
+def apply_to_geometry(gdf: gpd.GeoDataFrame, year: int) -> gpd.GeoDataFrame:
+    """
+    Apply the rules for `year` to a GeoDataFrame with "id" and "name" columns.
+    Everything that needs merging is merged in a single dissolve.
+    """
+    mapping = compile_rules(year, gdf["id"].unique())
+    gdf = gdf.assign(id=mapping.apply(gdf["id"]))
+    gdf = gdf[gdf["id"].notna()]
+
+    targets = {target for target in mapping.remap.values() if target is not None}
+    merging = gdf["id"].isin(targets)
+    merged = gdf[merging].dissolve(by="id").reset_index()
+    merged["name"] = merged["id"].map(mapping.names).fillna(merged["name"])
+
+    return pd.concat([gdf[~merging], merged[gdf.columns]], ignore_index=True)
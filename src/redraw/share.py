@@ -0,0 +1,261 @@
+"""
+Share codes, the `?share=` parameter of the map. A share code run length encodes
+the state of every county, one letter per state, with counties sorted by integer
+id. E.g., "3ab" means the first three counties are in Alabama and the fourth is in
+Alaska. See `getShareUrl` and `execReset` in map.js.
+
+Everything here works in bulk over NumPy arrays against a county index that each
+build writes next to its data file, so decoding never has to sort anything.
+"""
+
+import json
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable
+from urllib.parse import parse_qs, urlparse
+
+import geopandas as gpd
+import numpy as np
+
+from . import electors
+from .constants import STATE_ABBREVS
+from .electors import NO_STATE
+
+LETTERS = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+DEFAULT_BASE_URL = "https://kevinhayeswilson.com/redraw/"
+
+_LETTER_TO_STATE = np.full(128, -1, dtype=np.int64)
+_LETTER_TO_STATE[[ord(letter) for letter in LETTERS]] = np.arange(len(LETTERS))
+
+_RUN = re.compile(r"([0-9]*)([a-zA-Z])")
+_CODE = re.compile(r"(?:[0-9]*[a-zA-Z])*")
+
+
+@dataclass(frozen=True)
+class CountyIndex:
+    """
+    The counties of a year's data file in share code order, along with the values
+    needed to score a map
+    """
+
+    ids: np.ndarray  # (num_counties,) FIPS sorted by integer value
+    states: np.ndarray  # (num_counties,) the state index of each county
+    population: np.ndarray  # (num_counties,)
+    dem: np.ndarray  # (num_counties,)
+    gop: np.ndarray  # (num_counties,)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+def share_order(ids: Iterable) -> np.ndarray:
+    """
+    The permutation that sorts `ids` into share code order
+    """
+    return np.argsort(np.array([int(fips) for fips in ids]), kind="stable")
+
+
+def index_filename(filename: str) -> str:
+    """
+    Where the county index for the data file `filename` lives, e.g.,
+    us2024.json -> us2024.index.json
+    """
+    path = Path(filename)
+    return str(path.with_name(f"{path.stem}.index.json"))
+
+
+def make_index(gdf: gpd.GeoDataFrame) -> CountyIndex:
+    """
+    Build the county index from the final table a build writes
+    """
+    gdf = gdf.iloc[share_order(gdf["id"])]
+    state_index = {abbrev: i for i, abbrev in enumerate(STATE_ABBREVS)}
+
+    def column(name: str) -> np.ndarray:
+        if name not in gdf.columns:
+            return np.zeros(len(gdf), dtype=np.int64)
+        return gdf[name].fillna(0).to_numpy(dtype=np.int64)
+
+    return CountyIndex(
+        ids=gdf["id"].to_numpy(dtype=str),
+        states=gdf["state"].map(state_index).fillna(NO_STATE).to_numpy(dtype=int),
+        population=column("population"),
+        dem=column("dem"),
+        gop=column("gop"),
+    )
+
+
+def write_index(index: CountyIndex, filename: str):
+    """
+    Write a county index as compact, columnar JSON
+    """
+    with open(filename, "w") as outfile:
+        json.dump(
+            {
+                "ids": index.ids.tolist(),
+                "states": index.states.tolist(),
+                "population": index.population.tolist(),
+                "dem": index.dem.tolist(),
+                "gop": index.gop.tolist(),
+            },
+            outfile,
+            separators=(",", ":"),
+        )
+
+
+def read_index(filename: str) -> CountyIndex:
+    with open(filename) as infile:
+        raw = json.load(infile)
+    return CountyIndex(
+        ids=np.array(raw["ids"], dtype=str),
+        states=np.array(raw["states"], dtype=np.int64),
+        population=np.array(raw["population"], dtype=np.int64),
+        dem=np.array(raw["dem"], dtype=np.int64),
+        gop=np.array(raw["gop"], dtype=np.int64),
+    )
+
+
+def is_valid(code: str) -> bool:
+    """
+    Whether `code` is made up only of run lengths and letters
+    """
+    return _CODE.fullmatch(code) is not None
+
+
+def encode_many(states: np.ndarray) -> list[str]:
+    """
+    Encode a batch of maps as share codes.
+
+    Args:
+        states: An integer array of shape (num_maps, num_counties) of state indices
+            in share code order. NO_STATE is encoded as "Z".
+
+    Returns:
+        One share code per map
+    """
+    states = np.atleast_2d(states)
+    num_maps, num_counties = states.shape
+
+    # Find where every run starts in every map at once
+    starts = np.ones(states.shape, dtype=bool)
+    starts[:, 1:] = states[:, 1:] != states[:, :-1]
+    rows, cols = np.nonzero(starts)
+    ends = np.append(cols[1:], num_counties)
+    ends[np.flatnonzero(np.diff(rows))] = num_counties
+    lengths = ends - cols
+    letters = np.array(list(LETTERS))[states[rows, cols]]
+
+    pieces = np.where(lengths > 1, lengths.astype(str), "").astype(object) + letters
+    bounds = np.searchsorted(rows, np.arange(num_maps + 1))
+    return [
+        "".join(pieces[bounds[i] : bounds[i + 1]].tolist()) for i in range(num_maps)
+    ]
+
+
+def encode(states: np.ndarray) -> str:
+    return encode_many(np.asarray(states)[None])[0]
+
+
+def decode_many(codes: list[str], index: CountyIndex) -> np.ndarray:
+    """
+    Decode a batch of share codes as the map would. Counties the code marks with
+    "Z", or leaves off the end, keep their original state, and anything past the
+    last county is ignored.
+
+    Args:
+        codes: Share codes
+        index: The year's county index
+
+    Returns:
+        An int8 array of shape (len(codes), len(index)) of state indices
+
+    Raises:
+        ValueError: If a code has anything other than run lengths and letters
+    """
+    for i, code in enumerate(codes):
+        if not is_valid(code):
+            raise ValueError(f"Malformed share code at position {i}: {code!r}")
+
+    num_counties = len(index)
+    chars = np.frombuffer("".join(codes).encode("ascii"), dtype=np.uint8)
+    lengths = np.array([len(code) for code in codes], dtype=np.int64)
+    code_of_char = np.repeat(np.arange(len(codes)), lengths)
+
+    # Every letter ends a run. The digits before it, if any, are its length.
+    states = _LETTER_TO_STATE[chars]
+    is_letter = states >= 0
+    letters = np.flatnonzero(is_letter)
+    run_of_char = np.cumsum(is_letter) - is_letter
+    digits = np.flatnonzero(~is_letter)
+    exponents = np.minimum(letters[run_of_char[digits]] - digits - 1, 10)
+    values = np.bincount(
+        run_of_char[digits],
+        weights=(chars[digits] - ord("0")) * 10.0**exponents,
+        minlength=len(letters),
+    )
+    has_digits = np.bincount(run_of_char[digits], minlength=len(letters)) > 0
+
+    # Any run that reaches past the last county might as well stop there
+    counts = np.where(has_digits, np.minimum(values, num_counties + 1), 1)
+    counts = counts.astype(np.int64)
+    owners = code_of_char[letters]
+    states = states[letters]
+
+    # Where each run starts within its own code
+    totals = np.bincount(owners, weights=counts, minlength=len(codes))
+    code_starts = np.cumsum(totals).astype(np.int64) - totals.astype(np.int64)
+    starts = np.cumsum(counts) - counts - code_starts[owners]
+
+    # Counties after the end of a code keep their state, as if marked with "Z"
+    sentinels = np.arange(len(codes))
+    owners = np.concatenate([owners, sentinels])
+    starts = np.concatenate([starts, totals.astype(np.int64)])
+    states = np.concatenate([states, np.full(len(codes), NO_STATE)])
+    counts = np.concatenate([counts, np.ones(len(codes), dtype=np.int64)])
+
+    keep = (starts < num_counties) & (counts > 0)
+    owners, starts, states = owners[keep], starts[keep], states[keep]
+    order = np.lexsort((starts, owners))
+    owners, starts, states = owners[order], starts[order], states[order]
+
+    # Mark the change in state at the start of every run, then add them up
+    previous = np.concatenate([[0], states[:-1]])
+    previous[np.flatnonzero(np.diff(owners, prepend=-1))] = 0
+    deltas = np.zeros((len(codes), num_counties), dtype=np.int8)
+    deltas[owners, starts] = states - previous
+    result = np.cumsum(deltas, axis=1, dtype=np.int8)
+
+    return np.where(result == NO_STATE, index.states[None].astype(np.int8), result)
+
+
+def decode(code: str, index: CountyIndex) -> np.ndarray:
+    return decode_many([code], index)[0]
+
+
+def score_many(codes: list[str], index: CountyIndex) -> electors.Outcome:
+    """
+    Decode and score a batch of share codes in one go
+    """
+    return electors.evaluate(
+        decode_many(codes, index), index.population, index.dem, index.gop
+    )
+
+
+def share_url(year: str, states: np.ndarray, base_url: str = DEFAULT_BASE_URL) -> str:
+    """
+    The URL the map would share for `states` in `year` (as the map names years)
+    """
+    return f"{base_url}?year={year}&share={encode(states)}"
+
+
+def parse_url(url: str) -> tuple[str, str]:
+    """
+    Pull the year and share code out of a share URL. A bare share code is returned
+    with an empty year.
+    """
+    if "share=" not in url:
+        return "", url.strip()
+    query = parse_qs(urlparse(url.strip()).query)
+    return query.get("year", [""])[0], query.get("share", [""])[0]
@@ -0,0 +1,422 @@
+"""
+Answering the question the map asks: how few counties can you move to make the
+loser win? Moves are limited to border counties, i.e., a county may move to any
+state it touches. We search with a beam search that keeps state totals up to date
+incrementally, or, optionally, with an integer program solved locally by HiGHS.
+"""
+
+import json
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from . import adjacency, electors, share
+from .constants import STATE_ABBREVS
+from .electors import NO_STATE, NUM_STATES
+
+PARTIES = ("dem", "gop")
+
+# Every state, plus "no state"
+_NUM_LETTERS = NUM_STATES + 1
+
+
+@dataclass(frozen=True)
+class YearData:
+    """
+    The counties of a built data file, sorted by integer id as in share codes
+    """
+
+    ids: np.ndarray  # (num_counties,) FIPS as strings
+    names: np.ndarray  # (num_counties,) county names
+    states: np.ndarray  # (num_counties,) state indices, NO_STATE if none
+    population: np.ndarray  # (num_counties,)
+    dem: np.ndarray  # (num_counties,)
+    gop: np.ndarray  # (num_counties,)
+
+    adjacency: adjacency.Adjacency
+
+    def votes(self, party: str) -> np.ndarray:
+        return self.dem if party == "dem" else self.gop
+
+    def totals(self, states: np.ndarray) -> np.ndarray:
+        """
+        The (3, NUM_STATES) population, dem and gop totals for an assignment
+        """
+        return np.stack(
+            [
+                electors.state_totals(states, values)[0]
+                for values in (self.population, self.dem, self.gop)
+            ]
+        )
+
+
+@dataclass(frozen=True, order=True)
+class Move:
+    county: int  # The county's position in YearData
+    state: int  # The state it moves to
+
+
+@dataclass
+class Solution:
+    moves: list[Move]
+    states: np.ndarray  # The final assignment
+    outcome: electors.Outcome  # The final outcome (a batch of one)
+
+
+def load_year(filename: str) -> YearData:
+    """
+    Load a data file written by a build along with its adjacency index. If the
+    index is missing, we work it out from the data file's arcs.
+    """
+    with open(filename) as infile:
+        topology = json.load(infile)
+
+    geometries = sorted(
+        topology["objects"]["counties"]["geometries"],
+        key=lambda geometry: int(geometry.get("properties", {}).get("id", 0)),
+    )
+    properties = [geometry.get("properties", {}) for geometry in geometries]
+    state_index = {abbrev: i for i, abbrev in enumerate(STATE_ABBREVS)}
+
+    def column(name: str) -> np.ndarray:
+        return np.array([float(props.get(name) or 0) for props in properties])
+
+    ids = np.array([props.get("id", "") for props in properties])
+    states = np.array(
+        [state_index.get(props.get("state"), NO_STATE) for props in properties]
+    )
+
+    index = None
+    index_filename = adjacency.adjacency_filename(filename)
+    if Path(index_filename).exists():
+        index = adjacency.read(index_filename)
+    if index is None or not np.array_equal(index.ids, ids):
+        index = adjacency.from_topology(geometries, states)
+
+    return YearData(
+        ids=ids,
+        names=np.array([props.get("name", "") for props in properties]),
+        states=states,
+        population=column("population"),
+        dem=column("dem"),
+        gop=column("gop"),
+        adjacency=index,
+    )
+
+
+def loser(data: YearData) -> str:
+    """
+    The party which lost the election on the map as it stands
+    """
+    outcome = electors.evaluate(data.states, data.population, data.dem, data.gop)
+    return "dem" if outcome.dem_electors[0] < outcome.gop_electors[0] else "gop"
+
+
+def _wins(outcome: electors.Outcome, party: str) -> np.ndarray:
+    """
+    Whether `party` has strictly more electors in each map
+    """
+    if party == "dem":
+        return outcome.dem_electors > outcome.gop_electors
+    return outcome.gop_electors > outcome.dem_electors
+
+
+def _score(outcome: electors.Outcome, party: str) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Score a batch of outcomes for `party`. The first key is the electoral vote
+    margin. Ties are broken by how cheaply `party` could pick up its next state,
+    i.e., the smallest vote deficit per elector among the states it is losing.
+    """
+    if party == "dem":
+        margin = outcome.dem_electors - outcome.gop_electors
+        deficit = outcome.gop - outcome.dem + 1
+    else:
+        margin = outcome.gop_electors - outcome.dem_electors
+        deficit = outcome.dem - outcome.gop
+
+    losing = (deficit > 0) & (outcome.electors > 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cost = np.where(losing, deficit / outcome.electors, np.inf)
+    return margin, cost.min(axis=1)
+
+
+def border_moves(
+    data: YearData, states: np.ndarray, movable: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Every (county, state) pair where a movable county touches a different state
+
+    Args:
+        data: The year's data
+        states: The current assignment
+        movable: A boolean mask of counties that may move
+
+    Returns:
+        Arrays of counties and the states they may move to
+    """
+    index = data.adjacency
+    sources = np.repeat(np.arange(len(states)), np.diff(index.indptr))
+    destinations = states[index.indices]
+    ok = (
+        movable[sources]
+        & (destinations != states[sources])
+        & (destinations != NO_STATE)
+        & (states[sources] != NO_STATE)
+    )
+    keys = np.unique(sources[ok] * _NUM_LETTERS + destinations[ok])
+    return np.divmod(keys, _NUM_LETTERS)
+
+
+@dataclass
+class _Node:
+    moves: tuple[Move, ...]
+    states: np.ndarray
+    totals: np.ndarray  # (3, NUM_STATES)
+
+
+def _expand(data: YearData, node: _Node) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    The candidate moves out of `node` and the state totals each would produce. Only
+    the two states a move touches change, so we update those rather than
+    recomputing every state.
+    """
+    movable = np.ones(len(node.states), dtype=bool)
+    movable[[move.county for move in node.moves]] = False
+    counties, destinations = border_moves(data, node.states, movable)
+
+    values = np.stack([data.population, data.dem, data.gop])[:, counties].T
+    rows = np.arange(len(counties))
+    totals = np.repeat(node.totals[None], len(counties), axis=0)
+    totals[rows, :, node.states[counties]] -= values
+    totals[rows, :, destinations] += values
+    return counties, destinations, totals
+
+
+def prune(data: YearData, party: str, moves: list[Move]) -> list[Move]:
+    """
+    Greedily drop any moves that aren't needed for `party` to win
+    """
+    moves = list(moves)
+    for move in sorted(moves, key=lambda m: data.population[m.county]):
+        trial = [m for m in moves if m != move]
+        if _wins(evaluate_moves(data, trial).outcome, party)[0]:
+            moves = trial
+    return moves
+
+
+def evaluate_moves(data: YearData, moves: list[Move]) -> Solution:
+    """
+    Apply `moves` to the original map and score the result
+    """
+    states = data.states.copy()
+    for move in moves:
+        states[move.county] = move.state
+    outcome = electors.evaluate(states, data.population, data.dem, data.gop)
+    return Solution(moves=sorted(moves), states=states, outcome=outcome)
+
+
+def beam_search(
+    data: YearData, party: str, beam_width: int = 16, max_moves: int = 30
+) -> Optional[Solution]:
+    """
+    Search for the fewest border moves that make `party` win.
+
+    Each round, every map in the beam is extended by every possible border move, the
+    candidates are scored in one batch, and the best `beam_width` distinct maps are
+    kept. The first round with a winner gives the solution, which is then pruned of
+    any unneeded moves.
+
+    Args:
+        data: The year's data
+        party: "dem" or "gop"
+        beam_width: The number of maps to keep each round. 1 is a greedy search.
+        max_moves: Give up after this many moves
+
+    Returns:
+        The solution, or None if none was found
+    """
+    beam = [_Node(moves=(), states=data.states, totals=data.totals(data.states))]
+    for _ in range(max_moves):
+        expansions = [_expand(data, node) for node in beam]
+        parents = np.repeat(np.arange(len(beam)), [len(e[0]) for e in expansions])
+        if not len(parents):
+            return None
+        counties = np.concatenate([e[0] for e in expansions])
+        destinations = np.concatenate([e[1] for e in expansions])
+        totals = np.concatenate([e[2] for e in expansions])
+
+        outcome = electors.outcome_from_totals(totals[:, 0], totals[:, 1], totals[:, 2])
+        margin, cost = _score(outcome, party)
+        wins = _wins(outcome, party)
+        order = np.lexsort((cost, -margin))
+
+        seen = set()
+        next_beam = []
+        for i in order:
+            move = Move(int(counties[i]), int(destinations[i]))
+            moves = beam[parents[i]].moves + (move,)
+            if frozenset(moves) in seen:
+                continue
+            seen.add(frozenset(moves))
+
+            if wins[i]:
+                return evaluate_moves(data, prune(data, party, list(moves)))
+
+            states = beam[parents[i]].states.copy()
+            states[move.county] = move.state
+            next_beam.append(_Node(moves=moves, states=states, totals=totals[i]))
+            if len(next_beam) >= beam_width:
+                break
+        beam = next_beam
+
+    return None
+
+
+def ilp_search(
+    data: YearData,
+    party: str,
+    time_limit: Optional[float] = None,
+    max_rounds: int = 10,
+) -> Optional[Solution]:
+    """
+    Find the fewest border moves that make `party` win with a mixed integer program.
+
+    Each county may move at most once, to a state it touches on the original map.
+    The program holds the number of electors per state fixed, so its answer is
+    rescored exactly. If moving population changed the apportionment enough that
+    `party` no longer wins, we demand one more elector and try again.
+
+    Requires scipy.
+
+    Args:
+        data: The year's data
+        party: "dem" or "gop"
+        time_limit: The number of seconds to give the solver each round
+        max_rounds: The number of times to retry after apportionment changes
+
+    Returns:
+        The solution, or None if none was found
+    """
+    try:
+        from scipy import optimize, sparse
+    except ImportError as exc:
+        raise ImportError(
+            "The ILP solver requires scipy. Install it with `uv sync --extra solve`"
+        ) from exc
+
+    counties, destinations = border_moves(
+        data, data.states, np.ones(len(data.states), dtype=bool)
+    )
+    sources = data.states[counties]
+    num_moves = len(counties)
+
+    other = "gop" if party == "dem" else "dem"
+    county_margin = data.votes(party) - data.votes(other)
+    totals = electors.outcome_from_totals(*data.totals(data.states))
+    state_margin = (totals.dem - totals.gop)[0] * (1 if party == "dem" else -1)
+    state_electors = totals.electors[0]
+
+    # The state-level rule in map.js: ties go to the Republican
+    needed_margin = 1 if party == "dem" else 0
+    big = np.abs(county_margin).sum() + np.abs(state_margin).max() + 1
+
+    # Variables: one per move, then one per state for whether `party` carries it
+    num_vars = num_moves + NUM_STATES
+    rows = np.arange(num_moves)
+
+    # margin_s + (moves in) - (moves out) + big (1 - y_s) >= needed_margin
+    flows = sparse.coo_matrix(
+        (
+            np.concatenate([county_margin[counties], -county_margin[counties]]),
+            (np.concatenate([destinations, sources]), np.concatenate([rows, rows])),
+        ),
+        shape=(NUM_STATES, num_moves),
+    )
+    carry = sparse.hstack([flows, sparse.diags(np.full(NUM_STATES, -big))])
+
+    # Each county moves at most once
+    once = sparse.coo_matrix(
+        (np.ones(num_moves), (counties, rows)), shape=(len(data.states), num_moves)
+    )
+    once = sparse.hstack([once, sparse.csr_matrix((len(data.states), NUM_STATES))])
+
+    cost = np.concatenate([np.ones(num_moves), np.zeros(NUM_STATES)])
+    integrality = np.ones(num_vars)
+    bounds = optimize.Bounds(0, 1)
+    options = {"time_limit": time_limit} if time_limit else {}
+
+    needed = state_electors.sum() // 2 + 1
+    for _ in range(max_rounds):
+        ev = sparse.csr_matrix(
+            np.concatenate([np.zeros(num_moves), state_electors])[None]
+        )
+        constraints = [
+            optimize.LinearConstraint(
+                carry, needed_margin - big - state_margin, np.inf
+            ),
+            optimize.LinearConstraint(once, 0, 1),
+            optimize.LinearConstraint(ev, needed, np.inf),
+        ]
+        result = optimize.milp(
+            cost,
+            constraints=constraints,
+            integrality=integrality,
+            bounds=bounds,
+            options=options,
+        )
+        if result.x is None:
+            return None
+
+        chosen = np.flatnonzero(result.x[:num_moves] > 0.5)
+        moves = [Move(int(counties[i]), int(destinations[i])) for i in chosen]
+        solution = evaluate_moves(data, moves)
+        if _wins(solution.outcome, party)[0]:
+            return evaluate_moves(data, prune(data, party, moves))
+        needed += 1
+
+    return None
+
+
+def describe(data: YearData, move: Move) -> str:
+    """
+    A human readable description of a move
+    """
+    return (
+        f"{data.names[move.county]} ({data.ids[move.county]}): "
+        f"{STATE_ABBREVS[data.states[move.county]]} -> {STATE_ABBREVS[move.state]}"
+    )
+
+
+def solve(
+    filename: str,
+    party: Optional[str] = None,
+    method: str = "beam",
+    beam_width: int = 16,
+    max_moves: int = 30,
+    time_limit: Optional[float] = None,
+) -> tuple[YearData, str, Optional[Solution]]:
+    """
+    Find the fewest moves that flip the election in a built data file.
+
+    Args:
+        filename: The data file, e.g., public/data/us2024.json
+        party: The party to make win. Defaults to the loser.
+        method: "beam" or "ilp"
+        beam_width: See `beam_search`
+        max_moves: See `beam_search`
+        time_limit: See `ilp_search`
+
+    Returns:
+        The data, the party we solved for, and the solution if one was found
+    """
+    data = load_year(filename)
+    party = party or loser(data)
+    if method == "ilp":
+        return data, party, ilp_search(data, party, time_limit=time_limit)
+    return (
+        data,
+        party,
+        beam_search(data, party, beam_width=beam_width, max_moves=max_moves),
+    )
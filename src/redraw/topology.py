@@ -0,0 +1,494 @@
+"""
+An in-process TopoJSON encoder. This replaces the `geo2topo` / `toposimplify`
+pipeline we used to shell out to and follows their algorithms closely:
+
+    * coordinates are quantized before the topology is computed (`geo2topo -q`),
+    * rings are cut into arcs at junctions and shared arcs are deduplicated,
+    * arcs are simplified with Visvalingam's algorithm weighted by spherical
+      triangle area (`toposimplify -s`), and
+    * small rings which share no arcs with any other ring are dropped
+      (`toposimplify -f`)
+"""
+
+import json
+import math
+from heapq import heapify, heappop, heappush
+from typing import Optional
+
+import geopandas as gpd
+import numpy as np
+import shapely
+
+# Equivalent to `geo2topo -q 1e5`
+QUANTIZATION = 100_000
+
+# Equivalent to `toposimplify -s 1e-7`, in steradians
+MIN_WEIGHT = 1e-7
+
+
+def _quantize(
+    coords: np.ndarray, quantization: int
+) -> tuple[np.ndarray, np.ndarray, dict, list[float]]:
+    """
+    Quantize coordinates onto a `quantization` x `quantization` grid the same way
+    topojson-server does.
+
+    Returns:
+        The quantized x's, the quantized y's, the TopoJSON transform, and the bbox
+    """
+    x0, y0 = coords.min(axis=0)
+    x1, y1 = coords.max(axis=0)
+    kx = (quantization - 1) / (x1 - x0) if x1 > x0 else 1
+    ky = (quantization - 1) / (y1 - y0) if y1 > y0 else 1
+
+    # N.B. Math.round rounds halves up while np.round rounds them to even
+    qx = np.floor((coords[:, 0] - x0) * kx + 0.5).astype(np.int64)
+    qy = np.floor((coords[:, 1] - y0) * ky + 0.5).astype(np.int64)
+
+    transform = {
+        "scale": [float(1 / kx), float(1 / ky)],
+        "translate": [float(x0), float(y0)],
+    }
+    return qx, qy, transform, [float(x0), float(y0), float(x1), float(y1)]
+
+
+def _find_junctions(
+    keys: np.ndarray, starts: np.ndarray, ends: np.ndarray
+) -> np.ndarray:
+    """
+    A point is a junction if it appears more than once with different neighbors,
+    i.e., it's where a shared boundary begins or ends.
+
+    Args:
+        keys: The packed points of every ring, rings laid end to end, without the
+            closing points
+        starts: The index in `keys` at which each ring starts
+        ends: The index in `keys` of the last point of each ring
+
+    Returns:
+        A boolean mask over `keys`
+    """
+    idx = np.arange(len(keys))
+    prev_idx = idx - 1
+    prev_idx[starts] = ends
+    next_idx = idx + 1
+    next_idx[ends] = starts
+
+    prev_keys = keys[prev_idx]
+    next_keys = keys[next_idx]
+    lo = np.minimum(prev_keys, next_keys)
+    hi = np.maximum(prev_keys, next_keys)
+
+    order = np.lexsort((hi, lo, keys))
+    sorted_keys, sorted_lo, sorted_hi = keys[order], lo[order], hi[order]
+    new_triple = np.ones(len(keys), dtype=bool)
+    new_triple[1:] = (
+        (sorted_keys[1:] != sorted_keys[:-1])
+        | (sorted_lo[1:] != sorted_lo[:-1])
+        | (sorted_hi[1:] != sorted_hi[:-1])
+    )
+    triple_keys = sorted_keys[new_triple]
+    unique_keys, counts = np.unique(triple_keys, return_counts=True)
+
+    return np.isin(keys, unique_keys[counts > 1])
+
+
+class _ArcIndex:
+    """
+    Deduplicates arcs, recognizing an arc that has already been seen backwards
+    """
+
+    def __init__(self):
+        self.arcs: list[np.ndarray] = []
+        self._seen: dict[bytes, int] = {}
+
+    def add(self, arc: np.ndarray, reverse: Optional[np.ndarray] = None) -> int:
+        forward_key = arc.tobytes()
+        if forward_key in self._seen:
+            return self._seen[forward_key]
+
+        if reverse is None:
+            reverse = arc[::-1]
+        reverse_key = reverse.tobytes()
+        if reverse_key in self._seen:
+            return ~self._seen[reverse_key]
+
+        self._seen[forward_key] = len(self.arcs)
+        self.arcs.append(arc)
+        return len(self.arcs) - 1
+
+
+def _cut_ring(ring: np.ndarray, junctions: np.ndarray, index: _ArcIndex) -> list[int]:
+    """
+    Cut a ring into arcs at its junctions and return the (possibly negated)
+    indices of those arcs.
+    """
+    if len(junctions) == 0:
+        # No junctions, so the whole ring is one arc. Start it at its smallest point
+        # so that it matches the same ring coming from a neighboring polygon.
+        forward = np.roll(ring, -np.argmin(ring))
+        forward = np.append(forward, forward[0])
+        backward = ring[::-1]
+        backward = np.roll(backward, -np.argmin(backward))
+        backward = np.append(backward, backward[0])
+        return [index.add(forward, backward)]
+
+    ring = np.roll(ring, -junctions[0])
+    junctions = junctions - junctions[0]
+    closed = np.append(ring, ring[0])
+    bounds = list(junctions) + [len(ring)]
+    return [index.add(closed[a : b + 1]) for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+def _edge_terms(lam, sin_phi, cos_phi, i, j):
+    """
+    The contribution of the edge i -> j to d3-geo's spherical area accumulator.
+    Works equally well on scalars and numpy arrays of indices.
+    """
+    d_lam = lam[j] - lam[i]
+    sd_lam = np.where(d_lam >= 0, 1.0, -1.0)
+    ad_lam = sd_lam * d_lam
+    k = sin_phi[i] * sin_phi[j]
+    u = cos_phi[i] * cos_phi[j] + k * np.cos(ad_lam)
+    v = k * sd_lam * np.sin(ad_lam)
+    return np.arctan2(v, u)
+
+
+def _spherical_terms(lon: np.ndarray, lat: np.ndarray):
+    lam = np.radians(lon)
+    phi = np.radians(lat) / 2 + math.pi / 4
+    return lam, np.sin(phi), np.cos(phi)
+
+
+def spherical_ring_area(lon: np.ndarray, lat: np.ndarray) -> float:
+    """
+    The (unsigned) area of a ring on the unit sphere in steradians
+    """
+    lam, sin_phi, cos_phi = _spherical_terms(lon, lat)
+    idx = np.arange(len(lam))
+    area = abs(2 * _edge_terms(lam, sin_phi, cos_phi, idx - 1, idx).sum())
+    return min(area, 4 * math.pi - area)
+
+
+def _triangle_area(lam, sin_phi, cos_phi, a: int, b: int, c: int) -> float:
+    terms = 0.0
+    for i, j in ((a, b), (b, c), (c, a)):
+        d_lam = lam[j] - lam[i]
+        sd_lam = 1.0 if d_lam >= 0 else -1.0
+        ad_lam = sd_lam * d_lam
+        k = sin_phi[i] * sin_phi[j]
+        terms += math.atan2(
+            k * sd_lam * math.sin(ad_lam),
+            cos_phi[i] * cos_phi[j] + k * math.cos(ad_lam),
+        )
+    return abs(2 * terms)
+
+
+def effective_areas(lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+    """
+    Compute Visvalingam effective areas for each point of an arc, following
+    topojson-simplify's `presimplify`. Endpoints get infinite weight and a point
+    never gets a smaller weight than a point removed before it.
+    """
+    n = len(lon)
+    weights = np.full(n, np.inf)
+    if n < 3:
+        return weights
+
+    lam, sin_phi, cos_phi = _spherical_terms(lon, lat)
+    idx = np.arange(1, n - 1)
+    initial = np.abs(
+        2
+        * (
+            _edge_terms(lam, sin_phi, cos_phi, idx - 1, idx)
+            + _edge_terms(lam, sin_phi, cos_phi, idx, idx + 1)
+            + _edge_terms(lam, sin_phi, cos_phi, idx + 1, idx - 1)
+        )
+    )
+
+    lam, sin_phi, cos_phi = lam.tolist(), sin_phi.tolist(), cos_phi.tolist()
+    prev = list(range(-1, n - 1))
+    nxt = list(range(1, n + 1))
+    current = [math.inf] + initial.tolist() + [math.inf]
+    heap = [(area, i) for i, area in enumerate(current[1:-1], start=1)]
+    heapify(heap)
+
+    removed = [False] * n
+    max_area = 0.0
+    while heap:
+        area, i = heappop(heap)
+        if removed[i] or area != current[i]:
+            continue  # A stale entry
+        removed[i] = True
+
+        if area < max_area:
+            area = max_area
+        else:
+            max_area = area
+        weights[i] = area
+
+        p, q = prev[i], nxt[i]
+        nxt[p] = q
+        prev[q] = p
+        if p > 0:
+            current[p] = _triangle_area(lam, sin_phi, cos_phi, prev[p], p, q)
+            heappush(heap, (current[p], p))
+        if q < n - 1:
+            current[q] = _triangle_area(lam, sin_phi, cos_phi, p, q, nxt[q])
+            heappush(heap, (current[q], q))
+
+    return weights
+
+
+def _simplify_arc(arc: np.ndarray, weights: np.ndarray, min_weight: float):
+    keep = weights >= min_weight
+
+    # A closed arc is a whole ring. Unlike toposimplify we never let one collapse
+    # below a triangle, as it may be an enclave's only boundary.
+    if len(arc) >= 4 and arc[0, 0] == arc[-1, 0] and arc[0, 1] == arc[-1, 1]:
+        missing = 4 - keep.sum()
+        if missing > 0:
+            candidates = np.flatnonzero(~keep)
+            keep[candidates[np.argsort(-weights[candidates])[:missing]]] = True
+
+    return arc[keep]
+
+
+def _ring_coordinates(ring: list[int], arcs: list[np.ndarray]) -> np.ndarray:
+    pieces = []
+    for i, ref in enumerate(ring):
+        arc = arcs[ref] if ref >= 0 else arcs[~ref][::-1]
+        pieces.append(arc if i == 0 else arc[1:])
+    return np.concatenate(pieces)
+
+
+def _to_native(value):
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def gdf_to_topology(
+    gdf: gpd.GeoDataFrame,
+    object_name: str = "counties",
+    quantization: int = QUANTIZATION,
+    min_weight: float = MIN_WEIGHT,
+    filter_detached: bool = True,
+) -> dict:
+    """
+    Convert a GeoDataFrame of (Multi)Polygons into a quantized, simplified
+    TopoJSON topology. All non-geometry columns become properties.
+
+    Args:
+        gdf: The GeoDataFrame to convert, in lon/lat
+        object_name: The name of the GeometryCollection in the output
+        quantization: The number of distinct values along each axis
+        min_weight: The minimum spherical area (in steradians) a point must
+            contribute to survive simplification
+        filter_detached: If set, drop rings smaller than `min_weight` which share
+            no arcs with any other ring
+
+    Returns:
+        The topology as a JSON-serializable dict
+    """
+    return gdf_to_levels(
+        gdf,
+        [min_weight],
+        object_name=object_name,
+        quantization=quantization,
+        filter_detached=filter_detached,
+    )[0]
+
+
+def gdf_to_levels(
+    gdf: gpd.GeoDataFrame,
+    min_weights: list[float],
+    object_name: str = "counties",
+    quantization: int = QUANTIZATION,
+    filter_detached: bool = True,
+) -> list[dict]:
+    """
+    Convert a GeoDataFrame into one topology per simplification level. The levels
+    share their geometries and arc numbering and differ only in how many points
+    each arc keeps, so any level's arcs can be swapped into another. Since
+    effective areas only depend on the arcs, points kept at one level are kept
+    at every finer level.
+
+    Args:
+        gdf: The GeoDataFrame to convert, in lon/lat
+        min_weights: The minimum weight of each level. See `gdf_to_topology`.
+        object_name: The name of the GeometryCollection in the output
+        quantization: The number of distinct values along each axis
+        filter_detached: If set, drop rings smaller than the smallest of
+            `min_weights` which share no arcs with any other ring
+
+    Returns:
+        One topology per entry of `min_weights`
+    """
+    geoms = gdf.geometry.values
+    geom_types = shapely.get_type_id(geoms)
+
+    # Explode everything into rings of coordinates
+    parts, part_feature = shapely.get_parts(geoms, return_index=True)
+    rings, ring_part = shapely.get_rings(parts, return_index=True)
+    coords, coord_ring = shapely.get_coordinates(rings, return_index=True)
+    ring_exterior = np.ones(len(rings), dtype=bool)
+    ring_exterior[1:] = ring_part[1:] != ring_part[:-1]
+
+    qx, qy, transform, bbox = _quantize(coords, quantization)
+    bits = max(int(quantization - 1).bit_length(), 1)
+    keys = (qx << bits) | qy
+
+    # Drop consecutive duplicates and each ring's closing point
+    keep = np.ones(len(keys), dtype=bool)
+    keep[1:] = (keys[1:] != keys[:-1]) | (coord_ring[1:] != coord_ring[:-1])
+    keys, coord_ring = keys[keep], coord_ring[keep]
+    is_last = np.ones(len(keys), dtype=bool)
+    is_last[:-1] = coord_ring[1:] != coord_ring[:-1]
+    keys, coord_ring = keys[~is_last], coord_ring[~is_last]
+
+    # Rings which collapsed under quantization can't form a topology
+    ring_lengths = np.bincount(coord_ring, minlength=len(rings))
+    valid = ring_lengths >= 3
+    keep = valid[coord_ring]
+    keys, coord_ring = keys[keep], coord_ring[keep]
+    ring_lengths = ring_lengths[valid]
+    valid_rings = np.flatnonzero(valid)
+
+    ends = np.cumsum(ring_lengths) - 1
+    starts = ends - ring_lengths + 1
+    is_junction = _find_junctions(keys, starts, ends)
+
+    # Cut the rings into deduplicated arcs
+    index = _ArcIndex()
+    ring_arcs = {}
+    for ring_id, start, end in zip(valid_rings, starts, ends):
+        ring = keys[start : end + 1]
+        junctions = np.flatnonzero(is_junction[start : end + 1])
+        ring_arcs[ring_id] = _cut_ring(ring, junctions, index)
+
+    # Simplify each arc for each level. Which rings to keep is decided by the
+    # finest level.
+    mask = (1 << bits) - 1
+    min_weight = min(min_weights)
+    level_arcs = [[] for _ in min_weights]
+    for arc in index.arcs:
+        arc = np.stack([arc >> bits, arc & mask], axis=1)
+        weights = effective_areas(
+            arc[:, 0] * transform["scale"][0] + transform["translate"][0],
+            arc[:, 1] * transform["scale"][1] + transform["translate"][1],
+        )
+        for arcs, level_weight in zip(level_arcs, min_weights):
+            arcs.append(_simplify_arc(arc, weights, level_weight))
+    arcs = level_arcs[min_weights.index(min_weight)]
+
+    # Which rings share arcs with other rings
+    arc_owner = {}
+    for ring_id, refs in ring_arcs.items():
+        for ref in refs:
+            ref = ref if ref >= 0 else ~ref
+            owner = arc_owner.setdefault(ref, ring_id)
+            if owner != ring_id:
+                arc_owner[ref] = -1
+
+    def ring_area(refs: list[int]) -> float:
+        ring_coords = _ring_coordinates(refs, arcs)
+        return spherical_ring_area(
+            ring_coords[:, 0] * transform["scale"][0] + transform["translate"][0],
+            ring_coords[:, 1] * transform["scale"][1] + transform["translate"][1],
+        )
+
+    def keep_ring(refs: list[int]) -> bool:
+        if not filter_detached:
+            return True
+        if any(arc_owner[ref if ref >= 0 else ~ref] == -1 for ref in refs):
+            return True
+        return ring_area(refs) >= min_weight
+
+    # Assemble the polygons of each feature
+    polygons = [[] for _ in range(len(gdf))]
+    dropped = [[] for _ in range(len(gdf))]
+    for ring_id, refs in ring_arcs.items():
+        part_id = ring_part[ring_id]
+        feature_id = part_feature[part_id]
+        if ring_exterior[ring_id]:
+            target = polygons if keep_ring(refs) else dropped
+            target[feature_id].append((part_id, [refs]))
+        elif polygons[feature_id] and polygons[feature_id][-1][0] == part_id:
+            if keep_ring(refs):
+                polygons[feature_id][-1][1].append(refs)
+
+    properties = gdf.drop(columns=gdf.geometry.name).to_dict(orient="records")
+    geometries = []
+    used_arcs = set()
+    for feature_id, props in enumerate(properties):
+        feature_polygons = [rings for _, rings in polygons[feature_id]]
+        if not feature_polygons and dropped[feature_id]:
+            # Never drop a county entirely. Keep its largest piece instead.
+            feature_polygons = [
+                max(dropped[feature_id], key=lambda x: ring_area(x[1][0]))[1]
+            ]
+
+        for polygon in feature_polygons:
+            for refs in polygon:
+                used_arcs.update(ref if ref >= 0 else ~ref for ref in refs)
+
+        props = {key: _to_native(value) for key, value in props.items()}
+        if not feature_polygons:
+            geometries.append({"type": None, "properties": props})
+        elif geom_types[feature_id] == shapely.GeometryType.POLYGON:
+            geometries.append(
+                {"type": "Polygon", "arcs": feature_polygons[0], "properties": props}
+            )
+        else:
+            geometries.append(
+                {"type": "MultiPolygon", "arcs": feature_polygons, "properties": props}
+            )
+
+    # Prune arcs we no longer reference
+    renumber = {old: new for new, old in enumerate(sorted(used_arcs))}
+
+    def remap(ref: int) -> int:
+        return renumber[ref] if ref >= 0 else ~renumber[~ref]
+
+    for geometry in geometries:
+        if geometry["type"] == "Polygon":
+            geometry["arcs"] = [
+                [remap(ref) for ref in ring] for ring in geometry["arcs"]
+            ]
+        elif geometry["type"] == "MultiPolygon":
+            geometry["arcs"] = [
+                [[remap(ref) for ref in ring] for ring in polygon]
+                for polygon in geometry["arcs"]
+            ]
+
+    def encode(arcs: list[np.ndarray]) -> list:
+        encoded_arcs = []
+        for old in sorted(used_arcs):
+            arc = arcs[old]
+            deltas = np.concatenate([arc[:1], np.diff(arc, axis=0)])
+            encoded_arcs.append(deltas.tolist())
+        return encoded_arcs
+
+    return [
+        {
+            "type": "Topology",
+            "bbox": bbox,
+            "transform": transform,
+            "objects": {
+                object_name: {"type": "GeometryCollection", "geometries": geometries}
+            },
+            "arcs": encode(arcs),
+        }
+        for arcs in level_arcs
+    ]
+
+
+def write_topology(topology: dict, filename: str):
+    """
+    Write a topology to disk as compactly as possible
+    """
+    with open(filename, "w") as outfile:
+        json.dump(topology, outfile, separators=(",", ":"))
@@ -0,0 +1,206 @@
+"""
+Recording and replaying everything we download, so builds can run offline.
+
+Every request redraw makes (to the NYT, the Census API, TIGER and the CDC) goes
+through `resolve`. Normally that returns the URL as is. If REDRAW_REPLAY_URL is
+set, e.g., to http://127.0.0.1:8765, it instead points the request at a local
+replay server (see `serve`), so
+
+    https://api.census.gov/data/2020/dec/pl?get=P1_001N&for=county:*
+
+becomes
+
+    http://127.0.0.1:8765/https/api.census.gov/data/2020/dec/pl?get=P1_001N&for=county:*
+
+The server answers from an archive of recorded responses, with their original
+status, content type and validators, and honors conditional requests just as the
+real servers do. When recording, it fetches anything the archive doesn't have
+from the real server and adds it to the archive.
+
+An archive is a zip file. Each request has a small JSON entry keyed by a hash of
+its URL (less any API key) pointing at a body stored by the hash of its contents,
+so identical responses are stored once.
+"""
+
+import asyncio
+import hashlib
+import json
+import zipfile
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import aiohttp
+from aiohttp import web
+
+from .constants import REPLAY_URL
+
+# Query parameters which are credentials rather than part of what we asked for
+SECRET_PARAMS = {"key"}
+
+# The response headers we record and replay
+HEADERS = ["Content-Type", "ETag", "Last-Modified", "Cache-Control"]
+
+
+def resolve(url: str, replay_url: Optional[str] = REPLAY_URL) -> str:
+    """
+    The URL to actually request for `url`: the replay server's, if there is one
+    """
+    if not replay_url:
+        return url
+    parts = urlsplit(url)
+    path = f"/{parts.scheme}/{parts.netloc}{parts.path}"
+    return urlunsplit(
+        urlsplit(replay_url.rstrip("/") + path)._replace(query=parts.query)
+    )
+
+
+def request_key(url: str) -> str:
+    """
+    How we identify a request in an archive: its URL without credentials
+    """
+    parts = urlsplit(url)
+    query = [
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key not in SECRET_PARAMS
+    ]
+    return urlunsplit(parts._replace(query=urlencode(query, safe=":*,")))
+
+
+def _digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+@dataclass(frozen=True)
+class Recording:
+    """
+    A recorded response
+    """
+
+    url: str  # Its request key
+    status: int
+    headers: dict[str, str]
+    body: str  # The name of its body in the archive
+
+
+class Archive:
+    """
+    A zip file of recorded responses
+    """
+
+    def __init__(self, filename: str):
+        self.filename = Path(filename)
+        self.recordings: dict[str, Recording] = {}
+        self._bodies: set[str] = set()
+
+        if self.filename.exists():
+            with zipfile.ZipFile(self.filename) as archive:
+                for name in archive.namelist():
+                    if name.startswith("requests/"):
+                        recording = Recording(**json.loads(archive.read(name)))
+                        self.recordings[recording.url] = recording
+                    else:
+                        self._bodies.add(name)
+
+    def get(self, url: str) -> Optional[Recording]:
+        return self.recordings.get(request_key(url))
+
+    def body(self, recording: Recording) -> bytes:
+        with zipfile.ZipFile(self.filename) as archive:
+            return archive.read(recording.body)
+
+    def add(self, url: str, status: int, headers: dict[str, str], body: bytes):
+        """
+        Record a response. A request which is already recorded keeps its first
+        recording.
+        """
+        key = request_key(url)
+        if key in self.recordings:
+            return
+
+        body_name = f"bodies/{_digest(body)}"
+        recording = Recording(url=key, status=status, headers=headers, body=body_name)
+        with zipfile.ZipFile(
+            self.filename, "a", compression=zipfile.ZIP_DEFLATED, compresslevel=9
+        ) as archive:
+            if body_name not in self._bodies:
+                archive.writestr(body_name, body)
+            archive.writestr(
+                f"requests/{_digest(key.encode())[:32]}.json",
+                json.dumps(asdict(recording)),
+            )
+        self._bodies.add(body_name)
+        self.recordings[key] = recording
+
+
+def _not_modified(request: web.Request, headers: dict[str, str]) -> bool:
+    etag = headers.get("ETag")
+    if etag and request.headers.get("If-None-Match") == etag:
+        return True
+    last_modified = headers.get("Last-Modified")
+    return bool(
+        last_modified and request.headers.get("If-Modified-Since") == last_modified
+    )
+
+
+def make_app(archive: Archive, record: bool = False) -> web.Application:
+    """
+    The replay server for `archive`. If `record` is set, requests which aren't in
+    the archive are fetched from their real servers and recorded.
+    """
+    lock = asyncio.Lock()
+
+    async def fetch(url: str) -> Optional[Recording]:
+        session: aiohttp.ClientSession = app["session"]
+        async with session.get(url) as response:
+            body = await response.read()
+            if not response.ok:
+                return None
+            headers = {
+                name: response.headers[name]
+                for name in HEADERS
+                if name in response.headers
+            }
+        async with lock:
+            await asyncio.to_thread(archive.add, url, response.status, headers, body)
+        return archive.get(url)
+
+    async def handle(request: web.Request) -> web.StreamResponse:
+        # Undo `resolve` on the raw path, so nothing is decoded along the way
+        _, scheme, rest = request.raw_path.split("/", 2)
+        url = f"{scheme}://{rest}"
+
+        recording = archive.get(url)
+        if recording is None and record:
+            recording = await fetch(url)
+        if recording is None:
+            return web.Response(status=404, text=f"{request_key(url)} isn't recorded")
+
+        if _not_modified(request, recording.headers):
+            return web.Response(status=304, headers=recording.headers)
+        body = await asyncio.to_thread(archive.body, recording)
+        return web.Response(
+            status=recording.status, headers=recording.headers, body=body
+        )
+
+    async def open_session(app: web.Application):
+        app["session"] = aiohttp.ClientSession() if record else None
+        yield
+        if app["session"] is not None:
+            await app["session"].close()
+
+    app = web.Application()
+    app.cleanup_ctx.append(open_session)
+    app.router.add_get("/{scheme}/{path:.*}", handle)
+    return app
+
+
+def serve(
+    filename: str, host: str = "127.0.0.1", port: int = 8765, record: bool = False
+):
+    """
+    Serve the archive `filename` until interrupted. See `make_app`.
+    """
+    web.run_app(make_app(Archive(filename), record=record), host=host, port=port)
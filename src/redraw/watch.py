@@ -0,0 +1,249 @@
+"""
+Keeping a built data file up to date on election night. Each cycle refetches
+the NYT's results with conditional requests (see `refetch`) and, if any state
+changed, patches the vote properties of an existing topojson (and its county
+index and attributes) in place, or writes a small delta file, without touching
+any geometry.
+"""
+
+import asyncio
+import dataclasses
+import json
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+import click
+import numpy as np
+import pandas as pd
+
+from . import artifacts, attributes, binary, build, refetch, share, topology
+
+# The properties a results update can change
+VOTE_PROPERTIES = ["dem", "gop", "grn", "lib", "una"]
+
+
+def vote_table(target: build.Target, fragments: dict[str, pd.DataFrame]) -> dict:
+    """
+    Turn per-state results into the vote properties of each county.
+
+    Returns:
+        [county id] -> [property name] -> votes
+    """
+    df = pd.concat(fragments.values(), ignore_index=True)
+    df = build.apply_rules(df, target.year)
+
+    # Reuse the source's renaming to the columns the javascript app expects
+    module = build.SOURCES[target.source]
+    merged = module.merge_data(df, pd.DataFrame({"id": df["fips"]}))
+    for column in VOTE_PROPERTIES:
+        if column not in merged:
+            merged[column] = 0
+
+    merged = merged.set_index("id")[VOTE_PROPERTIES].astype(int)
+    return merged.to_dict(orient="index")
+
+
+def patch_properties(geometries: list[dict], votes: dict) -> dict:
+    """
+    Update the vote properties of topojson geometries in place.
+
+    Returns:
+        [county id] -> [property name] -> new votes, for whatever changed
+    """
+    changes = {}
+    for geometry in geometries:
+        properties = geometry.get("properties", {})
+        new = votes.get(properties.get("id"))
+        if new is None:
+            continue
+        changed = {
+            key: value for key, value in new.items() if properties.get(key) != value
+        }
+        if changed:
+            properties.update(changed)
+            changes[properties["id"]] = changed
+    return changes
+
+
+def _replace(path: Path, write):
+    """
+    Write a file next to `path` and then move it into place, so the web server
+    never serves a partial file
+    """
+    tmp_path = path.with_name(path.name + ".tmp")
+    write(str(tmp_path))
+    os.replace(tmp_path, path)
+
+
+def write_delta(changes: dict, filename: str):
+    """
+    Write the changed vote properties as a small columnar JSON file. Properties
+    which haven't changed are null.
+    """
+    ids = sorted(changes, key=int)
+
+    def write(path: str):
+        with open(path, "w") as outfile:
+            json.dump(
+                {
+                    "updated": int(time.time()),
+                    "ids": ids,
+                    "properties": {
+                        key: [changes[fips].get(key) for fips in ids]
+                        for key in VOTE_PROPERTIES
+                    },
+                },
+                outfile,
+                separators=(",", ":"),
+            )
+
+    _replace(Path(filename), write)
+
+
+def patch_index(filename: str, votes: dict):
+    """
+    Update the dem/gop columns of the data file's county index, if it has one
+    """
+    path = Path(share.index_filename(filename))
+    if not path.exists():
+        return
+
+    index = share.read_index(str(path))
+    updated = {
+        key: np.array(
+            [votes.get(fips, {}).get(key, old) for fips, old in zip(index.ids, values)]
+        )
+        for key, values in (("dem", index.dem), ("gop", index.gop))
+    }
+    index = dataclasses.replace(index, **updated)
+    _replace(path, lambda tmp: share.write_index(index, tmp))
+
+
+def patch_attributes(filename: str, votes: dict):
+    """
+    Update the vote columns of the data file's attributes, if it has any
+    """
+    path = Path(attributes.attributes_filename(filename))
+    if not path.exists():
+        return
+
+    raw = attributes.read(str(path))
+    properties = raw["properties"]
+    for key in VOTE_PROPERTIES:
+        old = properties.get(key, [None] * len(raw["ids"]))
+        properties[key] = [
+            votes.get(fips, {}).get(key, value) for fips, value in zip(raw["ids"], old)
+        ]
+
+    def write(tmp_path: str):
+        with open(tmp_path, "w") as outfile:
+            json.dump(raw, outfile, separators=(",", ":"))
+
+    _replace(path, write)
+
+
+def republish(filename: str, stale: list[str]) -> list[str]:
+    """
+    Publish whichever of the patched data files (topojson, binary and attributes)
+    were published before, and remove what the previous cycle replaced. Anything
+    replaced now is kept for one more cycle so that pages which just read the old
+    manifest can still load.
+
+    Returns:
+        The hashed names this cycle replaced
+    """
+    directory = Path(filename).parent
+    manifest = artifacts.read_manifest(directory)
+    filenames = [
+        filename,
+        attributes.attributes_filename(filename),
+        binary.binary_filename(filename),
+    ]
+    filenames = [name for name in filenames if Path(name).name in manifest]
+    if not filenames:
+        return []
+
+    artifacts.remove(directory, stale)
+    return artifacts.update_manifest(directory, artifacts.publish_all(filenames))
+
+
+def watch(
+    name: str,
+    filename: str,
+    interval: float = 60,
+    delta_filename: Optional[str] = None,
+    max_connections: Optional[int] = None,
+    once: bool = False,
+):
+    """
+    Poll the NYT and patch the vote properties of a built data file.
+
+    Args:
+        name: A key of `build.TARGETS` whose source is the NYT API
+        filename: The data file to patch
+        interval: The number of seconds between polls
+        delta_filename: If set, write every property that has changed since we
+            started here rather than rewriting `filename`
+        max_connections: The maximum number of connections to open to the NYT API.
+            Defaults to as many as it keeps up with (see `client`)
+        once: If set, poll only once, and fail if the poll does. Otherwise, a
+            failed poll is reported and retried at the next interval
+    """
+    target = build.TARGETS[name]
+    module = build.SOURCES[target.source]
+    cache = refetch.StateCache(f"nyt{target.year}", module)
+
+    path = Path(filename)
+    with open(path) as infile:
+        data = json.load(infile)
+    geometries = data["objects"]["counties"]["geometries"]
+    all_changes: dict[str, dict] = {}
+    stale: list[str] = []
+
+    while True:
+        start = time.perf_counter()
+        try:
+            fragments, changed = asyncio.run(
+                refetch.refetch_states(cache, max_connections=max_connections)
+            )
+        except Exception as exc:
+            # A failed or half-published poll shouldn't end the night. Try again
+            # at the next interval.
+            if once:
+                raise
+            click.echo(
+                f"{time.strftime('%H:%M:%S')} poll failed, retrying in "
+                f"{interval:g}s: {exc!r}",
+                err=True,
+            )
+            time.sleep(max(0.0, interval - (time.perf_counter() - start)))
+            continue
+
+        changes = {}
+        if changed:
+            votes = vote_table(target, fragments)
+            changes = patch_properties(geometries, votes)
+
+        if changes:
+            if delta_filename:
+                for fips, changed_properties in changes.items():
+                    all_changes.setdefault(fips, {}).update(changed_properties)
+                write_delta(all_changes, delta_filename)
+            else:
+                _replace(path, lambda tmp: topology.write_topology(data, tmp))
+                binary_path = Path(binary.binary_filename(filename))
+                if binary_path.exists():
+                    _replace(binary_path, lambda tmp: binary.write(data, tmp))
+                patch_index(filename, votes)
+                patch_attributes(filename, votes)
+                stale = republish(filename, stale)
+
+        click.echo(
+            f"{time.strftime('%H:%M:%S')} {len(changes)} counties changed "
+            f"({time.perf_counter() - start:.2f}s)"
+        )
+        if once:
+            return
+        time.sleep(max(0.0, interval - (time.perf_counter() - start)))